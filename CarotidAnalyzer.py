@@ -1,41 +1,48 @@
 import os
 import sys
 import shutil
-import glob
 from collections import OrderedDict
 
 import numpy as np 
-import nrrd
-import pydicom
 import vtk
 from vtk.util.numpy_support import numpy_to_vtk
-from PyQt5.QtCore import QSettings, QVariant, QObject, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QSettings, QVariant, QObject, QThread, QTimer, pyqtSignal
 from PyQt5.QtWidgets import (
     QApplication, QFileDialog, QMainWindow, QMessageBox, 
-    QTreeWidgetItem, QInputDialog, QProgressBar
+    QInputDialog, QProgressBar
 )
-from PyQt5.QtGui import QColor
 
 from defaults import *
 from mainwindow_ui import Ui_MainWindow
 from modules.CropModule import CropModule
+from modules.CaseIndex import CaseIndex, caseFilePath
+from modules.CaseWatcher import CaseWatcher
+from modules.PatientTreeModel import PatientTreeModel, STATUS_FILTERS
+from modules.DICOMReader import readSeries
+from modules.NrrdWriter import writeNrrd
 from modules.CenterlineModule import CenterlineModule
+from modules.CenterlineCache import removeCenterlineCache
 from modules.SegmentationModule import SegmentationModule
 from modules.StenosisClassifier import StenosisClassifier
+from modules.VolumeCache import writeVolumeCache, removeCachedVolume
 
 class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setupUi(self)
-        self.tree_widget_data.setExpandsOnDoubleClick(False)
+        self.tree_view_data.setExpandsOnDoubleClick(False)
+        self.patient_tree_model = PatientTreeModel(self)
+        self.tree_view_data.setModel(self.patient_tree_model)
+        self.tree_view_data.sortByColumn(0, Qt.AscendingOrder)
+        self.combo_box_status_filter.addItems([f[0] for f in STATUS_FILTERS])
 
         # state
         self.unsaved_changes = False
         self.compute_threads_active = 0
         self.working_dir = ""
-        self.patient_data = []
+        self.case_index = None
+        self.case_watcher = None
         self.active_patient_dict = {'patient_ID':None}
-        self.active_patient_tree_widget_item = None
         self.data = []
         self.locations = []
         self.DICOM_source_dir = ""
@@ -72,7 +79,10 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
         self.action_save_and_propagate.triggered.connect(self.saveAndPropagate)
         self.action_quit.triggered.connect(self.close)
         self.button_load_file.clicked.connect(self.loadSelectedPatient)
-        self.tree_widget_data.itemDoubleClicked.connect(self.loadSelectedPatient)
+        self.tree_view_data.doubleClicked.connect(self.loadSelectedPatient)
+        self.line_edit_filter.textChanged.connect(self.filterPatients)
+        self.combo_box_status_filter.currentIndexChanged.connect(self.filterPatients)
+        self.patient_tree_model.rowsInserted.connect(self.patientRowsInserted)
 
         self.crop_module.data_modified.connect(self.changesMade)
         self.crop_module.new_left_volume.connect(self.newLeftVolume)
@@ -81,9 +91,13 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
         self.segmentation_module.segmentation_module_right.data_modified.connect(self.changesMade)
         self.segmentation_module.new_segmentation.connect(self.newSegmentation)
         self.segmentation_module.new_models.connect(self.newModels)
+        self.segmentation_module.thread_started.connect(self.computeThreadStarted)
+        self.segmentation_module.thread_finished.connect(self.computeThreadFinished)
         self.centerline_module.centerline_module_left.data_modified.connect(self.changesMade)
         self.centerline_module.centerline_module_right.data_modified.connect(self.changesMade)
         self.centerline_module.new_centerlines.connect(self.newCenterlines)
+        self.centerline_module.thread_started.connect(self.computeThreadStarted)
+        self.centerline_module.thread_finished.connect(self.computeThreadFinished)
 
         # restore state properties
         settings = QSettings()
@@ -95,13 +109,11 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
             self.setWorkingDir(dir)
  
     
-    def loadNewDICOM(self, data_array): 
-        # get metadata for header/vtkImage
-        dicomdata = pydicom.dcmread(os.path.join(self.DICOM_source_dir, os.listdir(self.DICOM_source_dir)[0]))
+    def loadNewDICOM(self, data_array, geometry): 
+        # metadata for header/vtkImage from the sorted series
         dim_x, dim_y, dim_z = data_array.shape
-        s_z = float(dicomdata[0x0018, 0x0088].value)  # spacing between slices 
-        s_x_y = dicomdata[0x0028, 0x0030].value  # pixel spacing 
-        pos = dicomdata[0x0020, 0x0032].value  # image position
+        s_x, s_y, s_z = geometry['spacing']
+        pos = geometry['origin']
 
         # user input if dicom data should be saved in nrrd
         save_nrrd = QMessageBox.question(self, "Save Full Volume", "Should the full volume be saved in a .nrrd file?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
@@ -113,38 +125,32 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
             header['dimension'] = 3
             header['space'] = 'left-posterior-superior'
             header['sizes'] =  str(dim_x) + ' ' + str(dim_y) + ' ' + str(dim_z) 
-            header['space directions'] = [[s_x_y[0], 0.0, 0.0], [0.0, s_x_y[1], 0.0], [0.0, 0.0, s_z]]
+            header['space directions'] = [[s_x, 0.0, 0.0], [0.0, s_y, 0.0], [0.0, 0.0, s_z]]
             header['kinds'] = ['domain', 'domain', 'domain']
             header['endian'] = 'little'
-            header['encoding'] = 'gzip'
             header['space origin'] = pos
             self.write_nrrd(nrrd_path, data_array, header, filename)
            
         # convert to vtkImage
         image = vtk.vtkImageData()
         image.SetDimensions(dim_x,dim_y,dim_z)
-        image.SetSpacing(s_x_y[0], s_x_y[1], s_z)
+        image.SetSpacing(s_x, s_y, s_z)
         image.SetOrigin(pos)
         vtk_data_array = numpy_to_vtk(data_array.ravel(order='F'))
         image.GetPointData().SetScalars(vtk_data_array)
 
         # update tree widget, load patient
-        self.setWorkingDir(self.working_dir)   
-        for patient in self.patient_data:
-            if patient['patient_ID'] == self.DICOM_patient_ID:
-                self.active_patient_dict = patient
-                self.crop_module.loadPatient(patient, image)
-                self.segmentation_module.loadPatient(patient)
-                self.centerline_module.loadPatient(patient)
-                self.stenosis_classifier.loadPatient(patient)
-                break
-        
-        # set as activated widget
-        for i in range(self.tree_widget_data.topLevelItemCount()):
-                if self.tree_widget_data.topLevelItem(i).text(0) == self.DICOM_patient_ID:
-                    self.active_patient_tree_widget_item = self.tree_widget_data.topLevelItem(i)
-                    break
-        self.setPatientTreeItemColor(self.active_patient_tree_widget_item, COLOR_SELECTED)
+        patient = self.updatePatient(self.DICOM_patient_ID)
+        if patient is not None:
+            self.active_patient_dict = patient
+            self.case_watcher.setActiveCase(patient['patient_ID'])
+            self.crop_module.loadPatient(patient, image)
+            self.segmentation_module.loadPatient(patient)
+            self.centerline_module.loadPatient(patient)
+            self.stenosis_classifier.loadPatient(patient)
+
+        # set as activated patient
+        self.patient_tree_model.setActivePatient(self.DICOM_patient_ID)
 
 
     def write_nrrd(self, path, array, header, filename):
@@ -211,7 +217,7 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
                     self.worker.moveToThread(self.thread)
 
                     self.worker.progress[int, str].connect(self.report_DICOM_Progress)  
-                    self.worker.data_processed[object].connect(self.loadNewDICOM)
+                    self.worker.data_processed[object, object].connect(self.loadNewDICOM)
                     self.worker.finished.connect(self.thread.quit)
                     self.worker.finished.connect(self.worker.deleteLater)
 
@@ -226,79 +232,50 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
         if len(dir) <= 0:
             return
         self.working_dir = dir
-        self.patient_data = []
-        self.tree_widget_data.clear()
-
-        for patient_folder in glob.glob(os.path.join(dir, "case*")):
-            pID = os.path.basename(patient_folder)
-            patient_dict = {}
-            patient_dict['patient_ID'] = pID
-            patient_dict['base_path'] = patient_folder
-
-            def add_if_exists(dict_key, file_tail):
-                path = os.path.join(patient_folder, pID + file_tail)
-                if os.path.exists(path):
-                    patient_dict[dict_key] = path
-                else:
-                    patient_dict[dict_key] = False
-
-            # Fills the patient dict with all existing filepaths.
-            # Non-existing filepaths are marked with 'False'.
-            # First param is the dict key used to retrieve the entry.
-            # Second param is the file tail after patientID.
-            add_if_exists("volume_raw", ".nrrd")
-            add_if_exists("volume_left", "_left.nrrd")
-            add_if_exists("volume_right", "_right.nrrd")
-            add_if_exists("seg_left", "_left.seg.nrrd")
-            add_if_exists("seg_right", "_right.seg.nrrd")
-            add_if_exists("lumen_model_left", "_left_lumen.stl")
-            add_if_exists("lumen_model_right", "_right_lumen.stl")
-            add_if_exists("plaque_model_left", "_left_plaque.stl")
-            add_if_exists("plaque_model_right", "_right_plaque.stl")
-            add_if_exists("centerlines_left", "_left_lumen_centerlines.vtp")
-            add_if_exists("centerlines_right", "_right_lumen_centerlines.vtp")
-            self.patient_data.append(patient_dict)
-
-            entry_volume_raw = ["Full Volume", "", ""]
-            entry_volume_raw[1] = SYM_YES if patient_dict["volume_raw"] else SYM_NO
-            entry_volume_raw[2] = entry_volume_raw[1]
-
-            entry_volume = ["Crop Volume", "", ""]
-            entry_volume[1] = SYM_YES if patient_dict["volume_left"] else SYM_NO
-            entry_volume[2] = SYM_YES if patient_dict["volume_right"] else SYM_NO
-
-            entry_seg = ["Segmentation", "", ""]
-            entry_seg[1] = SYM_YES if patient_dict["seg_left"] else SYM_NO
-            entry_seg[2] = SYM_YES if patient_dict["seg_right"] else SYM_NO
-
-            entry_lumen = ["Lumen Model", "", ""]
-            entry_lumen[1] = SYM_YES if patient_dict["lumen_model_left"] else SYM_NO
-            entry_lumen[2] = SYM_YES if patient_dict["lumen_model_right"] else SYM_NO
-
-            entry_plaque = ["Plaque Model", "", ""]
-            entry_plaque[1] = SYM_YES if patient_dict["plaque_model_left"] else SYM_NO
-            entry_plaque[2] = SYM_YES if patient_dict["plaque_model_right"] else SYM_NO
-
-            entry_centerlines = ["Centerlines", "", ""]
-            entry_centerlines[1] = SYM_YES if patient_dict["centerlines_left"] else SYM_NO
-            entry_centerlines[2] = SYM_YES if patient_dict["centerlines_right"] else SYM_NO
-
-            entry_patient = QTreeWidgetItem([pID, "", ""])
-            entry_patient.addChild(QTreeWidgetItem(entry_volume_raw))
-            entry_patient.addChild(QTreeWidgetItem(entry_volume))
-            entry_patient.addChild(QTreeWidgetItem(entry_seg))
-            entry_patient.addChild(QTreeWidgetItem(entry_lumen))
-            entry_patient.addChild(QTreeWidgetItem(entry_plaque))
-            entry_patient.addChild(QTreeWidgetItem(entry_centerlines))
-            self.tree_widget_data.addTopLevelItem(entry_patient)
-            entry_patient.setExpanded(True)
-        self.tree_widget_data.resizeColumnToContents(0)
-        self.tree_widget_data.resizeColumnToContents(1)
-        self.tree_widget_data.resizeColumnToContents(2)
-
-        if not EXPAND_PATIENTS:
-            for i in range(self.tree_widget_data.topLevelItemCount()):
-                self.tree_widget_data.topLevelItem(i).setExpanded(False)
+        self.case_index = CaseIndex(dir)
+        self.case_index.scan()
+        if self.case_watcher is not None:
+            self.case_watcher.stop()
+            self.case_watcher.deleteLater()
+        self.case_watcher = CaseWatcher(self.case_index, self)
+        self.case_watcher.cases_changed.connect(self.casesChanged)
+        if self.active_patient_dict['patient_ID'] in self.case_index.cases:
+            self.case_watcher.setActiveCase(self.active_patient_dict['patient_ID'])
+        self.patient_tree_model.setCaseIndex(self.case_index)
+        self.tree_view_data.resizeColumnToContents(0)
+
+
+    def updatePatient(self, patient_ID):
+        """
+        Re-indexes the folder of a single case and refreshes only its tree row.
+        Returns the (in place updated) patient dict, None if the case does not exist.
+        """
+        patient_dict = self.case_index.refreshCase(patient_ID)
+        self.patient_tree_model.patientChanged(patient_ID)
+        return patient_dict
+
+
+    def casesChanged(self, patient_IDs):
+        """
+        Applies file system changes made outside of the application (e.g. by other users
+        or tools editing the shared case folders) to the index and the tree view.
+        """
+        for patient_ID in patient_IDs:
+            patient_dict = self.updatePatient(patient_ID)
+            if patient_dict is None and patient_ID == self.active_patient_dict['patient_ID']:
+                self.__unloadActivePatient()
+
+
+    def filterPatients(self):
+        self.patient_tree_model.setFilter(self.line_edit_filter.text(),
+                                          self.combo_box_status_filter.currentIndex())
+
+
+    def patientRowsInserted(self, parent, first, last):
+        # expand case rows as they are fetched, stage rows are then fetched on demand
+        if EXPAND_PATIENTS and not parent.isValid():
+            for row in range(first, last + 1):
+                self.tree_view_data.expand(self.patient_tree_model.index(row, 0))
         
     
     def openWorkingDirDialog(self):
@@ -307,77 +284,63 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
             self.setWorkingDir(dir)
 
 
-    def setPatientTreeItemColor(self, item, color):
-        if item is None:
-            return
-        c = QColor(color[0], color[1], color[2])
-        for i in range(3):
-            item.setBackground(i, c)
-        for i in range(item.childCount()):
-            for j in range(3):
-                item.child(i).setBackground(j, c)
-       
-
     def loadSelectedPatient(self):  
         if self.unsaved_changes:
             return
 
-        # get top parent item
-        selected = self.tree_widget_data.currentItem()
-        if selected == None:
+        # get patient of selected row
+        patient_ID = self.patient_tree_model.patientID(self.tree_view_data.currentIndex())
+        if patient_ID == None:
             return
-            
-        while selected.parent() != None:
-            selected = selected.parent()
-
-        # set colors of last and current item
-        self.setPatientTreeItemColor(self.active_patient_tree_widget_item, COLOR_UNSELECTED)
-        self.setPatientTreeItemColor(selected, COLOR_SELECTED)
-
-        # save selected item, load new patient
-        self.active_patient_tree_widget_item = selected
-        patient_ID = selected.text(0)
-        for patient in self.patient_data:
-            if (patient['patient_ID'] == patient_ID):
-                # update patient in all modules
-                self.active_patient_dict = patient
-                self.__updatePatientInModules()
-                if SHOW_MODEL_MISMATCH_WARNING:
-                    self.__checkSegMatchesModels()
-                break
+
+        # files of inactive cases overwritten in place are not watched
+        if self.case_index.isStale(patient_ID):
+            self.updatePatient(patient_ID)
+
+        # highlight and load new patient
+        self.patient_tree_model.setActivePatient(patient_ID)
+        patient = self.case_index.cases.get(patient_ID)
+        if patient is not None:
+            # update patient in all modules
+            self.active_patient_dict = patient
+            self.__updatePatientInModules()
+            if SHOW_MODEL_MISMATCH_WARNING:
+                self.__checkSegMatchesModels()
 
 
     def deleteSelectedPatient(self):
-        # get selected top parent item
-        selected = self.tree_widget_data.currentItem()
-        if selected == None:
+        # get patient of selected row
+        patient = self.patient_tree_model.patientID(self.tree_view_data.currentIndex())
+        if patient == None:
             return
 
-        while selected.parent() != None: 
-            selected = selected.parent()
-
-        # delete patient dierectory, reset modules and remove patient from tree widget if user confirms patient
-        patient = selected.text(0)
+        # delete patient dierectory, reset modules and remove patient from tree view if user confirms patient
         delete = QMessageBox.question(self,
                                       "Delete patient",
                                       "Do you want to delete the data of " + patient + "?",
                                       QMessageBox.Yes | QMessageBox.No,
                                       QMessageBox.No)
         if delete == QMessageBox.Yes:
-            patient_idx = self.tree_widget_data.indexOfTopLevelItem(selected)
+            if self.case_index.cases[patient]['volume_raw']:
+                removeCachedVolume(self.case_index.cases[patient]['volume_raw'])
             shutil.rmtree(os.path.join(self.working_dir, patient))
-            del self.patient_data[patient_idx]
+            self.case_index.removeCase(patient)
+            self.patient_tree_model.patientChanged(patient)
             if patient == self.active_patient_dict['patient_ID']:
-                self.active_patient_dict = dict.fromkeys(self.active_patient_dict,False)
-                self.__updatePatientInModules()
-                self.active_patient_dict = {}
-                if self.unsaved_changes == True:
-                    self.discardChanges()
-            self.tree_widget_data.takeTopLevelItem(patient_idx)
+                self.__unloadActivePatient()
             
 
     
+    def __unloadActivePatient(self):
+        self.active_patient_dict = dict.fromkeys(self.active_patient_dict,False)
+        self.__updatePatientInModules()
+        self.active_patient_dict = {'patient_ID':None}
+        if self.unsaved_changes == True:
+            self.discardChanges()
+
+
     def __updatePatientInModules(self):
+        self.case_watcher.setActiveCase(self.active_patient_dict['patient_ID'])
         self.crop_module.loadPatient(self.active_patient_dict)
         self.segmentation_module.loadPatient(self.active_patient_dict)
         self.centerline_module.loadPatient(self.active_patient_dict)
@@ -389,10 +352,10 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
         Test if a new patient's segmentation matches the model files.
         They may be out of sync if the segmentation was externally modified.
         """
-        seg_model_left = self.segmentation_module.segmentation_module_left.model_view.smoother_lumen.GetOutput()
+        seg_model_left = self.segmentation_module.segmentation_module_left.model_view.surface_lumen
         cen_model_left = self.centerline_module.centerline_module_left.reader_lumen.GetOutput()
 
-        seg_model_right = self.segmentation_module.segmentation_module_right.model_view.smoother_lumen.GetOutput()
+        seg_model_right = self.segmentation_module.segmentation_module_right.model_view.surface_lumen
         cen_model_right = self.centerline_module.centerline_module_right.reader_lumen.GetOutput()
 
         match = True
@@ -478,6 +441,14 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
         self.action_stenosis_classifier.setEnabled(state)
 
 
+    def computeThreadStarted(self):
+        self.compute_threads_active += 1
+
+
+    def computeThreadFinished(self):
+        self.compute_threads_active -= 1
+
+
     def changesMade(self):
         self.unsaved_changes = True
         self.setModulesClickable(False)
@@ -507,13 +478,7 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
 
     
     def newLeftVolume(self):
-        patient_ID = self.active_patient_dict['patient_ID']
-        base_path  = self.active_patient_dict['base_path']
-        path_left = os.path.join(base_path, patient_ID + "_left.nrrd")
-        seg_item = self.active_patient_tree_widget_item.child(1)
-        if os.path.exists(path_left):
-            self.active_patient_dict['volume_left'] = path_left
-            seg_item.setText(1, SYM_YES)
+        self.updatePatient(self.active_patient_dict['patient_ID'])
 
         # propagate
         self.segmentation_module.patient_dict = self.active_patient_dict
@@ -524,13 +489,7 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
 
 
     def newRightVolume(self):
-        patient_ID = self.active_patient_dict['patient_ID']
-        base_path  = self.active_patient_dict['base_path']
-        path_right = os.path.join(base_path, patient_ID + "_right.nrrd")
-        seg_item = self.active_patient_tree_widget_item.child(1)
-        if os.path.exists(path_right):
-            self.active_patient_dict['volume_right'] = path_right
-            seg_item.setText(2, SYM_YES)
+        self.updatePatient(self.active_patient_dict['patient_ID'])
 
         # propagate
         self.segmentation_module.patient_dict = self.active_patient_dict
@@ -541,40 +500,15 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
 
 
     def newSegmentation(self):
-        patient_ID = self.active_patient_dict['patient_ID']
-        base_path  = self.active_patient_dict['base_path']
-        path_left = os.path.join(base_path, patient_ID + "_left.seg.nrrd")
-        path_right = os.path.join(base_path, patient_ID + "_right.seg.nrrd")
-        seg_item = self.active_patient_tree_widget_item.child(2)
-        if os.path.exists(path_left):
-            self.active_patient_dict['seg_left'] = path_left
-            seg_item.setText(1, SYM_YES)
-        if os.path.exists(path_right):
-            self.active_patient_dict['seg_right'] = path_right
-            seg_item.setText(2, SYM_YES)
+        self.updatePatient(self.active_patient_dict['patient_ID'])
 
     
     def newModels(self):
+        # tessellations of the old lumen models
         patient_ID = self.active_patient_dict['patient_ID']
-        base_path  = self.active_patient_dict['base_path']
-        path_left_lumen = os.path.join(base_path, patient_ID + "_left_lumen.stl")
-        path_left_plaque = os.path.join(base_path, patient_ID + "_left_plaque.stl")
-        path_right_lumen = os.path.join(base_path, patient_ID + "_right_lumen.stl")
-        path_right_plaque = os.path.join(base_path, patient_ID + "_right_plaque.stl")
-        lumen_item = self.active_patient_tree_widget_item.child(3)
-        plaque_item = self.active_patient_tree_widget_item.child(4)
-        if os.path.exists(path_left_lumen):
-            self.active_patient_dict['lumen_model_left'] = path_left_lumen
-            lumen_item.setText(1, SYM_YES)
-        if os.path.exists(path_left_plaque):
-            self.active_patient_dict['plaque_model_left'] = path_left_plaque
-            plaque_item.setText(1, SYM_YES)
-        if os.path.exists(path_right_lumen):
-            self.active_patient_dict['lumen_model_right'] = path_right_lumen
-            lumen_item.setText(2, SYM_YES)
-        if os.path.exists(path_right_plaque):
-            self.active_patient_dict['plaque_model_right'] = path_right_plaque
-            plaque_item.setText(2, SYM_YES)
+        for side in ("left", "right"):
+            removeCenterlineCache(caseFilePath(self.working_dir, patient_ID, "lumen_model_" + side))
+        self.updatePatient(patient_ID)
 
         # propagate
         self.centerline_module.loadPatient(self.active_patient_dict)
@@ -584,15 +518,6 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
     def newCenterlines(self):
         patient_ID = self.active_patient_dict['patient_ID']
         base_path  = self.active_patient_dict['base_path']
-        path_left = os.path.join(base_path, patient_ID + "_left_lumen_centerlines.vtp")
-        path_right = os.path.join(base_path, patient_ID + "_right_lumen_centerlines.vtp")
-        centerlines_item = self.active_patient_tree_widget_item.child(5)
-        if os.path.exists(path_left):
-            self.active_patient_dict['centerlines_left'] = path_left
-            centerlines_item.setText(1, SYM_YES)
-        if os.path.exists(path_right):
-            self.active_patient_dict['centerlines_right'] = path_right
-            centerlines_item.setText(2, SYM_YES)
 
         # delete meta information files for stenoses if they exist
         meta_path_left = os.path.join(base_path, patient_ID + "_left_meta.txt")
@@ -601,6 +526,7 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
             os.remove(meta_path_left)
         if os.path.exists(meta_path_right):
             os.remove(meta_path_right)
+        self.updatePatient(patient_ID)
 
         # propagate
         self.stenosis_classifier.loadPatient(self.active_patient_dict)
@@ -653,29 +579,21 @@ class CarotidAnalyzer(QMainWindow, Ui_MainWindow):
 class DICOMReaderWorker(QObject):  
     finished = pyqtSignal()
     progress = pyqtSignal(int, str)
-    data_processed = pyqtSignal(object)
+    data_processed = pyqtSignal(object, object)
     source_dir = None 
    
 
     def run(self):
-        data = []
-        locations = []
-        path = os.listdir(self.source_dir)
-        for idx, file in enumerate(path):
-            # read in each dcm and save pixel data, emit progress and data when finished 
-            self.progress.emit(idx, "Loading " + file)
-            ds = pydicom.dcmread(os.path.join(self.source_dir, file))
-            hu = pydicom.pixel_data_handlers.util.apply_modality_lut(ds.pixel_array, ds)
-            locations.append(ds[0x0020, 0x1041].value) # slice location
-            data.append(hu)
-
-        # sort slices if required
-        self.progress.emit(idx + 1, "Sorting slices...")
-        if not (all(locations[i] <= locations[i + 1] for i in range(len(locations)-1))):
-            data = [x for _, x in sorted(zip(locations, data))] 
-        data_array = np.transpose(np.array(data, dtype=np.int16))
-
-        self.data_processed.emit(data_array)
+        paths = [os.path.join(self.source_dir, f) for f in os.listdir(self.source_dir)]
+
+        # read headers to sort slices, then decode in parallel
+        self.progress.emit(0, "Reading headers...")
+        data_array, geometry = readSeries(
+            paths, DICOM_READER_THREADS,
+            progress=lambda idx, file: self.progress.emit(idx + 1, "Loading " + file)
+        )
+
+        self.data_processed.emit(data_array, geometry)
         self.finished.emit()
 
 
@@ -687,8 +605,17 @@ class NrrdWriterWorker(QObject):
     header = None 
    
     def run(self): 
-        nrrd.write(self.path, self.array, self.header)
-        self.finished.emit()
+        try:
+            writeNrrd(self.path, self.array, self.header)
+            if USE_VOLUME_CACHE:
+                try:
+                    writeVolumeCache(self.path, self.array,
+                                     np.diagonal(self.header['space directions']),
+                                     self.header['space origin'])
+                except OSError:
+                    pass # the cache is optional
+        finally:
+            self.finished.emit()
         
 
 
@@ -700,4 +627,7 @@ if __name__ == "__main__":
     app.setStyle("Fusion")
     win = CarotidAnalyzer()
     win.show()
+    if WARM_UP_PREDICTOR:
+        # load the CNN once the window is on screen
+        QTimer.singleShot(0, win.segmentation_module.predictor_service.warmUp)
     sys.exit(app.exec())
\ No newline at end of file
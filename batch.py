@@ -0,0 +1,219 @@
+"""
+Headless batch processing of a working directory:
+crop -> CNN segmentation -> models -> centerlines.
+
+Stages are only run if their outputs are missing or older than their inputs.
+Cases are processed concurrently in a process pool.
+
+Usage:
+    python batch.py <working dir> [--cases case01 case02] [--stages segmentation models] [--workers 4] [--force]
+"""
+import os
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from defaults import *
+from modules.CaseIndex import CaseIndex, caseFilePath
+from modules.PredictorService import PredictorService
+
+STAGES = ["crop", "segmentation", "models", "centerlines"]
+SIDES = ["left", "right"]
+
+predictor_service = PredictorService() # one predictor per worker process, loaded on first segmentation
+
+
+def isStale(inputs, outputs, force=False):
+    """
+    True if any output is missing or older than any input.
+    Missing inputs make a stage not runnable (False).
+    """
+    if not all(os.path.exists(p) for p in inputs):
+        return False
+    if force or not all(os.path.exists(p) for p in outputs):
+        return True
+    newest_input = max(os.stat(p).st_mtime for p in inputs)
+    oldest_output = min(os.stat(p).st_mtime for p in outputs)
+    return oldest_output < newest_input
+
+
+def runCrop(working_dir, patient_ID, side, force):
+    from modules.Pipeline import cropParameters, cropVolume, readImage, writeCropVolume
+    path_raw = caseFilePath(working_dir, patient_ID, "volume_raw")
+    path_crop = caseFilePath(working_dir, patient_ID, "volume_" + side)
+
+    # the crop region is set by hand, only existing crops can be repeated on a new full volume
+    if not os.path.exists(path_crop):
+        return "no crop region"
+    if not isStale([path_raw], [path_crop], force):
+        return None
+    image, _ = readImage(path_raw)
+    center, z_height = cropParameters(image, path_crop)
+    writeCropVolume(cropVolume(image, center, z_height), path_crop)
+    return "done"
+
+
+def runSegmentation(working_dir, patient_ID, sides, force):
+    """
+    CNN segmentation of all stale sides of a case in one batched prediction.
+    Returns {side: status}.
+    """
+    from modules.Pipeline import readImage, fitLabelMap, writeSegmentation
+    stale_sides = [side for side in sides if isStale(
+        [caseFilePath(working_dir, patient_ID, "volume_" + side)],
+        [caseFilePath(working_dir, patient_ID, "seg_" + side)], force)]
+    images = {}
+
+    def volumes():
+        # files are read lazily by the prefetch thread of predict_many
+        for side in stale_sides:
+            image, image_data = readImage(caseFilePath(working_dir, patient_ID, "volume_" + side))
+            images[side] = image
+            yield image_data
+
+    status = {}
+    for side, prediction in zip(stale_sides, predictor_service.get().predict_many(volumes())):
+        image = images.pop(side)
+        label_map_data = fitLabelMap(prediction, image.GetDimensions())
+        writeSegmentation(label_map_data, image.GetSpacing(), image.GetOrigin(),
+                          caseFilePath(working_dir, patient_ID, "seg_" + side))
+        status[side] = "done"
+    return status
+
+
+def runModels(working_dir, patient_ID, side, force):
+    from modules.Pipeline import readImage, extractSurface, writeSTL
+    from modules.CenterlineCache import removeCenterlineCache
+    path_seg = caseFilePath(working_dir, patient_ID, "seg_" + side)
+    path_lumen = caseFilePath(working_dir, patient_ID, "lumen_model_" + side)
+    path_plaque = caseFilePath(working_dir, patient_ID, "plaque_model_" + side)
+
+    # plaque can be empty (no file), the lumen model decides staleness
+    if not isStale([path_seg], [path_lumen], force):
+        return None
+    label_map, _ = readImage(path_seg)
+    removeCenterlineCache(path_lumen) # tessellation of the old lumen model
+    if not writeSTL(extractSurface(label_map, LABEL_LUMEN), path_lumen):
+        return "empty lumen"
+    if not writeSTL(extractSurface(label_map, LABEL_PLAQUE), path_plaque) and os.path.exists(path_plaque):
+        os.remove(path_plaque) # outdated plaque model
+    return "done"
+
+
+def runCenterlines(working_dir, patient_ID, side, force):
+    from modules.Pipeline import readSTL, readCenterlines, centerlineEndPoints, computeCenterlines, writeCenterlines
+    from modules.CenterlineSeeds import cropBox, detectSeeds
+    path_lumen = caseFilePath(working_dir, patient_ID, "lumen_model_" + side)
+    path_centerlines = caseFilePath(working_dir, patient_ID, "centerlines_" + side)
+    if not isStale([path_lumen], [path_centerlines], force):
+        return None
+
+    # seeds are taken from the existing centerlines, otherwise detected on the crop box faces
+    surface = readSTL(path_lumen)
+    if os.path.exists(path_centerlines):
+        source, targets = centerlineEndPoints(readCenterlines(path_centerlines))
+    else:
+        box = None
+        for key in ("volume_" + side, "seg_" + side):
+            if os.path.exists(caseFilePath(working_dir, patient_ID, key)):
+                box = cropBox(caseFilePath(working_dir, patient_ID, key))
+                break
+        source, targets = detectSeeds(surface, box)
+    if source is None or len(targets) == 0:
+        return "no seed points"
+    centerlines = computeCenterlines(surface, source, targets, path_lumen)
+    writeCenterlines(centerlines, path_centerlines)
+
+    # stenosis meta information refers to the old centerlines
+    meta_path = os.path.join(working_dir, patient_ID, patient_ID + "_" + side + "_meta.txt")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    return "done"
+
+
+STAGE_FUNCTIONS = {
+    "crop": runCrop,
+    "models": runModels,
+    "centerlines": runCenterlines,
+}
+
+
+def processCase(working_dir, patient_ID, stages, force=False):
+    """
+    Runs all requested stages of one case in order. Executed in a worker process.
+    Returns a list of (stage, side, status) for stages that did something or could not run.
+    """
+    report = []
+    for stage in stages:
+        if stage == "segmentation":
+            # both sides go through the CNN as one batch, they share the stage runtime
+            t0 = time.perf_counter()
+            try:
+                status = runSegmentation(working_dir, patient_ID, SIDES, force)
+            except Exception:
+                status = {"-": "failed\n" + traceback.format_exc()}
+        else:
+            status = {}
+            for side in SIDES:
+                t0 = time.perf_counter()
+                try:
+                    status[side] = STAGE_FUNCTIONS[stage](working_dir, patient_ID, side, force)
+                except Exception:
+                    status[side] = "failed\n" + traceback.format_exc()
+                if status[side] == "done":
+                    status[side] = "done ({:.1f} s)".format(time.perf_counter() - t0)
+        for side, side_status in status.items():
+            if side_status is not None:
+                if side_status == "done":
+                    side_status = "done ({:.1f} s)".format(time.perf_counter() - t0)
+                report.append((stage, side, side_status))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the CarotidAnalyzer pipeline on all cases of a working directory.")
+    parser.add_argument("working_dir", help="directory containing the case* folders")
+    parser.add_argument("--cases", nargs="+", help="patient IDs to process (default: all cases)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to run (default: all)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="number of worker processes (0 -> all cores)")
+    parser.add_argument("--force", action="store_true", help="run stages even if their outputs are up to date")
+    args = parser.parse_args(argv)
+
+    case_index = CaseIndex(args.working_dir)
+    case_index.scan()
+    patient_IDs = args.cases if args.cases else list(case_index.cases.keys())
+    missing = [pID for pID in patient_IDs if pID not in case_index.cases]
+    if missing:
+        print("Unknown cases: " + ", ".join(missing))
+        patient_IDs = [pID for pID in patient_IDs if pID in case_index.cases]
+    stages = [s for s in STAGES if s in args.stages] # keep pipeline order
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    # spawn: no forked CUDA/VTK state in the workers
+    t0 = time.perf_counter()
+    failed = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(processCase, args.working_dir, pID, stages, args.force): pID
+                   for pID in patient_IDs}
+        for future in as_completed(futures):
+            pID = futures[future]
+            try:
+                report = future.result()
+            except Exception as e: # worker died
+                report = [("all", "-", "failed: " + str(e))]
+            if not report:
+                print(pID + ": up to date")
+            for stage, side, status in report:
+                print("{}: {} {} {}".format(pID, stage, side, status))
+                failed += status.startswith("failed")
+    print("Processed {} cases in {:.1f} s, {} stages failed.".format(
+        len(patient_IDs), time.perf_counter() - t0, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,37 @@ SYM_UNSAVED_CHANGES = "\u25CF"
 # global execution flags
 EXPAND_PATIENTS = True
 SHOW_MODEL_MISMATCH_WARNING = False
+WARM_UP_PREDICTOR = True # load the segmentation CNN in the background after start (else on first use)
 
 # global parameter constants
-MIN_CLUSTER_SIZE = 20000 # minimal cluster size (voxels) computed by automatic segmentation
\ No newline at end of file
+MIN_CLUSTER_SIZE = 20000 # minimal cluster size (voxels) computed by automatic segmentation
+DICOM_READER_THREADS = 0 # number of threads decoding DICOM slices (0 -> all cores)
+USE_VOLUME_CACHE = True # keep uncompressed, memory-mapped copies of full volumes
+VOLUME_CACHE_MAX_SIZE = 4 * 1024**3 # maximal size (bytes) of the volume cache per working directory
+NRRD_ENCODING = 'gzip' # encoding of written .nrrd files ('raw' or 'gzip')
+NRRD_COMPRESSION_LEVEL = 1 # gzip level of written .nrrd files (1 fastest, 9 smallest)
+NRRD_WRITE_THREADS = 0 # number of threads compressing .nrrd files (0 -> all cores)
+NRRD_GZIP_CHUNK_SIZE = 4 * 1024**2 # bytes per independently compressed gzip chunk
+CASE_WATCHER_DEBOUNCE_MS = 500 # bursts of file system events within this time are applied at once
+PATIENT_TREE_FETCH_SIZE = 200 # number of cases added to the data inspector per fetch
+CROP_Z_HEIGHT = 124 # default height (voxels) of the crop VOI in the full volume
+BATCH_WORKERS = 2 # worker processes of batch.py, each holds its own CNN (0 -> all cores)
+INFERENCE_MEMORY_BUDGET = 2 * 1024**3 # bytes available for one batched CNN forward pass
+INFERENCE_BYTES_PER_VOXEL = 256 # estimated UNet activation memory per input voxel
+INFERENCE_BACKEND = 'eager' # CNN forward pass: 'eager', 'torchscript' or 'onnx' (CPU, needs onnxruntime)
+INFERENCE_CHANNELS_LAST = False # channels-last 3D memory format for CPU inference
+INFERENCE_THREADS = 0 # intra-op threads of the CNN forward pass (0 -> library default)
+SURFACE_UPDATE_DEBOUNCE_MS = 150 # edits within this time trigger one background surface extraction
+SURFACE_BRICK_SIZE = 32 # marching cubes cells per brick and axis of the incremental surface extraction
+LABEL_PLAQUE = 1 # label map value of plaque voxels
+LABEL_LUMEN = 2 # label map value of lumen voxels
+UNDO_MEMORY_LIMIT = 64 * 1024**2 # bytes of compressed undo steps per side, oldest steps are dropped
+USE_CENTERLINE_CACHE = True # keep vmtk Delaunay tessellation/Voronoi diagram next to lumen models
+CENTERLINE_PRECONDITIONING = None # lumen surface preconditioning before centerline computation: None, 'decimate' or 'remesh'
+CENTERLINE_DECIMATION_REDUCTION = 0.75 # target fraction of triangles removed by the 'decimate' preconditioning
+CENTERLINE_PRECONDITIONING_TOLERANCE = 0.1 # maximal vertex deviation (mm) of the 'decimate' preconditioning
+CENTERLINE_REMESH_EDGE_LENGTH = 0.5 # target edge length (mm) of the 'remesh' preconditioning
+CENTERLINE_SEED_CAP_DISTANCE = 0.5 # maximal distance (mm) of automatic seed caps to the crop box faces
+CENTERLINE_SEED_MIN_CAP_AREA = 2.0 # caps (mm^2) below this area are not used as automatic seeds
+STENOSIS_REPORT_THRESHOLD = 0.8 # automatic stenosis detection: ranges below this fraction of the median segment diameter
+CENTERLINE_MERGE_TOLERANCE = 1e-4 # centerline points closer than this (mm) belong to a shared branch section
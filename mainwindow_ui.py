@@ -83,23 +83,33 @@ class Ui_MainWindow(object):
         self.verticalLayout = QtWidgets.QVBoxLayout(self.data_inspector_contents)
         self.verticalLayout.setContentsMargins(1, 1, 1, 1)
         self.verticalLayout.setObjectName("verticalLayout")
-        self.tree_widget_data = QtWidgets.QTreeWidget(self.data_inspector_contents)
+        self.layout_filter = QtWidgets.QHBoxLayout()
+        self.layout_filter.setObjectName("layout_filter")
+        self.line_edit_filter = QtWidgets.QLineEdit(self.data_inspector_contents)
+        self.line_edit_filter.setClearButtonEnabled(True)
+        self.line_edit_filter.setObjectName("line_edit_filter")
+        self.layout_filter.addWidget(self.line_edit_filter)
+        self.combo_box_status_filter = QtWidgets.QComboBox(self.data_inspector_contents)
+        self.combo_box_status_filter.setObjectName("combo_box_status_filter")
+        self.layout_filter.addWidget(self.combo_box_status_filter)
+        self.verticalLayout.addLayout(self.layout_filter)
+        self.tree_view_data = QtWidgets.QTreeView(self.data_inspector_contents)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
-        sizePolicy.setHeightForWidth(self.tree_widget_data.sizePolicy().hasHeightForWidth())
-        self.tree_widget_data.setSizePolicy(sizePolicy)
-        self.tree_widget_data.setMinimumSize(QtCore.QSize(400, 0))
-        self.tree_widget_data.setMaximumSize(QtCore.QSize(16777215, 16777215))
-        self.tree_widget_data.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
-        self.tree_widget_data.setIndentation(20)
-        self.tree_widget_data.setUniformRowHeights(True)
-        self.tree_widget_data.setAllColumnsShowFocus(True)
-        self.tree_widget_data.setColumnCount(3)
-        self.tree_widget_data.setObjectName("tree_widget_data")
-        self.tree_widget_data.header().setDefaultSectionSize(90)
-        self.tree_widget_data.header().setHighlightSections(True)
-        self.verticalLayout.addWidget(self.tree_widget_data)
+        sizePolicy.setHeightForWidth(self.tree_view_data.sizePolicy().hasHeightForWidth())
+        self.tree_view_data.setSizePolicy(sizePolicy)
+        self.tree_view_data.setMinimumSize(QtCore.QSize(400, 0))
+        self.tree_view_data.setMaximumSize(QtCore.QSize(16777215, 16777215))
+        self.tree_view_data.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.tree_view_data.setIndentation(20)
+        self.tree_view_data.setUniformRowHeights(True)
+        self.tree_view_data.setSortingEnabled(True)
+        self.tree_view_data.setAllColumnsShowFocus(True)
+        self.tree_view_data.setObjectName("tree_view_data")
+        self.tree_view_data.header().setDefaultSectionSize(90)
+        self.tree_view_data.header().setHighlightSections(True)
+        self.verticalLayout.addWidget(self.tree_view_data)
         self.button_load_file = QtWidgets.QPushButton(self.data_inspector_contents)
         self.button_load_file.setObjectName("button_load_file")
         self.verticalLayout.addWidget(self.button_load_file)
@@ -203,9 +213,7 @@ class Ui_MainWindow(object):
         self.toolbar_modules.setWindowTitle(_translate("MainWindow", "toolBar"))
         self.toolbar_save.setWindowTitle(_translate("MainWindow", "toolbar_save"))
         self.dock_data_inspector.setWindowTitle(_translate("MainWindow", "Data Inspector"))
-        self.tree_widget_data.headerItem().setText(0, _translate("MainWindow", "Patient ID"))
-        self.tree_widget_data.headerItem().setText(1, _translate("MainWindow", "Left"))
-        self.tree_widget_data.headerItem().setText(2, _translate("MainWindow", "Right"))
+        self.line_edit_filter.setPlaceholderText(_translate("MainWindow", "Filter patient ID..."))
         self.button_load_file.setText(_translate("MainWindow", "Load Selected Patient"))
         self.action_load_new_DICOM.setText(_translate("MainWindow", "Load New DICOM..."))
         self.action_load_new_DICOM.setShortcut(_translate("MainWindow", "Ctrl+N"))
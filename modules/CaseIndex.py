@@ -0,0 +1,193 @@
+import os
+import json
+from collections import OrderedDict
+
+MANIFEST_FILENAME = ".carotid_manifest.json"
+
+# All file signatures of a case.
+# First entry is the dict key used to retrieve the file path.
+# Second entry is the file tail after the patient ID.
+CASE_FILES = [
+    ("volume_raw", ".nrrd"),
+    ("volume_left", "_left.nrrd"),
+    ("volume_right", "_right.nrrd"),
+    ("seg_left", "_left.seg.nrrd"),
+    ("seg_right", "_right.seg.nrrd"),
+    ("lumen_model_left", "_left_lumen.stl"),
+    ("lumen_model_right", "_right_lumen.stl"),
+    ("plaque_model_left", "_left_plaque.stl"),
+    ("plaque_model_right", "_right_plaque.stl"),
+    ("centerlines_left", "_left_lumen_centerlines.vtp"),
+    ("centerlines_right", "_right_lumen_centerlines.vtp"),
+]
+
+# Pipeline stages as shown in the data inspector: (name, left key, right key)
+CASE_STAGES = [
+    ("Full Volume", "volume_raw", "volume_raw"),
+    ("Crop Volume", "volume_left", "volume_right"),
+    ("Segmentation", "seg_left", "seg_right"),
+    ("Lumen Model", "lumen_model_left", "lumen_model_right"),
+    ("Plaque Model", "plaque_model_left", "plaque_model_right"),
+    ("Centerlines", "centerlines_left", "centerlines_right"),
+]
+
+
+def caseFilePath(working_dir, patient_ID, key):
+    """
+    Path of a case file, whether it exists or not.
+    """
+    return os.path.join(working_dir, patient_ID, patient_ID + dict(CASE_FILES)[key])
+
+
+class CaseIndex():
+    """
+    Index of all cases (case* folders) in a working directory.
+    Case folders are listed with a single os.scandir pass each. The result is kept
+    in a manifest file in the working directory (folder mtime, mtime/size per file),
+    so unchanged folders are not listed again on the next scan.
+    """
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.manifest_path = os.path.join(working_dir, MANIFEST_FILENAME)
+        self.cases = OrderedDict() # patient ID -> patient dict (file paths, False if missing)
+        self.manifest = {}         # patient ID -> {'mtime': folder mtime, 'files': {key: [mtime, size]}}
+
+
+    def scan(self):
+        """
+        (Re-)builds the index of the working directory. Only case folders whose
+        mtime differs from the manifest are listed.
+        """
+        old_manifest = self.__loadManifest()
+        self.cases = OrderedDict()
+        self.manifest = {}
+        modified = False
+
+        for entry in sorted(self.__listCaseFolders(), key=lambda e: e.name):
+            pID = entry.name
+            mtime = entry.stat().st_mtime_ns
+            manifest_entry = old_manifest.get(pID)
+            if manifest_entry is None or manifest_entry.get('mtime') != mtime:
+                manifest_entry = self.__scanCaseFolder(entry.path, pID, mtime)
+                modified = True
+            self.manifest[pID] = manifest_entry
+            self.cases[pID] = self.__patientDict(pID, manifest_entry)
+
+        if modified or old_manifest.keys() != self.manifest.keys():
+            self.save()
+
+
+    def refreshCase(self, patient_ID):
+        """
+        Re-lists a single case folder and updates its patient dict in place.
+        Returns the patient dict or None if the case folder does not exist (anymore).
+        """
+        folder = os.path.join(self.working_dir, patient_ID)
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            self.removeCase(patient_ID)
+            return None
+
+        manifest_entry = self.__scanCaseFolder(folder, patient_ID, mtime)
+        self.manifest[patient_ID] = manifest_entry
+        patient_dict = self.__patientDict(patient_ID, manifest_entry)
+        if patient_ID in self.cases:
+            self.cases[patient_ID].update(patient_dict) # keep references held by modules valid
+        else:
+            self.cases[patient_ID] = patient_dict
+        self.save()
+        return self.cases[patient_ID]
+
+
+    def removeCase(self, patient_ID):
+        if patient_ID in self.cases:
+            del self.cases[patient_ID]
+            del self.manifest[patient_ID]
+            self.save()
+
+
+    def caseFolderIDs(self):
+        """
+        Returns the IDs of all case folders currently on disk (single listing, no case folder is read).
+        """
+        try:
+            return [e.name for e in self.__listCaseFolders()]
+        except OSError:
+            return []
+
+
+    def fileStat(self, patient_ID, key):
+        """
+        Returns (mtime_ns, size) of a case file as recorded at the last scan, or None.
+        Files overwritten in place do not change the folder mtime, use os.stat for exact values.
+        """
+        stat = self.manifest.get(patient_ID, {}).get('files', {}).get(key)
+        return tuple(stat) if stat else None
+
+
+    def isStale(self, patient_ID):
+        """
+        True if the folder or a file of a case changed since it was indexed.
+        Catches files overwritten in place, which are not reported by the folder mtime.
+        """
+        manifest_entry = self.manifest.get(patient_ID)
+        if manifest_entry is None:
+            return False
+        try:
+            if os.stat(os.path.join(self.working_dir, patient_ID)).st_mtime_ns != manifest_entry['mtime']:
+                return True
+            for key, (mtime, size) in manifest_entry['files'].items():
+                stat = os.stat(caseFilePath(self.working_dir, patient_ID, key))
+                if stat.st_mtime_ns != mtime or stat.st_size != size:
+                    return True
+        except OSError:
+            return True
+        return False
+
+
+    def save(self):
+        try:
+            with open(self.manifest_path + ".tmp", 'w') as f:
+                json.dump(self.manifest, f)
+            os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        except OSError:
+            print("Could not write manifest " + self.manifest_path)
+
+
+    def __loadManifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+    def __listCaseFolders(self):
+        with os.scandir(self.working_dir) as it:
+            return [e for e in it if e.name.startswith("case") and e.is_dir()]
+
+
+    def __scanCaseFolder(self, folder, patient_ID, mtime):
+        files = {}
+        with os.scandir(folder) as it:
+            existing = {e.name: e for e in it}
+        for key, tail in CASE_FILES:
+            entry = existing.get(patient_ID + tail)
+            if entry is not None:
+                stat = entry.stat()
+                files[key] = [stat.st_mtime_ns, stat.st_size]
+        return {'mtime': mtime, 'files': files}
+
+
+    def __patientDict(self, patient_ID, manifest_entry):
+        folder = os.path.join(self.working_dir, patient_ID)
+        patient_dict = {}
+        patient_dict['patient_ID'] = patient_ID
+        patient_dict['base_path'] = folder
+        for key, tail in CASE_FILES:
+            if key in manifest_entry['files']:
+                patient_dict[key] = os.path.join(folder, patient_ID + tail)
+            else:
+                patient_dict[key] = False
+        return patient_dict
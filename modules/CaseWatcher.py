@@ -0,0 +1,126 @@
+import os
+
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+
+from defaults import *
+from modules.CaseIndex import CASE_FILES
+
+
+class CaseWatcher(QObject):
+    """
+    Watches the working directory, all case folders and the files of the active case.
+    Added, removed and replaced (write to temp + rename) files change their case folder.
+    Files overwritten in place are only reported for the active case, other cases are
+    compared with the manifest when they are activated (CaseIndex.isStale).
+    Events are collected and applied after CASE_WATCHER_DEBOUNCE_MS without new events.
+    Only the affected cases are re-indexed, the working directory is never rescanned.
+    """
+    cases_changed = pyqtSignal(object) # list of patient IDs that were added, modified or removed
+
+    def __init__(self, case_index, parent=None):
+        super().__init__(parent)
+        self.case_index = case_index
+        self.working_dir = case_index.working_dir
+        self.active_case = None
+        self.watched = set() # paths added to the watcher
+        self.pending_cases = set()
+        self.pending_folder_list = False
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.__directoryChanged)
+        self.watcher.fileChanged.connect(self.__fileChanged)
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(CASE_WATCHER_DEBOUNCE_MS)
+        self.debounce_timer.timeout.connect(self.__applyEvents)
+
+        self.__addPaths([self.working_dir] +
+                        [patient_dict['base_path'] for patient_dict in self.case_index.cases.values()])
+
+
+    def watchCase(self, patient_ID):
+        """
+        (Re-)adds the folder of a case, and its existing files if it is the active case.
+        Files replaced on disk drop out of the watcher and are re-added here.
+        """
+        patient_dict = self.case_index.cases.get(patient_ID)
+        if patient_dict is None:
+            return
+        paths = [patient_dict['base_path']]
+        if patient_ID == self.active_case:
+            paths += [patient_dict[key] for key, _ in CASE_FILES if patient_dict[key]]
+        self.__addPaths(paths)
+
+
+    def unwatchCase(self, patient_ID):
+        prefix = os.path.join(self.working_dir, patient_ID)
+        self.__removePaths([p for p in self.watched if p == prefix or p.startswith(prefix + os.sep)])
+
+
+    def setActiveCase(self, patient_ID):
+        """
+        Moves the file watches to the case loaded in the application (None if no case is loaded).
+        """
+        if patient_ID == self.active_case:
+            return
+        if self.active_case is not None:
+            folder = os.path.join(self.working_dir, self.active_case)
+            self.__removePaths([p for p in self.watched if p.startswith(folder + os.sep)])
+        self.active_case = patient_ID if patient_ID else None
+        if self.active_case is not None:
+            self.watchCase(self.active_case)
+
+
+    def stop(self):
+        self.debounce_timer.stop()
+        self.__removePaths(list(self.watched))
+
+
+    def __addPaths(self, paths):
+        new_paths = [p for p in paths if p not in self.watched]
+        if new_paths:
+            self.watched.update(new_paths)
+            self.watcher.addPaths(new_paths)
+
+
+    def __removePaths(self, paths):
+        if paths:
+            self.watched.difference_update(paths)
+            self.watcher.removePaths(paths)
+
+
+    def __directoryChanged(self, path):
+        if os.path.normpath(path) == os.path.normpath(self.working_dir):
+            self.pending_folder_list = True
+        else:
+            self.pending_cases.add(os.path.basename(os.path.normpath(path)))
+        self.debounce_timer.start() # restarts a running timer
+
+
+    def __fileChanged(self, path):
+        self.watched.discard(path) # dropped by the watcher if replaced, re-added with the case
+        self.pending_cases.add(os.path.basename(os.path.dirname(path)))
+        self.debounce_timer.start()
+
+
+    def __applyEvents(self):
+        changed = self.pending_cases
+        if self.pending_folder_list:
+            # a single listing of the working directory reveals added and removed cases
+            on_disk = set(self.case_index.caseFolderIDs())
+            known = set(self.case_index.cases)
+            changed |= (on_disk - known) | (known - on_disk)
+        self.pending_cases = set()
+        self.pending_folder_list = False
+
+        changed = sorted(pID for pID in changed if pID.startswith("case"))
+        if not changed:
+            return
+        self.cases_changed.emit(changed)
+
+        # watch added cases and files, forget removed ones
+        for patient_ID in changed:
+            if patient_ID in self.case_index.cases:
+                self.watchCase(patient_ID)
+            else:
+                self.unwatchCase(patient_ID)
@@ -0,0 +1,121 @@
+"""
+Persistent cache of the vmtk centerline intermediates of a lumen model.
+The Delaunay tessellation, Voronoi diagram and pole ids only depend on the surface,
+not on the seed points. They are stored next to the lumen STL:
+    <patient>_<side>_lumen.delaunay.vtu  Delaunay tessellation
+    <patient>_<side>_lumen.voronoi.vtp   Voronoi diagram, pole ids as field data
+Both files carry the SHA1 of the STL they were computed from, entries of other
+STL contents are ignored.
+"""
+
+import os
+import hashlib
+
+import vtk
+
+KEY_ARRAY_NAME = "SourceSHA1"
+POLE_IDS_ARRAY_NAME = "PoleIds"
+
+
+def cachePaths(lumen_path):
+    """
+    Returns the (Delaunay tessellation, Voronoi diagram) file paths of a lumen model.
+    """
+    stem = os.path.splitext(lumen_path)[0]
+    return stem + ".delaunay.vtu", stem + ".voronoi.vtp"
+
+
+def surfaceKey(lumen_path):
+    """
+    SHA1 of the lumen STL file content, None if it cannot be read.
+    """
+    sha1 = hashlib.sha1()
+    try:
+        with open(lumen_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024**2), b''):
+                sha1.update(chunk)
+    except OSError:
+        return None
+    return sha1.hexdigest()
+
+
+def loadCenterlineCache(lumen_path, key=None):
+    """
+    Returns (Delaunay tessellation, Voronoi diagram, pole ids) of a lumen model,
+    or None if there is no entry for the current STL content.
+    """
+    if key is None:
+        key = surfaceKey(lumen_path)
+    delaunay_path, voronoi_path = cachePaths(lumen_path)
+    if key is None or not (os.path.exists(delaunay_path) and os.path.exists(voronoi_path)):
+        return None
+
+    delaunay = _readEntry(vtk.vtkXMLUnstructuredGridReader(), delaunay_path, key)
+    voronoi = _readEntry(vtk.vtkXMLPolyDataReader(), voronoi_path, key)
+    if delaunay is None or voronoi is None:
+        return None
+    pole_array = voronoi.GetFieldData().GetArray(POLE_IDS_ARRAY_NAME)
+    if pole_array is None:
+        return None
+    pole_ids = vtk.vtkIdList()
+    pole_ids.SetNumberOfIds(pole_array.GetNumberOfTuples())
+    for i in range(pole_array.GetNumberOfTuples()):
+        pole_ids.SetId(i, int(pole_array.GetValue(i)))
+    voronoi.GetFieldData().RemoveArray(POLE_IDS_ARRAY_NAME)
+    return delaunay, voronoi, pole_ids
+
+
+def writeCenterlineCache(lumen_path, key, delaunay, voronoi, pole_ids):
+    """
+    Writes the intermediates of a lumen model with the SHA1 of its STL (see surfaceKey()).
+    The given data objects are not modified.
+    """
+    delaunay_path, voronoi_path = cachePaths(lumen_path)
+    pole_array = vtk.vtkIdTypeArray()
+    pole_array.SetName(POLE_IDS_ARRAY_NAME)
+    pole_array.SetNumberOfTuples(pole_ids.GetNumberOfIds())
+    for i in range(pole_ids.GetNumberOfIds()):
+        pole_array.SetValue(i, pole_ids.GetId(i))
+
+    # write to temporary files first, a crash must not leave a valid looking entry
+    _writeEntry(vtk.vtkXMLUnstructuredGridWriter(), vtk.vtkUnstructuredGrid(), delaunay, delaunay_path, key)
+    _writeEntry(vtk.vtkXMLPolyDataWriter(), vtk.vtkPolyData(), voronoi, voronoi_path, key, pole_array)
+
+
+def removeCenterlineCache(lumen_path):
+    for path in cachePaths(lumen_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _readEntry(reader, path, key):
+    reader.SetFileName(path)
+    reader.Update()
+    data = reader.GetOutput()
+    key_array = data.GetFieldData().GetAbstractArray(KEY_ARRAY_NAME)
+    if key_array is None or key_array.GetNumberOfValues() != 1 or key_array.GetValue(0) != key:
+        return None
+    data.GetFieldData().RemoveArray(KEY_ARRAY_NAME)
+    return data
+
+
+def _writeEntry(writer, copy, data, path, key, *arrays):
+    # shallow copy with its own field data, the arrays of data are shared
+    copy.ShallowCopy(data)
+    field_data = vtk.vtkFieldData()
+    field_data.ShallowCopy(data.GetFieldData())
+    key_array = vtk.vtkStringArray()
+    key_array.SetName(KEY_ARRAY_NAME)
+    key_array.InsertNextValue(key)
+    field_data.AddArray(key_array)
+    for a in arrays:
+        field_data.AddArray(a)
+    copy.SetFieldData(field_data)
+
+    writer.SetFileName(path + ".tmp")
+    writer.SetInputData(copy)
+    if writer.Write() != 1:
+        raise OSError("Could not write " + path)
+    os.replace(path + ".tmp", path)
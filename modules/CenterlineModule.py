@@ -1,21 +1,100 @@
 import os
 
 import vtk
-from vmtk.vtkvmtkComputationalGeometryPython import vtkvmtkPolyDataCenterlines
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
-from PyQt5.QtCore import pyqtSignal
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTabWidget, QPushButton, QLabel
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTabWidget, QPushButton, QLabel, QProgressBar
 
 from defaults import *
+from modules.Pipeline import (centerlineEndPoints, createCenterlineFilter, setCenterlineIntermediates,
+                              preconditionSurface, mapPointIds, centerlineCacheKey)
+from modules.CenterlineCache import loadCenterlineCache, writeCenterlineCache
+from modules.CenterlineSeeds import cropBox, detectSeeds
+
+
+class CenterlineWorker(QObject):
+    """
+    Runs the vmtk centerline filter of one lumen surface outside of the GUI thread.
+    Progress is taken from the VTK progress events of the filter, cancellation
+    aborts the filter at its next progress event. A newly computed tessellation
+    is written to the centerline cache of the lumen file.
+    """
+    finished = pyqtSignal()
+    progress = pyqtSignal(float)
+    centerlines_done = pyqtSignal(object, object, object, object, int)
+    failed = pyqtSignal(str)
+    surface = None
+    source_id = None
+    target_ids = None
+    delaunay_tessellation = None
+    voronoi_diagram = None
+    pole_ids = None
+    lumen_path = None
+    surface_key = None
+    generation = 0
+    cancelled = False
+
+
+    def run(self):
+        try:
+            # seed ids refer to the displayed surface
+            surface = preconditionSurface(self.surface)
+            source_id = mapPointIds(self.surface, surface, [self.source_id])[0]
+            target_ids = mapPointIds(self.surface, surface, self.target_ids)
+            if self.cancelled:
+                return
+            centerlineFilter = createCenterlineFilter(surface, source_id, target_ids)
+            setCenterlineIntermediates(centerlineFilter, self.delaunay_tessellation,
+                                       self.voronoi_diagram, self.pole_ids)
+            centerlineFilter.AddObserver("ProgressEvent", self.reportProgress)
+            centerlineFilter.Update()
+            if self.cancelled:
+                return
+            self.centerlines_done.emit(
+                centerlineFilter.GetOutput(),
+                centerlineFilter.GetDelaunayTessellation(),
+                centerlineFilter.GetVoronoiDiagram(),
+                centerlineFilter.GetPoleIds(),
+                self.generation)
+            if USE_CENTERLINE_CACHE and self.surface_key is not None and self.delaunay_tessellation is None:
+                try:
+                    writeCenterlineCache(self.lumen_path, self.surface_key,
+                                         centerlineFilter.GetDelaunayTessellation(),
+                                         centerlineFilter.GetVoronoiDiagram(),
+                                         centerlineFilter.GetPoleIds())
+                except OSError:
+                    pass # the cache is optional
+        except Exception as e: # e.g. vmtk not installed
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit()
+
+
+    def reportProgress(self, obj, event):
+        if self.cancelled:
+            obj.SetAbortExecute(1)
+            return
+        self.progress.emit(obj.GetProgress())
+
+
+
 
 class CenterlineModuleTab(QWidget):
     """
     Tab view of a right OR left side carotid for centerline computation.
     """
     data_modified = pyqtSignal()
+    thread_started = pyqtSignal()
+    thread_finished = pyqtSignal()
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.centerline_thread = None     # thread of a running centerline computation
+        self.centerline_worker = None     # worker of a running centerline computation
+        self.centerline_generation = 0    # results of older generations are not applied
         self.lumen_active = False
+        self.lumen_path = None            # STL of the lumen model
+        self.crop_box = None              # faces of the crop box (automatic seeds), surface bounds if None
+        self.surface_key = None           # key of the centerline cache (SHA1 of the lumen STL, preconditioning)
         self.centerlines = None
         self.DelaunayTessellation = None
         self.VoronoiDiagram = None
@@ -26,6 +105,11 @@ class CenterlineModuleTab(QWidget):
         # QT UI
         self.button_compute = QPushButton("Compute New Centerlines")
         self.button_compute.clicked.connect(self.computeCenterlines)
+        self.centerline_progress = QProgressBar()
+        self.centerline_progress.setVisible(False)
+        self.centerline_cancel_button = QPushButton("Cancel")
+        self.centerline_cancel_button.setVisible(False)
+        self.centerline_cancel_button.clicked.connect(self.cancelCenterlines)
         self.button_set_source = QPushButton("Source")
         self.button_set_source.setCheckable(True)
         self.button_set_source.clicked[bool].connect(self.setSourcePoint)
@@ -34,6 +118,9 @@ class CenterlineModuleTab(QWidget):
         self.button_set_target.clicked[bool].connect(self.setTargetPoints)
         self.button_remove_target = QPushButton("Remove Targets")
         self.button_remove_target.clicked.connect(self.removeTargetPoints)
+        self.button_auto_seeds = QPushButton("Auto")
+        self.button_auto_seeds.setToolTip("Detect source and targets at the vessel ends on the crop box faces.")
+        self.button_auto_seeds.clicked.connect(self.detectEndPoints)
         self.label_picker_hint = QLabel(r"<b>Right-click on the surface to add endpoints.</b><br>Right-click a target point to remove it. One source and one or more targets need to be defined.")
         self.label_picker_hint.setVisible(False)
 
@@ -62,7 +149,10 @@ class CenterlineModuleTab(QWidget):
         self.button_layout.addWidget(self.button_set_target)
         self.button_layout.addWidget(QLabel("|"))
         self.button_layout.addWidget(self.button_remove_target)
+        self.button_layout.addWidget(self.button_auto_seeds)
         self.button_layout.addStretch()
+        self.button_layout.addWidget(self.centerline_progress)
+        self.button_layout.addWidget(self.centerline_cancel_button)
         self.button_layout.addWidget(self.button_compute)
         self.main_layout = QVBoxLayout(self)
         self.main_layout.addLayout(self.button_layout)
@@ -139,10 +229,25 @@ class CenterlineModuleTab(QWidget):
     def removeTargetPoints(self):
         for actor in self.actors_targets:
             self.renderer.RemoveActor(actor)
+        self.actors_targets.clear()
         self.TargetIds.clear()
         self.centerline_view.GetRenderWindow().Render()
 
 
+    def detectEndPoints(self):
+        if not self.lumen_active:
+            return
+        source, targets = detectSeeds(self.reader_lumen.GetOutput(), self.crop_box)
+        if source is None:
+            print("No vessel end found on the inferior crop box face.")
+            return
+        self.removeTargetPoints()
+        self.addCenterlineEndPoint(source, source=True)
+        for p in targets:
+            self.addCenterlineEndPoint(p, source=False)
+        self.centerline_view.GetRenderWindow().Render()
+
+
     def pickCenterlineEndPoint(self, obj, event):
         # pick selected position
         x_screen, y_screen = self.centerline_view.GetEventPosition()
@@ -191,16 +296,7 @@ class CenterlineModuleTab(QWidget):
         if self.centerlines is None:
             return
         
-        first_point = None
-        last_points = []
-        l = self.centerlines.GetLines()
-        l.InitTraversal()
-        for i in range(l.GetNumberOfCells()):
-            pointIds = vtk.vtkIdList()
-            l.GetNextCell(pointIds)
-            if pointIds.GetNumberOfIds() == 0: continue
-            first_point = self.centerlines.GetPoint(pointIds.GetId(0))
-            last_points.append(self.centerlines.GetPoint(pointIds.GetId(pointIds.GetNumberOfIds()-1)))
+        first_point, last_points = centerlineEndPoints(self.centerlines)
         if first_point is not None:
             self.addCenterlineEndPoint(first_point, source=True)
         for p in last_points:
@@ -208,7 +304,6 @@ class CenterlineModuleTab(QWidget):
         
 
     def computeCenterlines(self):
-        # TODO threading?
         if not self.lumen_active:
             print("No lumen to compute centerlines from.")
             return
@@ -218,45 +313,83 @@ class CenterlineModuleTab(QWidget):
         elif len(self.TargetIds) < 1:
             print("No target points specified.")
             return
+        elif self.centerline_thread is not None:
+            return
 
-        # create idlists from seepoints
-        inletSeedIds = vtk.vtkIdList()
-        inletSeedIds.InsertNextId(self.SourceId)
-        outletSeedIds = vtk.vtkIdList()
-        for id in self.TargetIds:
-            outletSeedIds.InsertNextId(id)
-
-        # create centerline filter
-        centerlineFilter = vtkvmtkPolyDataCenterlines()
-        centerlineFilter.SetInputData(self.reader_lumen.GetOutput())
-        centerlineFilter.SetSourceSeedIds(inletSeedIds)
-        centerlineFilter.SetTargetSeedIds(outletSeedIds)
-        centerlineFilter.SetRadiusArrayName('MaximumInscribedSphereRadius')
-        centerlineFilter.SetFlipNormals(False)
-        centerlineFilter.SetAppendEndPointsToCenterlines(False)
-        if len(self.TargetIds) == 1:
-            centerlineFilter.SetStopFastMarchingOnReachingTarget(True)
-        else:
-            centerlineFilter.SetStopFastMarchingOnReachingTarget(False)
-        centerlineFilter.SetSimplifyVoronoi(False)
-        if self.DelaunayTessellation != None:
-            centerlineFilter.GenerateDelaunayTessellationOff()
-            centerlineFilter.SetDelaunayTessellation(self.DelaunayTessellation)
-        if (self.VoronoiDiagram is not None) and (self.PoleIds is not None):
-            centerlineFilter.GenerateVoronoiDiagramOff()
-            centerlineFilter.SetVoronoiDiagram(self.VoronoiDiagram)
-            centerlineFilter.SetPoleIds(self.PoleIds)
-    
-        # execute centerline filter
-        centerlineFilter.SetCenterlineResampling(False)
-        centerlineFilter.SetResamplingStepLength(1.0)
-        centerlineFilter.Update()
+        self.centerline_generation += 1
+        self.button_compute.setEnabled(False)
+        self.centerline_progress.setRange(0, 0) # busy until the filter reports progress
+        self.centerline_progress.setFormat("Computing centerlines... %p%")
+        self.centerline_progress.setVisible(True)
+        self.centerline_cancel_button.setVisible(True)
+
+        # start new thread, the surface is copied as the reader may load another patient meanwhile
+        surface = vtk.vtkPolyData()
+        surface.DeepCopy(self.reader_lumen.GetOutput())
+        self.centerline_thread = QThread()
+        self.centerline_worker = CenterlineWorker()
+        self.centerline_worker.surface = surface
+        self.centerline_worker.source_id = self.SourceId
+        self.centerline_worker.target_ids = list(self.TargetIds)
+        self.centerline_worker.delaunay_tessellation = self.DelaunayTessellation
+        self.centerline_worker.voronoi_diagram = self.VoronoiDiagram
+        self.centerline_worker.pole_ids = self.PoleIds
+        self.centerline_worker.lumen_path = self.lumen_path
+        self.centerline_worker.surface_key = self.surface_key
+        self.centerline_worker.generation = self.centerline_generation
+        self.centerline_worker.moveToThread(self.centerline_thread)
+
+        self.centerline_worker.progress[float].connect(self.reportCenterlineProgress)
+        self.centerline_worker.centerlines_done[object, object, object, object, int].connect(self.applyCenterlines)
+        self.centerline_worker.failed[str].connect(self.centerlinesFailed)
+        self.centerline_worker.finished.connect(self.centerline_thread.quit)
+        self.centerline_worker.finished.connect(self.centerline_worker.deleteLater)
+
+        self.centerline_thread.started.connect(self.centerline_worker.run)
+        self.centerline_thread.finished.connect(self.centerlineThreadFinished)
+        self.centerline_thread.finished.connect(self.centerline_thread.deleteLater)
+        self.centerline_thread.start()
+        self.thread_started.emit()
+
+
+    def reportCenterlineProgress(self, progress):
+        if self.centerline_worker is None or self.centerline_worker.cancelled:
+            return
+        self.centerline_progress.setRange(0, 100)
+        self.centerline_progress.setValue(int(progress * 100))
+
+
+    def cancelCenterlines(self):
+        if self.centerline_worker is None:
+            return
+        self.centerline_worker.cancelled = True
+        self.centerline_generation += 1 # result is ignored even if the filter does not abort
+        self.centerline_progress.setFormat("Cancelling...")
+        self.centerline_cancel_button.setVisible(False)
+
+
+    def centerlinesFailed(self, message):
+        print("Centerline computation failed:", message)
+
+
+    def centerlineThreadFinished(self):
+        self.centerline_thread = None
+        self.centerline_worker = None
+        self.centerline_progress.setVisible(False)
+        self.centerline_cancel_button.setVisible(False)
+        self.button_compute.setEnabled(True)
+        self.thread_finished.emit()
+
+
+    def applyCenterlines(self, centerlines, delaunay_tessellation, voronoi_diagram, pole_ids, generation):
+        if generation != self.centerline_generation:
+            return
 
-        # cache output
-        self.centerlines = centerlineFilter.GetOutput()
-        self.VoronoiDiagram = centerlineFilter.GetVoronoiDiagram()
-        self.DelaunayTessellation = centerlineFilter.GetDelaunayTessellation()
-        self.PoleIds = centerlineFilter.GetPoleIds()
+        # cache output, only complete computations replace the cached tessellation
+        self.centerlines = centerlines
+        self.DelaunayTessellation = delaunay_tessellation
+        self.VoronoiDiagram = voronoi_diagram
+        self.PoleIds = pole_ids
 
         # show output and propagate
         self.mapper_centerline.SetInputData(self.centerlines)
@@ -279,7 +412,8 @@ class CenterlineModuleTab(QWidget):
         super(CenterlineModuleTab, self).hideEvent(event)
     
 
-    def loadModels(self, lumen_file, centerline_file):
+    def loadModels(self, lumen_file, centerline_file, crop_file=None):
+        self.cancelCenterlines() # a running computation belongs to the old surface
         self.DelaunayTessellation = None
         self.VoronoiDiagram = None
         self.PoleIds = None
@@ -298,6 +432,13 @@ class CenterlineModuleTab(QWidget):
             self.reader_lumen.Update()
             self.renderer.AddActor(self.actor_lumen)
             self.lumen_active = True
+            self.lumen_path = lumen_file
+            self.crop_box = cropBox(crop_file) if crop_file else None
+            self.surface_key = centerlineCacheKey(lumen_file)
+            if USE_CENTERLINE_CACHE and self.surface_key is not None:
+                cache = loadCenterlineCache(lumen_file, self.surface_key)
+                if cache is not None:
+                    self.DelaunayTessellation, self.VoronoiDiagram, self.PoleIds = cache
             self.text_patient.SetInput(os.path.basename(lumen_file)[:-4])
             if centerline_file:
                 self.reader_centerline.SetFileName("")
@@ -310,9 +451,12 @@ class CenterlineModuleTab(QWidget):
             else:
                 self.renderer.RemoveActor(self.actor_centerline)
                 self.centerlines = None
+                self.detectEndPoints()
             self.renderer.ResetCamera()
         else:
             self.lumen_active = False
+            self.lumen_path = None
+            self.surface_key = None
             self.centerlines = None
             self.renderer.RemoveActor(self.actor_lumen)
             self.renderer.RemoveActor(self.actor_centerline)
@@ -331,6 +475,9 @@ class CenterlineModuleTab(QWidget):
 
 
     def close(self):
+        if self.centerline_thread is not None:
+            self.cancelCenterlines()
+            self.centerline_thread.wait()
         self.centerline_view.Finalize()
 
 
@@ -341,6 +488,8 @@ class CenterlineModule(QTabWidget):
     User selects start/endpoints.
     """
     new_centerlines = pyqtSignal()
+    thread_started = pyqtSignal()
+    thread_finished = pyqtSignal()
     def __init__(self, parent=None):
         super().__init__(parent)
         self.patient_dict = None
@@ -350,6 +499,9 @@ class CenterlineModule(QTabWidget):
 
         self.centerline_module_left.data_modified.connect(self.dataModifiedLeft)
         self.centerline_module_right.data_modified.connect(self.dataModifiedRight)
+        for tab in (self.centerline_module_left, self.centerline_module_right):
+            tab.thread_started.connect(self.thread_started)
+            tab.thread_finished.connect(self.thread_finished)
 
         self.addTab(self.centerline_module_right, "Right")
         self.addTab(self.centerline_module_left, "Left")
@@ -357,10 +509,13 @@ class CenterlineModule(QTabWidget):
 
     def loadPatient(self, patient_dict):
         self.patient_dict = patient_dict
+        # crop geometry for automatic seeds, the segmentation has the same geometry
         self.centerline_module_right.loadModels(
-            patient_dict['lumen_model_right'], patient_dict['centerlines_right'])
+            patient_dict['lumen_model_right'], patient_dict['centerlines_right'],
+            patient_dict['volume_right'] or patient_dict['seg_right'])
         self.centerline_module_left.loadModels(
-            patient_dict['lumen_model_left'], patient_dict['centerlines_left'])
+            patient_dict['lumen_model_left'], patient_dict['centerlines_left'],
+            patient_dict['volume_left'] or patient_dict['seg_left'])
 
 
     def save(self):
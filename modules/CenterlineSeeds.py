@@ -0,0 +1,98 @@
+"""
+Automatic centerline seed points of a lumen model.
+The lumen surface is extracted from a padded label map, so vessels cut by the crop
+box end in flat caps on its faces. Caps are the connected surface regions lying on
+a face (facing along its axis). The largest cap on the inferior face (CCA) is the
+source, all caps on the other faces (ICA, ECA) are targets.
+"""
+
+import nrrd
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+from defaults import *
+
+INFERIOR_FACE = 4 # z min in LPS space
+
+
+def cropBox(volume_path):
+    """
+    Returns the faces (x0, x1, y0, y1, z0, z1) of the crop box of a crop volume or
+    segmentation (.nrrd), i.e. the voxel bounds extended by half a voxel.
+    """
+    header = nrrd.read_header(volume_path)
+    origin = np.array(header['space origin'], dtype=np.float64)
+    spacing = np.diagonal(header['space directions']).astype(np.float64)
+    sizes = np.array(header['sizes'])
+    end = origin + spacing * (sizes - 1)
+    box = []
+    for d in range(3):
+        half = abs(spacing[d]) / 2
+        box += [min(origin[d], end[d]) - half, max(origin[d], end[d]) + half]
+    return box
+
+
+def capRegions(surface, box, max_distance=CENTERLINE_SEED_CAP_DISTANCE, min_area=CENTERLINE_SEED_MIN_CAP_AREA):
+    """
+    Returns the caps of a surface on the faces of a box as (face index, area, centroid),
+    face index 2*axis (min face) or 2*axis+1 (max face). Caps below min_area are dropped.
+    """
+    triangle_filter = vtk.vtkTriangleFilter()
+    triangle_filter.SetInputData(surface)
+    triangle_filter.Update()
+    triangulated = triangle_filter.GetOutput()
+    if triangulated.GetNumberOfCells() == 0:
+        return []
+    points = vtk_to_numpy(triangulated.GetPoints().GetData()).astype(np.float64)
+    triangles = vtk_to_numpy(triangulated.GetPolys().GetData()).reshape(-1, 4)[:, 1:]
+    corners = points[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1) / 2
+    centers = corners.mean(axis=1)
+
+    regions = []
+    for face in range(6):
+        axis = face // 2
+        near = np.abs(points[:, axis] - box[face]) <= max_distance
+        facing = np.abs(normals[:, axis]) > 0.9 * 2 * areas
+        selected = np.flatnonzero(near[triangles].all(axis=1) & facing)
+        if len(selected) == 0:
+            continue
+        _, components = np.unique(_connectedComponents(triangles[selected], len(points)), return_inverse=True)
+        component_areas = np.bincount(components, weights=areas[selected])
+        for c in np.flatnonzero(component_areas >= min_area):
+            weights = areas[selected] * (components == c)
+            centroid = (centers[selected] * weights[:, np.newaxis]).sum(axis=0) / component_areas[c]
+            regions.append((face, float(component_areas[c]), tuple(centroid)))
+    return regions
+
+
+def detectSeeds(surface, box=None):
+    """
+    Returns the (source position, [target positions]) of a lumen surface, cap centroids
+    on the crop box faces (largest first). The surface bounds are used if no box is given.
+    Returns (None, []) if there is no inferior cap.
+    """
+    if box is None:
+        box = surface.GetBounds()
+    regions = capRegions(surface, box)
+    sources = [r for r in regions if r[0] == INFERIOR_FACE]
+    if not sources:
+        return None, []
+    source = max(sources, key=lambda r: r[1])
+    targets = sorted((r for r in regions if r[0] != INFERIOR_FACE), key=lambda r: -r[1])
+    return source[2], [r[2] for r in targets]
+
+
+def _connectedComponents(triangles, number_of_points):
+    # label propagation with pointer jumping, label of a point = smallest connected point id
+    labels = np.arange(number_of_points)
+    while True:
+        triangle_labels = labels[triangles].min(axis=1)
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, triangles.ravel(), np.repeat(triangle_labels, 3))
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels[triangles[:, 0]]
+        labels = new_labels
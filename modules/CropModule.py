@@ -1,16 +1,39 @@
 import os
-from collections import OrderedDict
 import time
 
 import numpy as np
 import nrrd
 import vtk
 from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QSlider, QPushButton, QLabel
 
 from defaults import *
 from modules.Interactors import ImageSliceInteractor, VolumeRenderingInteractor
+from modules.Pipeline import cropVolume, writeCropVolume
+from modules.VolumeCache import loadCachedVolume, writeVolumeCache
+
+
+class VolumeCacheWorker(QObject):
+    """
+    Writes the volume cache entry of a loaded raw volume outside of the GUI thread.
+    """
+    finished = pyqtSignal()
+    path = None
+    image = None # keeps the vtkImageData (and thus the data array) alive while writing
+
+
+    def run(self):
+        try:
+            data = vtk_to_numpy(self.image.GetPointData().GetScalars())
+            data = data.reshape(self.image.GetDimensions(), order='F')
+            writeVolumeCache(self.path, data, self.image.GetSpacing(), self.image.GetOrigin())
+        except OSError:
+            pass # the cache is optional
+        finally:
+            self.finished.emit()
+
+
 
 class CropModule(QWidget):
     """
@@ -22,13 +45,15 @@ class CropModule(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.image = None
-        self.z_height = 124 # height of VOI in voxels
+        self.z_height = CROP_Z_HEIGHT # height of VOI in voxels
         self.y_height = int(np.round(self.z_height * (72/124)))
         self.x_height = int(np.round(self.z_height * (60/124)))
         self.crop_image_left = None
         self.crop_image_left_center = None
         self.crop_image_right = None
         self.crop_image_right_center = None
+        self.cache_thread = None # thread of a running volume cache write
+        self.cache_worker = None
         
         self.box_left_source = vtk.vtkCubeSource()
         self.box_left_mapper = vtk.vtkPolyDataMapper()
@@ -226,25 +251,10 @@ class CropModule(QWidget):
                      int(round((pos[1] - origin[1]) / spacing[1])), 
                      int(self.slice_view.slice))
         else:
-            spacing = self.image.GetSpacing()
             x, y, z = center
 
-        # crop volume
-        extractor = vtk.vtkExtractVOI()
-        extractor.SetInputData(self.image)
-        extractor.SetVOI(
-            x-int(self.x_height/2), x+int(self.x_height/2), 
-            y-int(self.y_height/2), y+int(self.y_height/2),
-            z-int(self.z_height/2), z+int(self.z_height/2))
-        
-        # scale resolution * 2
-        reslicer = vtk.vtkImageReslice()
-        reslicer.SetInputConnection(extractor.GetOutputPort())
-        reslicer.SetInterpolationModeToCubic()
-        reslicer.SetOutputExtent(0, 119, 0, 143, 0, 247)
-        reslicer.SetOutputSpacing([s*(self.z_height/248) for s in spacing])
-        reslicer.Update()
-        crop_image = reslicer.GetOutput()
+        # crop volume, scale resolution * 2
+        crop_image = cropVolume(self.image, (x, y, z), self.z_height)
 
         # adapt crop display
         ox, oy, oz = crop_image.GetOrigin()
@@ -301,6 +311,27 @@ class CropModule(QWidget):
         super(CropModule, self).hideEvent(event)
 
 
+    def __writeVolumeCache(self, path, image):
+        if self.cache_thread is not None:
+            return # one write at a time, the entry is written on a later load
+        self.cache_thread = QThread()
+        self.cache_worker = VolumeCacheWorker()
+        self.cache_worker.path = path
+        self.cache_worker.image = image
+        self.cache_worker.moveToThread(self.cache_thread)
+        self.cache_worker.finished.connect(self.cache_thread.quit)
+        self.cache_worker.finished.connect(self.cache_worker.deleteLater)
+        self.cache_thread.started.connect(self.cache_worker.run)
+        self.cache_thread.finished.connect(self.cacheThreadFinished)
+        self.cache_thread.finished.connect(self.cache_thread.deleteLater)
+        self.cache_thread.start()
+
+
+    def cacheThreadFinished(self):
+        self.cache_thread = None
+        self.cache_worker = None
+
+
     def __loadCropVolumeBox(self, filename, box_source, box_actor, cut_actor):
         if filename:
             header = nrrd.read_header(filename)
@@ -355,10 +386,17 @@ class CropModule(QWidget):
                 self.resetViews()
                 return
 
-            reader = vtk.vtkNrrdReader()
-            reader.SetFileName(patient_dict['volume_raw'])
-            reader.Update()
-            self.image = reader.GetOutput()
+            # memory-mapped cache avoids decompressing the full volume
+            self.image = None
+            if USE_VOLUME_CACHE:
+                self.image = loadCachedVolume(patient_dict['volume_raw'])
+            if self.image is None:
+                reader = vtk.vtkNrrdReader()
+                reader.SetFileName(patient_dict['volume_raw'])
+                reader.Update()
+                self.image = reader.GetOutput()
+                if USE_VOLUME_CACHE:
+                    self.__writeVolumeCache(patient_dict['volume_raw'], self.image)
 
         # compute crop volume size around a center
         # needs to be 1/4 of target dimension (120 144 248)
@@ -389,20 +427,7 @@ class CropModule(QWidget):
 
     
     def saveVolumeNrrd(self, volume, path):
-        sx, sy, sz = volume.GetSpacing()
-        ox, oy, oz = volume.GetOrigin()
-        x_dim, y_dim, z_dim = volume.GetDimensions()
-        header = OrderedDict()
-        header['dimension'] = 3
-        header['space'] = 'left-posterior-superior'
-        header['space directions'] = [[sx, 0, 0], [0, sy, 0], [0, 0, sz]]
-        header['kinds'] = ['domain', 'domain', 'domain']
-        header['endian'] = 'little'
-        header['encoding'] = 'gzip'
-        header['space origin'] = [ox, oy, oz]
-        segmentation = vtk_to_numpy(volume.GetPointData().GetScalars()).astype(np.int16)
-        segmentation = segmentation.reshape(x_dim, y_dim, z_dim, order='F')
-        nrrd.write(path, segmentation, header)
+        writeCropVolume(volume, path)
 
     
     def save(self):
@@ -434,5 +459,7 @@ class CropModule(QWidget):
 
 
     def close(self):
+        if self.cache_thread is not None:
+            self.cache_thread.wait()
         self.slice_view.Finalize()
         self.volume_view.Finalize()
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pydicom
+from pydicom.pixel_data_handlers.util import apply_modality_lut
+
+from defaults import *
+
+
+def numberOfReaderThreads(threads=DICOM_READER_THREADS):
+    """
+    Resolves the configured number of decoder threads (0 -> all cores).
+    """
+    if threads is None or threads <= 0:
+        return os.cpu_count() or 1
+    return threads
+
+
+def readSliceHeader(path):
+    """
+    Reads a single DICOM file up to (excluding) the pixel data.
+    """
+    return pydicom.dcmread(path, stop_before_pixels=True)
+
+
+def decodeSlice(path):
+    """
+    Reads a single DICOM file and converts its pixel data to HU.
+    Returns the (rows x columns) HU array.
+    Pixel decoders (numpy, GDCM, pylibjpeg) release the GIL,
+    so this can be called concurrently from a thread pool.
+    """
+    ds = pydicom.dcmread(path)
+    return apply_modality_lut(ds.pixel_array, ds)
+
+
+def readSeriesGeometry(paths, threads=DICOM_READER_THREADS):
+    """
+    First import phase: reads only the headers of all slices.
+    Returns the slice paths sorted by slice location and a dict
+    with the volume geometry ('dimensions', 'spacing', 'origin').
+    """
+    with ThreadPoolExecutor(max_workers=numberOfReaderThreads(threads)) as executor:
+        headers = list(executor.map(readSliceHeader, paths))
+
+    locations = np.array([float(ds[0x0020, 0x1041].value) for ds in headers]) # slice location
+    order = np.argsort(locations, kind='stable')
+    first = headers[order[0]]
+
+    geometry = {}
+    geometry['dimensions'] = (int(first.Columns), int(first.Rows), len(paths))
+    s_x_y = first[0x0028, 0x0030].value # pixel spacing
+    s_z = float(first[0x0018, 0x0088].value) # spacing between slices
+    geometry['spacing'] = (float(s_x_y[0]), float(s_x_y[1]), s_z)
+    geometry['origin'] = [float(p) for p in first[0x0020, 0x0032].value] # image position
+    return [paths[i] for i in order], geometry
+
+
+def readSeries(paths, threads=DICOM_READER_THREADS, progress=None):
+    """
+    Two-phase import of a DICOM series.
+    The header pass determines the slice order and geometry, then all slices
+    are decoded on a thread pool directly into one preallocated int16 volume.
+    The volume is in (x, y, z) Fortran order, so it can be wrapped by VTK without copying.
+    Peak memory is about one volume.
+
+    Args:
+        paths (list): file paths of all slices
+        threads (int): number of decoder threads (0 -> all cores)
+        progress (callable): called with (index, filename) in slice order
+
+    Returns the volume array and the geometry dict of readSeriesGeometry().
+    """
+    sorted_paths, geometry = readSeriesGeometry(paths, threads)
+    volume = np.empty(geometry['dimensions'], dtype=np.int16, order='F')
+
+    def decodeInto(idx):
+        # slices are disjoint, so threads can write concurrently
+        volume[:,:,idx] = decodeSlice(sorted_paths[idx]).T
+
+    with ThreadPoolExecutor(max_workers=numberOfReaderThreads(threads)) as executor:
+        # map() yields in submission order -> ordered progress
+        for idx, _ in enumerate(executor.map(decodeInto, range(len(sorted_paths)))):
+            if progress is not None:
+                progress(idx, os.path.basename(sorted_paths[idx]))
+    return volume, geometry
@@ -0,0 +1,154 @@
+"""
+Brick-wise (incremental) surface extraction of a label map.
+The padded label volume is split into bricks of marching cubes cells. Surface
+patches are cached per brick and label, after an edit only the bricks touching
+the modified voxels are re-extracted. Patches are stitched (duplicate points on
+brick borders merged) and smoothed like a full extraction (Pipeline.extractSurface).
+"""
+
+import threading
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk
+
+from defaults import *
+from modules.Pipeline import createSmoothingPipeline
+
+
+class IncrementalSurface():
+    """
+    Cached surfaces of several labels of one label map geometry.
+    invalidate() can be called from any thread while update() is running.
+    """
+    def __init__(self, labels=(LABEL_LUMEN, LABEL_PLAQUE), brick_size=SURFACE_BRICK_SIZE):
+        """
+            Args:
+            labels (tuple): label values, update() returns one surface per label
+            brick_size (int): marching cubes cells per brick and axis
+        """
+        self.labels = labels
+        self.brick_size = brick_size
+        self.geometry = None           # (shape, spacing, origin) of the cached patches
+        self.patches = {}              # (label, brick index) -> vtkPolyData, bricks without label are missing
+        self.dirty = set()             # brick indices to re-extract
+        self.dirty_all = True          # re-extract all bricks
+        self.dirty_lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+
+    def invalidate(self, extent):
+        """
+        Marks the bricks touching voxels [x0:x1, y0:y1, z0:z1] for re-extraction.
+        """
+        with self.dirty_lock:
+            if self.geometry is None:
+                self.dirty_all = True
+                return
+            # a voxel v is a corner of the cells v-1 and v, padded cell index = cell + 1
+            ranges = []
+            for d in range(3):
+                last = self.__numberOfBricks(self.geometry[0][d]) - 1
+                ranges.append(range(max(extent[2*d], 0) // self.brick_size,
+                                    min(extent[2*d+1] // self.brick_size, last) + 1))
+            self.dirty.update((i, j, k) for i in ranges[0] for j in ranges[1] for k in ranges[2])
+
+
+    def invalidateAll(self):
+        with self.dirty_lock:
+            self.dirty_all = True
+
+
+    def update(self, data, spacing, origin, abort=None):
+        """
+        Re-extracts all invalidated bricks and returns the stitched, smoothed surfaces
+        (one vtkPolyData per label). A geometry change re-extracts everything.
+        abort() is polled between bricks and while smoothing. If it returns True,
+        None is returned and the remaining bricks stay invalidated.
+        """
+        with self.update_lock:
+            geometry = (tuple(data.shape), tuple(spacing), tuple(origin))
+            with self.dirty_lock:
+                if self.dirty_all or geometry != self.geometry:
+                    self.geometry = geometry
+                    self.patches = {}
+                    bricks = [(i, j, k)
+                              for i in range(self.__numberOfBricks(data.shape[0]))
+                              for j in range(self.__numberOfBricks(data.shape[1]))
+                              for k in range(self.__numberOfBricks(data.shape[2]))]
+                    self.dirty_all = False
+                    self.dirty = set()
+                else:
+                    bricks = sorted(self.dirty)
+                    self.dirty = set()
+
+            for n, brick in enumerate(bricks):
+                if abort is not None and abort():
+                    with self.dirty_lock:
+                        self.dirty.update(bricks[n:])
+                    return None
+                self.__extractBrick(data, spacing, origin, brick)
+
+            surfaces = []
+            for label in self.labels:
+                surface = self.__stitch(label, abort)
+                if surface is None:
+                    return None
+                surfaces.append(surface)
+            return surfaces
+
+
+    def __numberOfBricks(self, n):
+        # n voxels -> n+2 padded points -> n+1 cells
+        return (n + self.brick_size) // self.brick_size
+
+
+    def __extractBrick(self, data, spacing, origin, brick):
+        # point extent of the brick in padded voxel coordinates (-1 ... n), borders are shared
+        lo = [b * self.brick_size - 1 for b in brick]
+        hi = [min((b+1) * self.brick_size, n+1) - 1 for b, n in zip(brick, data.shape)]
+        block = np.zeros([h - l + 1 for l, h in zip(lo, hi)], dtype=np.uint8, order='F')
+        v0 = [max(l, 0) for l in lo]
+        v1 = [min(h, n-1) + 1 for h, n in zip(hi, data.shape)]
+        block[v0[0]-lo[0]:v1[0]-lo[0], v0[1]-lo[1]:v1[1]-lo[1], v0[2]-lo[2]:v1[2]-lo[2]] = \
+            data[v0[0]:v1[0], v0[1]:v1[1], v0[2]:v1[2]]
+
+        image = None
+        for label in self.labels:
+            self.patches.pop((label, brick), None)
+            if not np.any(block == label):
+                continue
+            if image is None:
+                # same origin and index coordinates as the padded full volume -> identical points
+                image = vtk.vtkImageData()
+                image.SetExtent(lo[0], hi[0], lo[1], hi[1], lo[2], hi[2])
+                image.SetSpacing(spacing)
+                image.SetOrigin(origin)
+                image.GetPointData().SetScalars(numpy_to_vtk(block.ravel(order='F')))
+            marching = vtk.vtkDiscreteMarchingCubes()
+            marching.SetInputData(image)
+            marching.GenerateValues(1, label, label)
+            marching.Update()
+            if marching.GetOutput().GetNumberOfCells() > 0:
+                patch = vtk.vtkPolyData()
+                patch.ShallowCopy(marching.GetOutput())
+                self.patches[(label, brick)] = patch
+
+
+    def __stitch(self, label, abort):
+        patches = [self.patches[key] for key in sorted(self.patches) if key[0] == label]
+        if not patches:
+            return vtk.vtkPolyData()
+        append = vtk.vtkAppendPolyData()
+        for patch in patches:
+            append.AddInputData(patch)
+        clean, smoother = createSmoothingPipeline(append.GetOutputPort())
+        if abort is not None:
+            for f in (clean, smoother):
+                f.AddObserver("ProgressEvent", lambda obj, event: obj.SetAbortExecute(1) if abort() else None)
+        smoother.Update()
+        if abort is not None and abort():
+            return None
+        surface = vtk.vtkPolyData()
+        surface.ShallowCopy(smoother.GetOutput())
+        return surface
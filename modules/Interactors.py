@@ -4,10 +4,12 @@ import numpy as np
 import nrrd
 import vtk
 from vtk.util.numpy_support import numpy_to_vtk
-from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 
 from defaults import *
+from modules.LabelMap import LabelMap
+from modules.IncrementalSurface import IncrementalSurface
 
 class ImageSliceInteractor(QVTKRenderWindowInteractor):
     """
@@ -122,46 +124,77 @@ class ImageSliceInteractor(QVTKRenderWindowInteractor):
 
 
 
+class SurfaceWorker(QObject):
+    """
+    Extracts the lumen and plaque surfaces of label map snapshots in a persistent thread.
+    Only bricks invalidated since the last extraction are re-meshed (IncrementalSurface).
+    Requests of an outdated generation are skipped, running extractions are aborted
+    as soon as a newer generation is requested.
+    """
+    surfaces_ready = pyqtSignal(object, object, int)
+    surface_engine = None
+    latest_generation = 0 # set by the GUI thread (per worker instance)
+
+
+    def extract(self, data, spacing, origin, generation):
+        if generation != self.latest_generation:
+            return
+        surfaces = self.surface_engine.update(data, spacing, origin,
+                                              lambda: generation != self.latest_generation)
+        if surfaces is not None:
+            self.surfaces_ready.emit(surfaces[0], surfaces[1], generation)
+
+
+
+
 class IsosurfaceInteractor(QVTKRenderWindowInteractor):
     """
     Displays a 3D view of an isosurface reconstructed from a segmentation.
     Interactions: Rotate, Zoom, Translate.
+    Surfaces are shown from held polydata (surface_lumen, surface_plaque).
+    updateScene() extracts them immediately, requestSurfaceUpdate() in the background.
+    Both only re-mesh the bricks of the label map that were marked modified.
     """
+    surface_requested = pyqtSignal(object, object, object, int)
     def __init__(self, parent=None):
         super().__init__(parent)
         self.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
 
-        # build isosurface, mapper, actor pipeline
-        self.padding = vtk.vtkImageConstantPad()
-        self.padding.SetConstant(0)
-
-        self.marching_lumen = vtk.vtkDiscreteMarchingCubes()
-        self.marching_lumen.SetInputConnection(self.padding.GetOutputPort())
-        self.marching_lumen.GenerateValues(1, 2, 2)
-        self.clean_lumen = vtk.vtkCleanPolyData()
-        self.clean_lumen.SetInputConnection(self.marching_lumen.GetOutputPort())
-        self.smoother_lumen = vtk.vtkWindowedSincPolyDataFilter()
-        self.smoother_lumen.SetInputConnection(self.clean_lumen.GetOutputPort())
-        self.smoother_lumen.SetNumberOfIterations(20)
-        self.smoother_lumen.SetPassBand(0.005)
+        # state
+        self.surface_generation = 0    # surfaces of older generations are not shown
+        self.surface_mtime = None      # modification time of the label map the surfaces show
+        self.pending_labels = None     # label map of a debounced surface update
+        self.pending_mtime = None      # modification time of the label map being extracted
+        self.camera_reset_pending = False # reset the camera when the next background surfaces arrive
+
+        # held surfaces, new surfaces are copied in (connected pipelines follow)
+        self.surface_lumen = vtk.vtkPolyData()
+        self.surface_plaque = vtk.vtkPolyData()
+        self.surface_engine = IncrementalSurface(labels=(LABEL_LUMEN, LABEL_PLAQUE))
+
+        # background surface extraction
+        self.surface_timer = QTimer(self)
+        self.surface_timer.setSingleShot(True)
+        self.surface_timer.setInterval(SURFACE_UPDATE_DEBOUNCE_MS)
+        self.surface_timer.timeout.connect(self.startSurfaceUpdate)
+        self.surface_thread = QThread()
+        self.surface_worker = SurfaceWorker()
+        self.surface_worker.surface_engine = self.surface_engine
+        self.surface_worker.moveToThread(self.surface_thread)
+        self.surface_requested[object, object, object, int].connect(self.surface_worker.extract)
+        self.surface_worker.surfaces_ready[object, object, int].connect(self.setSurfaces)
+        self.surface_thread.start()
+
+        # mapper, actor pipeline
         self.mapper_lumen = vtk.vtkPolyDataMapper()
-        self.mapper_lumen.SetInputConnection(self.smoother_lumen.GetOutputPort())
+        self.mapper_lumen.SetInputData(self.surface_lumen)
         self.mapper_lumen.ScalarVisibilityOff()
         self.actor_lumen = vtk.vtkActor()
         self.actor_lumen.GetProperty().SetColor(COLOR_LUMEN)
         self.actor_lumen.SetMapper(self.mapper_lumen)
 
-        self.marching_plaque = vtk.vtkDiscreteMarchingCubes()
-        self.marching_plaque.SetInputConnection(self.padding.GetOutputPort())
-        self.marching_plaque.GenerateValues(1, 1, 1)
-        self.clean_plaque = vtk.vtkCleanPolyData()
-        self.clean_plaque.SetInputConnection(self.marching_plaque.GetOutputPort())
-        self.smoother_plaque = vtk.vtkWindowedSincPolyDataFilter()
-        self.smoother_plaque.SetInputConnection(self.clean_plaque.GetOutputPort())
-        self.smoother_plaque.SetNumberOfIterations(20)
-        self.smoother_plaque.SetPassBand(0.005)
         self.mapper_plaque = vtk.vtkPolyDataMapper()
-        self.mapper_plaque.SetInputConnection(self.smoother_plaque.GetOutputPort())
+        self.mapper_plaque.SetInputData(self.surface_plaque)
         self.mapper_plaque.ScalarVisibilityOff()
         self.actor_plaque = vtk.vtkActor()
         self.actor_plaque.GetProperty().SetColor(COLOR_PLAQUE)
@@ -186,18 +219,12 @@ class IsosurfaceInteractor(QVTKRenderWindowInteractor):
         label_dim = header['sizes']
 
         if src_image is None:
-            label_map = vtk.vtkImageData()
-            label_map.SetDimensions(label_dim)
-            label_map.SetSpacing(label_spacing)
-            label_map.SetOrigin(label_origin)
-            vtk_data_array = numpy_to_vtk(img_data.ravel(order='F'))
-            label_map.GetPointData().SetScalars(vtk_data_array)
-            label_map_data = img_data
+            labels = LabelMap(label_dim, label_spacing, label_origin, img_data)
         else:
             src_origin = np.array(src_image.GetOrigin())
             src_spacing = np.array(src_image.GetSpacing())
             src_dim = np.array(src_image.GetDimensions())
-            label_map_data = np.zeros(src_dim, dtype=np.uint8)
+            labels = LabelMap(src_dim, src_spacing, src_origin)
 
             if np.sign(label_spacing[0]) != np.sign(src_spacing[0]):
                 label_origin[0] += (label_dim[0]-1) * label_spacing[0]
@@ -215,37 +242,31 @@ class IsosurfaceInteractor(QVTKRenderWindowInteractor):
                 img_data_crop = img_data[-1*min(0, v[0]):min(label_dim[0],src_dim[0]-v[0]),
                                          -1*min(0, v[1]):min(label_dim[1],src_dim[1]-v[1]),
                                          -1*min(0, v[2]):min(label_dim[2],src_dim[2]-v[2])]
-                label_map_data[max(0, v[0]):min(v[0]+label_dim[0], src_dim[0]),
+                labels.data[max(0, v[0]):min(v[0]+label_dim[0], src_dim[0]),
                         max(0, v[1]):min(v[1]+label_dim[1], src_dim[1]),
                         max(0, v[2]):min(v[2]+label_dim[2], src_dim[2])] = img_data_crop
-
-            label_map = vtk.vtkImageData()
-            label_map.SetDimensions(src_dim)
-            label_map.SetSpacing(src_spacing)
-            label_map.SetOrigin(src_origin)
-            vtk_data_array = numpy_to_vtk(label_map_data.ravel(order='F'))
-            label_map.GetPointData().SetScalars(vtk_data_array)
         
-        # add padding, update scene actors
-        plaque_pending, lumen_pending = self.updateScene(label_map_data, label_map)
+        # extract surfaces, update scene actors
+        plaque_pending, lumen_pending = self.updateScene(labels)
                 
-        # return pointer to label map if needed, return pending labels
-        return label_map, plaque_pending, lumen_pending
+        # return label map (shared numpy/VTK buffer), return pending labels
+        return labels, plaque_pending, lumen_pending
 
-    def updateScene(self, label_map_data, label_map_vtk):
-        extent = np.array(label_map_vtk.GetExtent())
-        extent += np.array([-1, 1, -1, 1, -1, 1])
-        self.padding.SetInputData(label_map_vtk)
-        self.padding.SetOutputWholeExtent(extent)
+    def updateScene(self, labels, new_label_map=True):
+        """
+        Extracts the surfaces of a LabelMap and shows the actors of existing labels.
+        new_label_map=False re-meshes only the bricks marked modified in labels.
+        """
+        self.updateSurfaces(labels, new_label_map)
 
-        if 1.0 in label_map_data:
+        if labels.contains(LABEL_PLAQUE):
             self.renderer.AddActor(self.actor_plaque)
             plaque_pending = False
         else:
             self.renderer.RemoveActor(self.actor_plaque)
             plaque_pending = True
 
-        if 2.0 in label_map_data:
+        if labels.contains(LABEL_LUMEN):
             self.renderer.AddActor(self.actor_lumen)
             lumen_pending = False
         else:
@@ -258,7 +279,90 @@ class IsosurfaceInteractor(QVTKRenderWindowInteractor):
         return plaque_pending, lumen_pending
 
 
+    def updateSurfaces(self, labels, new_label_map=False):
+        """
+        Extracts the surfaces of a LabelMap in the calling (GUI) thread.
+        Pending and running background updates are discarded.
+        """
+        self.surface_timer.stop()
+        self.pending_labels = None
+        self.surface_generation += 1
+        self.surface_worker.latest_generation = self.surface_generation
+        self.__invalidateSurfaces(labels, new_label_map)
+        lumen, plaque = self.surface_engine.update(labels.data, labels.image.GetSpacing(), labels.image.GetOrigin())
+        self.surface_lumen.ShallowCopy(lumen)
+        self.surface_plaque.ShallowCopy(plaque)
+        self.surface_mtime = labels.image.GetMTime()
+
+
+    def __invalidateSurfaces(self, labels, new_label_map):
+        extent = labels.takeDirtyExtent()
+        if new_label_map:
+            self.surface_engine.invalidateAll()
+        elif extent is not None:
+            self.surface_engine.invalidate(extent)
+
+
+    def surfacesCurrent(self, label_map_vtk):
+        """
+        True if the shown surfaces belong to the current state of the label map.
+        """
+        return self.surface_mtime == label_map_vtk.GetMTime()
+
+
+    def requestSurfaceUpdate(self, labels):
+        """
+        Schedules a background surface update of a LabelMap. Requests within
+        SURFACE_UPDATE_DEBOUNCE_MS are merged, a running update of older data is aborted.
+        """
+        self.pending_labels = labels
+        self.surface_generation += 1
+        self.surface_worker.latest_generation = self.surface_generation
+        self.surface_timer.start()
+
+
+    def startSurfaceUpdate(self):
+        if self.pending_labels is None:
+            return
+        labels = self.pending_labels
+        self.pending_labels = None
+        self.__invalidateSurfaces(labels, False)
+        self.pending_mtime = labels.image.GetMTime()
+        self.surface_requested.emit(np.array(labels.data, order='F'), labels.image.GetSpacing(),
+                                    labels.image.GetOrigin(), self.surface_generation)
+
+
+    def setSurfaces(self, lumen, plaque, generation):
+        # swap both surfaces before the next render
+        if generation != self.surface_generation:
+            return
+        self.surface_lumen.ShallowCopy(lumen)
+        self.surface_plaque.ShallowCopy(plaque)
+        self.surface_mtime = self.pending_mtime
+        if self.camera_reset_pending:
+            self.renderer.ResetCamera()
+            self.camera_reset_pending = False
+        self.GetRenderWindow().Render()
+
+
+    def stopSurfaceUpdates(self):
+        self.surface_timer.stop()
+        self.surface_generation += 1
+        self.surface_worker.latest_generation = self.surface_generation
+        self.surface_thread.quit()
+        self.surface_thread.wait()
+
+
     def reset(self):
+        # the next label map is new, cached surface bricks are invalid
+        self.surface_timer.stop()
+        self.pending_labels = None
+        self.surface_generation += 1
+        self.surface_worker.latest_generation = self.surface_generation
+        self.surface_engine.invalidateAll()
+        self.surface_lumen.Initialize()
+        self.surface_plaque.Initialize()
+        self.surface_mtime = None
         self.renderer.RemoveActor(self.actor_lumen)
         self.renderer.RemoveActor(self.actor_plaque)
         self.GetRenderWindow().Render()
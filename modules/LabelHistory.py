@@ -0,0 +1,108 @@
+"""
+Undo/redo of label map edits.
+Each edit is stored as a sparse delta: the changed voxels as runs of consecutive
+(Fortran order) indices plus run-length encoded old and new values.
+A brush stroke of a few thousand voxels takes some kilobytes instead of a 4 MB snapshot.
+"""
+
+from collections import deque
+
+import numpy as np
+
+from defaults import *
+
+
+def runLengthEncode(values):
+    """
+    Returns (run values, run lengths) of a 1D array.
+    """
+    starts = np.flatnonzero(np.diff(values)) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+    return values[starts], lengths.astype(np.uint32)
+
+
+class LabelDelta():
+    """
+    Compressed changes of one edit (see LabelMap.endRecording()).
+    """
+    def __init__(self, indices, old_values, new_values):
+        # runs of consecutive voxel indices, e.g. the x rows of a brush
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        self.run_starts = indices[starts].astype(np.uint32)
+        self.run_lengths = np.diff(np.concatenate((starts, [len(indices)]))).astype(np.uint32)
+        self.old_values = runLengthEncode(old_values)
+        self.new_values = runLengthEncode(new_values)
+        self.nbytes = sum(a.nbytes for a in (self.run_starts, self.run_lengths) +
+                          self.old_values + self.new_values)
+
+
+    def indices(self):
+        lengths = self.run_lengths.astype(np.int64)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(self.run_starts.astype(np.int64), lengths) + offsets
+
+
+    def oldValues(self):
+        return np.repeat(*self.old_values)
+
+
+    def newValues(self):
+        return np.repeat(*self.new_values)
+
+
+
+class LabelHistory():
+    """
+    Undo and redo stacks of LabelDeltas of one LabelMap.
+    The oldest undo steps are dropped if the deltas exceed memory_limit bytes.
+    """
+    def __init__(self, labels, memory_limit=UNDO_MEMORY_LIMIT):
+        self.labels = labels
+        self.memory_limit = memory_limit
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+
+    def push(self, changes):
+        """
+        Adds the changes of an edit (LabelMap.endRecording()), clears the redo stack.
+        """
+        if changes is None:
+            return
+        delta = LabelDelta(*changes)
+        self.undo_stack.append(delta)
+        self.nbytes += delta.nbytes
+        for d in self.redo_stack:
+            self.nbytes -= d.nbytes
+        self.redo_stack = []
+        while self.nbytes > self.memory_limit and self.undo_stack:
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+
+    def canUndo(self):
+        return len(self.undo_stack) > 0
+
+
+    def canRedo(self):
+        return len(self.redo_stack) > 0
+
+
+    def undo(self):
+        if not self.undo_stack:
+            return False
+        delta = self.undo_stack.pop()
+        self.labels.applyChanges(delta.indices(), delta.oldValues())
+        self.redo_stack.append(delta)
+        return True
+
+
+    def redo(self):
+        if not self.redo_stack:
+            return False
+        delta = self.redo_stack.pop()
+        self.labels.applyChanges(delta.indices(), delta.newValues())
+        self.undo_stack.append(delta)
+        return True
@@ -0,0 +1,231 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk
+
+
+def boundingBox(mask):
+    """
+    Returns the box (x0, x1, y0, y1, z0, z1) of the True voxels of a 3D mask, or None.
+    """
+    box = []
+    for axis in range(3):
+        indices = np.flatnonzero(mask.any(axis=tuple(a for a in range(3) if a != axis)))
+        if len(indices) == 0:
+            return None
+        box += [int(indices[0]), int(indices[-1]) + 1]
+    return box
+
+
+class LabelMap():
+    """
+    Segmentation label map (uint8) in a single Fortran-ordered buffer.
+    The numpy array (x, y, z indices) and the vtkImageData share the memory,
+    edits of data only have to be announced with markModified(), nothing is copied.
+
+    Voxel counts and bounding boxes of all labels are maintained by paint() and
+    setData(), other writes to data have to be followed by recount().
+    """
+    def __init__(self, dimensions, spacing, origin, data=None):
+        """
+            Args:
+            dimensions (tuple): (x, y, z) number of voxels
+            spacing (tuple): voxel spacing
+            origin (tuple): image origin
+            data (numpy array): initial labels (copied), empty label map if None
+        """
+        self.data = np.zeros(tuple(int(d) for d in dimensions), dtype=np.uint8, order='F')
+        if data is not None:
+            self.data[:] = data
+        self.image = vtk.vtkImageData()
+        self.image.SetDimensions(self.data.shape)
+        self.image.SetSpacing(spacing)
+        self.image.SetOrigin(origin)
+
+        # Fortran order == VTK point order, ravel returns a view
+        self.scalars = numpy_to_vtk(self.data.ravel(order='F'))
+        self.image.GetPointData().SetScalars(self.scalars)
+        self.dirty_extent = None # [x0, x1, y0, y1, z0, z1) modified since takeDirtyExtent()
+        self.counts = None       # voxels per label value (256 bins)
+        self.boxes = {}          # label -> [x0, x1, y0, y1, z0, z1) containing all its voxels
+        self.loose_boxes = set() # labels whose box may be larger than necessary
+        self.recording = None    # (flat indices, old values) of changes since beginRecording()
+        self.recount()
+
+
+    def markModified(self, x0=0, x1=None, y0=0, y1=None, z0=0, z1=None):
+        """
+        Announces that voxels [x0:x1, y0:y1, z0:z1] of data were changed (default: all).
+        Constant cost, the VTK pipeline re-executes only for the extents it requests
+        (e.g. the displayed slice). Modified boxes are merged until takeDirtyExtent().
+        """
+        shape = self.data.shape
+        box = [x0, shape[0] if x1 is None else x1,
+               y0, shape[1] if y1 is None else y1,
+               z0, shape[2] if z1 is None else z1]
+        if self.dirty_extent is None:
+            self.dirty_extent = box
+        else:
+            for i in (0, 2, 4):
+                self.dirty_extent[i] = min(self.dirty_extent[i], box[i])
+                self.dirty_extent[i+1] = max(self.dirty_extent[i+1], box[i+1])
+        self.scalars.Modified()
+        self.image.Modified()
+
+
+    def takeDirtyExtent(self):
+        """
+        Returns the box modified since the last call (x0, x1, y0, y1, z0, z1) or None.
+        """
+        box = self.dirty_extent
+        self.dirty_extent = None
+        return None if box is None else tuple(box)
+
+
+    def setData(self, data):
+        """
+        Replaces all labels (copied into the shared buffer).
+        Only the bounding box of the changed voxels is marked modified.
+        """
+        changed = self.data != data
+        box = boundingBox(changed)
+        if box is None:
+            return
+        if self.recording is not None:
+            indices = np.flatnonzero(changed.ravel(order='F'))
+            self.recording.append((indices, self.data.ravel(order='F')[indices]))
+        self.data[:] = data
+        self.recount()
+        self.markModified(*box)
+
+
+    def recount(self):
+        """
+        Recomputes the voxel counts (one bincount), bounding boxes are tightened on request.
+        """
+        self.counts = np.bincount(self.data.ravel(order='F'), minlength=256)
+        full_box = [0, self.data.shape[0], 0, self.data.shape[1], 0, self.data.shape[2]]
+        labels = np.flatnonzero(self.counts)
+        self.boxes = {int(label): list(full_box) for label in labels if label != 0}
+        self.loose_boxes = set(self.boxes)
+
+
+    def paint(self, x0, x1, y0, y1, z0, z1, mask, value):
+        """
+        Sets the voxels of data[x0:x1, y0:y1, z0:z1] selected by mask (boolean array
+        of the box shape) to value. Updates counts and boxes and marks the box modified.
+        """
+        region = self.data[x0:x1, y0:y1, z0:z1]
+        old_counts = np.bincount(region[mask], minlength=256)
+        if old_counts.sum() == 0:
+            return
+        if self.recording is not None:
+            changed = mask & (region != value)
+            xs, ys, zs = np.nonzero(changed)
+            indices = np.ravel_multi_index((xs + x0, ys + y0, zs + z0), self.data.shape, order='F')
+            self.recording.append((indices, region[changed]))
+        region[mask] = value
+        had_value = self.counts[value] > 0
+        self.counts -= old_counts
+        self.counts[value] += old_counts.sum()
+
+        # overwritten labels may have shrunk, the painted label grows by the mask box
+        for label in np.flatnonzero(old_counts):
+            if label != value and label != 0:
+                self.loose_boxes.add(int(label))
+        if value != 0:
+            box = boundingBox(mask)
+            box = [box[i] + (x0, x0, y0, y0, z0, z0)[i] for i in range(6)]
+            if had_value:
+                old = self.boxes[value]
+                box = [min(old[i], box[i]) if i % 2 == 0 else max(old[i], box[i]) for i in range(6)]
+            self.boxes[value] = box
+        self.markModified(x0, x1, y0, y1, z0, z1)
+
+
+    def beginRecording(self):
+        """
+        Starts collecting the voxels changed by paint() and setData().
+        """
+        self.recording = []
+
+
+    def endRecording(self):
+        """
+        Returns the changes since beginRecording() as (flat indices in Fortran order,
+        old values, new values), each voxel once and sorted, or None if nothing changed.
+        """
+        recording = self.recording
+        self.recording = None
+        if not recording:
+            return None
+        indices = np.concatenate([r[0] for r in recording])
+        old_values = np.concatenate([r[1] for r in recording])
+        # np.unique returns the first occurrence -> value before the first change
+        indices, first = np.unique(indices, return_index=True)
+        old_values = old_values[first]
+        new_values = self.data.ravel(order='F')[indices]
+        changed = old_values != new_values # painted and erased again
+        if not changed.any():
+            return None
+        return indices[changed], old_values[changed], new_values[changed]
+
+
+    def applyChanges(self, indices, values):
+        """
+        Writes values to the flat (Fortran order) voxel indices, e.g. to undo an edit.
+        Counts and boxes are updated and the box of the indices is marked modified.
+        """
+        flat = self.data.ravel(order='F') # view
+        old_counts = np.bincount(flat[indices], minlength=256)
+        new_counts = np.bincount(values, minlength=256)
+        flat[indices] = values
+        self.counts += new_counts - old_counts
+
+        xs, ys, zs = np.unravel_index(indices, self.data.shape, order='F')
+        box = [int(xs.min()), int(xs.max()) + 1, int(ys.min()), int(ys.max()) + 1, int(zs.min()), int(zs.max()) + 1]
+        for label in np.flatnonzero(old_counts):
+            if label != 0:
+                self.loose_boxes.add(int(label))
+        for label in np.flatnonzero(new_counts):
+            label = int(label)
+            if label == 0:
+                continue
+            if label in self.boxes and self.counts[label] > new_counts[label]:
+                old = self.boxes[label]
+                self.boxes[label] = [min(old[i], box[i]) if i % 2 == 0 else max(old[i], box[i]) for i in range(6)]
+            else:
+                self.boxes[label] = list(box)
+            self.loose_boxes.add(label)
+        self.markModified(*box)
+
+
+    def count(self, label):
+        return int(self.counts[label])
+
+
+    def contains(self, label):
+        return self.counts[label] > 0
+
+
+    def volume(self, label):
+        """
+        Volume of a label in cubic units of the spacing (mm^3).
+        """
+        return self.count(label) * abs(float(np.prod(self.image.GetSpacing())))
+
+
+    def boundingBox(self, label):
+        """
+        Returns the box [x0, x1, y0, y1, z0, z1) of a label, or None if it does not exist.
+        A box that may have shrunk is tightened by scanning only inside of it.
+        """
+        if not self.contains(label):
+            return None
+        box = self.boxes[label]
+        if label in self.loose_boxes:
+            x0, x1, y0, y1, z0, z1 = box
+            tight = boundingBox(self.data[x0:x1, y0:y1, z0:z1] == label)
+            box = [tight[i] + box[2*(i//2)] for i in range(6)]
+            self.boxes[label] = box
+            self.loose_boxes.discard(label)
+        return tuple(box)
@@ -0,0 +1,114 @@
+import os
+import zlib
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nrrd
+
+from defaults import *
+
+NRRD_TYPES = {
+    np.dtype(np.int8): 'signed char',
+    np.dtype(np.uint8): 'unsigned char',
+    np.dtype(np.int16): 'short',
+    np.dtype(np.uint16): 'unsigned short',
+    np.dtype(np.int32): 'int',
+    np.dtype(np.uint32): 'unsigned int',
+    np.dtype(np.int64): 'long long int',
+    np.dtype(np.uint64): 'unsigned long long int',
+    np.dtype(np.float32): 'float',
+    np.dtype(np.float64): 'double',
+}
+
+# fields written in this order, all other header keys are written as key:=value pairs
+NRRD_FIELDS = ['type', 'dimension', 'space', 'sizes', 'space directions', 'kinds', 'endian', 'encoding', 'space origin']
+
+
+def numberOfWriterThreads(threads=NRRD_WRITE_THREADS):
+    if threads is None or threads <= 0:
+        return os.cpu_count() or 1
+    return threads
+
+
+def writeNrrd(path, data, header, encoding=NRRD_ENCODING, level=NRRD_COMPRESSION_LEVEL, threads=NRRD_WRITE_THREADS):
+    """
+    Writes an array in (x, y, z) order to a NRRD file.
+    The header is used as given, except for the encoding.
+
+    Args:
+        path (str): target file
+        data (numpy array): volume data
+        header (dict): NRRD header (pynrrd style)
+        encoding (str): 'raw' or 'gzip'
+        level (int): gzip compression level (1 fastest, 9 smallest)
+        threads (int): compression threads for gzip (0 -> all cores)
+    """
+    header = OrderedDict(header)
+    header['encoding'] = encoding
+    threads = numberOfWriterThreads(threads)
+
+    if encoding != 'gzip' or threads <= 1 or data.nbytes <= NRRD_GZIP_CHUNK_SIZE:
+        nrrd.write(path, data, header, compression_level=level)
+        return
+
+    # chunked parallel gzip
+    data = data.astype(data.dtype.newbyteorder('<'), copy=False)
+    header['type'] = NRRD_TYPES[np.dtype(data.dtype.name)]
+    header['dimension'] = data.ndim
+    header['sizes'] = data.shape
+    header['endian'] = 'little'
+    buffer = memoryview(np.asfortranarray(data).T).cast('B') # fortran order bytes, no copy if possible
+    with open(path, 'wb') as f:
+        f.write(_formatHeader(header).encode('ascii'))
+        _writeParallelGzip(f, buffer, level, threads)
+
+
+def _formatValue(key, value):
+    if isinstance(value, str):
+        return value
+    if key in ('space directions', 'space origin'):
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim == 1:
+            return '(' + ','.join(f'{v:.17g}' for v in value) + ')'
+        return ' '.join('(' + ','.join(f'{v:.17g}' for v in row) + ')' for row in value)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return ' '.join(str(v) for v in value)
+    return str(value)
+
+
+def _formatHeader(header):
+    lines = ['NRRD0004',
+             '# Complete NRRD file format specification at:',
+             '# http://teem.sourceforge.net/nrrd/format.html']
+    for key in NRRD_FIELDS:
+        if key in header:
+            lines.append(key + ': ' + _formatValue(key, header[key]))
+    for key, value in header.items():
+        if key not in NRRD_FIELDS:
+            lines.append(key + ':=' + _formatValue(key, value))
+    return '\n'.join(lines) + '\n\n' # empty line separates header and data
+
+
+def _writeParallelGzip(f, buffer, level, threads):
+    """
+    Compresses chunks as raw deflate streams on a thread pool (zlib releases the GIL).
+    All but the last chunk end with a sync flush, so their concatenation
+    is one valid deflate stream inside a single gzip member (like pigz).
+    """
+    chunk_size = NRRD_GZIP_CHUNK_SIZE
+    nr_chunks = max(1, -(-len(buffer) // chunk_size))
+
+    def compressChunk(i):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        out = compressor.compress(buffer[i*chunk_size:(i+1)*chunk_size])
+        return out + compressor.flush(zlib.Z_FINISH if i == nr_chunks-1 else zlib.Z_SYNC_FLUSH)
+
+    f.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff') # gzip header: deflate, no flags/mtime, unknown OS
+    crc = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for i, block in enumerate(executor.map(compressChunk, range(nr_chunks))):
+            f.write(block)
+            crc = zlib.crc32(buffer[i*chunk_size:(i+1)*chunk_size], crc)
+    f.write(struct.pack('<II', crc & 0xffffffff, len(buffer) & 0xffffffff))
@@ -0,0 +1,281 @@
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
+from PyQt5.QtGui import QColor
+
+from defaults import *
+from modules.CaseIndex import CASE_STAGES
+
+# status filters of the data inspector: (name, function(patient dict) -> bool)
+STATUS_FILTERS = [("All cases", lambda p: True)]
+for _name, _left, _right in CASE_STAGES:
+    STATUS_FILTERS.append((_name + " missing",
+        lambda p, l=_left, r=_right: not (p[l] and p[r])))
+    STATUS_FILTERS.append((_name + " complete",
+        lambda p, l=_left, r=_right: bool(p[l] and p[r])))
+
+
+def completedStages(patient_dict, side):
+    """
+    Number of pipeline stages that exist for one side (1 left, 2 right).
+    """
+    return sum(1 for stage in CASE_STAGES if patient_dict[stage[side]])
+
+
+class PatientTreeModel(QAbstractItemModel):
+    """
+    Two level model of the data inspector: one row per case, one child row per pipeline stage.
+    Rows are not materialized. Only the (filtered, sorted) list of patient IDs is kept,
+    the view fetches top level rows in batches of PATIENT_TREE_FETCH_SIZE and
+    the stage rows of a case once it is expanded. All cell data is read from the case index.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.case_index = None
+        self.patient_IDs = []       # filtered and sorted patient IDs (top level rows)
+        self.patient_rows = {}      # patient ID -> row
+        self.internal_IDs = {}      # patient ID -> stable internal ID of its stage rows (> 0)
+        self.internal_patients = [None] # internal ID -> patient ID
+        self.rows_fetched = 0       # number of top level rows the view knows about
+        self.children_fetched = set() # patient IDs with fetched stage rows
+        self.active_patient_ID = None
+        self.filter_text = ""
+        self.status_filter = 0      # index into STATUS_FILTERS
+        self.sort_column = 0
+        self.sort_order = Qt.AscendingOrder
+
+
+    def setCaseIndex(self, case_index):
+        self.case_index = case_index
+        self.active_patient_ID = None
+        self.__rebuild()
+
+
+    def setFilter(self, text=None, status_filter=None):
+        if text is not None:
+            self.filter_text = text
+        if status_filter is not None:
+            self.status_filter = status_filter
+        self.__rebuild()
+
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self.__rebuild()
+
+
+    def setActivePatient(self, patient_ID):
+        last_patient_ID = self.active_patient_ID
+        self.active_patient_ID = patient_ID
+        self.__emitPatientChanged(last_patient_ID)
+        self.__emitPatientChanged(patient_ID)
+
+
+    def patientChanged(self, patient_ID):
+        """
+        Applies an added, modified or removed case without touching other rows.
+        Sort order is not updated for modified cases, they keep their row until the next sort.
+        """
+        row = self.__row(patient_ID)
+        patient_dict = self.case_index.cases.get(patient_ID) if self.case_index else None
+        visible = patient_dict is not None and self.__accepts(patient_dict)
+
+        if row is not None and not visible:
+            if row < self.rows_fetched:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.patient_IDs[row]
+                self.__updateRows()
+                self.rows_fetched -= 1
+                self.endRemoveRows()
+            else:
+                del self.patient_IDs[row]
+                self.__updateRows()
+            self.children_fetched.discard(patient_ID)
+        elif row is None and visible:
+            # rows before the new case in sort order
+            key = self.__sortKey(patient_ID)
+            if self.sort_order == Qt.DescendingOrder:
+                row = sum(1 for pID in self.patient_IDs if self.__sortKey(pID) > key)
+            else:
+                row = sum(1 for pID in self.patient_IDs if self.__sortKey(pID) < key)
+            if row <= self.rows_fetched:
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.patient_IDs.insert(row, patient_ID)
+                self.__updateRows()
+                self.rows_fetched += 1
+                self.endInsertRows()
+            else:
+                self.patient_IDs.insert(row, patient_ID)
+                self.__updateRows()
+        elif row is not None:
+            self.__emitPatientChanged(patient_ID)
+
+
+    def patientID(self, index):
+        """
+        Returns the patient ID of a case or stage row, None for invalid indices.
+        """
+        if not index.isValid():
+            return None
+        if index.internalId() == 0:
+            return self.patient_IDs[index.row()]
+        return self.internal_patients[index.internalId()]
+
+
+    def indexOfPatient(self, patient_ID):
+        row = self.__row(patient_ID)
+        if row is None or row >= self.rows_fetched:
+            return QModelIndex()
+        return self.index(row, 0)
+
+
+    ###########################
+    # QAbstractItemModel API  #
+    ###########################
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        # stage rows store the internal ID of their case (0 marks case rows),
+        # it stays valid when case rows are inserted or removed above
+        return self.createIndex(row, column, self.__internalID(self.patient_IDs[parent.row()]))
+
+
+    def parent(self, index):
+        if not index.isValid() or index.internalId() == 0:
+            return QModelIndex()
+        row = self.patient_rows.get(self.internal_patients[index.internalId()])
+        if row is None:
+            return QModelIndex()
+        return self.createIndex(row, 0, 0)
+
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return self.rows_fetched
+        if parent.internalId() != 0 or parent.column() != 0:
+            return 0
+        if self.patient_IDs[parent.row()] in self.children_fetched:
+            return len(CASE_STAGES)
+        return 0
+
+
+    def columnCount(self, parent=QModelIndex()):
+        return 3
+
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self.patient_IDs) > 0
+        return parent.internalId() == 0 and parent.column() == 0
+
+
+    def canFetchMore(self, parent):
+        if not parent.isValid():
+            return self.rows_fetched < len(self.patient_IDs)
+        if parent.internalId() == 0:
+            return self.patient_IDs[parent.row()] not in self.children_fetched
+        return False
+
+
+    def fetchMore(self, parent):
+        if not parent.isValid():
+            count = min(PATIENT_TREE_FETCH_SIZE, len(self.patient_IDs) - self.rows_fetched)
+            if count <= 0:
+                return
+            self.beginInsertRows(QModelIndex(), self.rows_fetched, self.rows_fetched + count - 1)
+            self.rows_fetched += count
+            self.endInsertRows()
+        elif parent.internalId() == 0:
+            patient_ID = self.patient_IDs[parent.row()]
+            if patient_ID in self.children_fetched:
+                return
+            self.beginInsertRows(parent, 0, len(CASE_STAGES) - 1)
+            self.children_fetched.add(patient_ID)
+            self.endInsertRows()
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        patient_ID = self.patientID(index)
+
+        if role == Qt.DisplayRole:
+            if index.internalId() == 0:
+                return patient_ID if index.column() == 0 else ""
+            stage = CASE_STAGES[index.row()]
+            if index.column() == 0:
+                return stage[0]
+            return SYM_YES if self.case_index.cases[patient_ID][stage[index.column()]] else SYM_NO
+        if role == Qt.BackgroundRole and patient_ID == self.active_patient_ID:
+            return QColor(*COLOR_SELECTED)
+        return None
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ("Patient ID", "Left", "Right")[section]
+        return None
+
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+
+    ###########################
+    # private                 #
+    ###########################
+    def __rebuild(self):
+        self.beginResetModel()
+        self.rows_fetched = 0
+        self.children_fetched = set()
+        if self.case_index is None:
+            self.patient_IDs = []
+        else:
+            # only patient IDs and dict lookups, no rows are created
+            self.patient_IDs = [pID for pID, p in self.case_index.cases.items() if self.__accepts(p)]
+            self.patient_IDs.sort(key=self.__sortKey, reverse=self.sort_order == Qt.DescendingOrder)
+        self.__updateRows()
+        self.endResetModel()
+
+
+    def __updateRows(self):
+        self.patient_rows = {pID: row for row, pID in enumerate(self.patient_IDs)}
+
+
+    def __internalID(self, patient_ID):
+        internal_ID = self.internal_IDs.get(patient_ID)
+        if internal_ID is None:
+            internal_ID = len(self.internal_patients)
+            self.internal_IDs[patient_ID] = internal_ID
+            self.internal_patients.append(patient_ID)
+        return internal_ID
+
+
+    def __accepts(self, patient_dict):
+        if self.filter_text and self.filter_text.lower() not in patient_dict['patient_ID'].lower():
+            return False
+        return STATUS_FILTERS[self.status_filter][1](patient_dict)
+
+
+    def __sortKey(self, patient_ID):
+        if self.sort_column == 0:
+            return patient_ID
+        # completion status of the sorted side, ties in ID order
+        return (completedStages(self.case_index.cases[patient_ID], self.sort_column), patient_ID)
+
+
+    def __row(self, patient_ID):
+        return self.patient_rows.get(patient_ID)
+
+
+    def __emitPatientChanged(self, patient_ID):
+        row = self.__row(patient_ID)
+        if row is None or row >= self.rows_fetched:
+            return
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 2))
+        if patient_ID in self.children_fetched:
+            parent = self.index(row, 0)
+            self.dataChanged.emit(self.index(0, 0, parent), self.index(len(CASE_STAGES) - 1, 2, parent))
@@ -0,0 +1,389 @@
+"""
+Qt-free processing stages of the pipeline.
+Used by the GUI modules and by the batch runner (batch.py).
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import nrrd
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from vmtk.vtkvmtkComputationalGeometryPython import vtkvmtkPolyDataCenterlines
+from vmtk.vtkvmtkMiscPython import vtkvmtkPolyDataSurfaceRemeshing
+
+from defaults import *
+from modules.NrrdWriter import writeNrrd
+from modules.CenterlineCache import surfaceKey, loadCenterlineCache, writeCenterlineCache
+
+CROP_DIMENSIONS = (120, 144, 248) # fixed model input size
+
+
+###########################
+# crop                    #
+###########################
+def cropVolume(image, center, z_height=CROP_Z_HEIGHT):
+    """
+    Crops a VOI of z_height voxels around a center (discrete image coordinates)
+    and resamples it to the model input size.
+    """
+    y_height = int(np.round(z_height * (72/124)))
+    x_height = int(np.round(z_height * (60/124)))
+    x, y, z = center
+
+    extractor = vtk.vtkExtractVOI()
+    extractor.SetInputData(image)
+    extractor.SetVOI(
+        x-int(x_height/2), x+int(x_height/2),
+        y-int(y_height/2), y+int(y_height/2),
+        z-int(z_height/2), z+int(z_height/2))
+
+    # scale resolution * 2
+    reslicer = vtk.vtkImageReslice()
+    reslicer.SetInputConnection(extractor.GetOutputPort())
+    reslicer.SetInterpolationModeToCubic()
+    reslicer.SetOutputExtent(0, CROP_DIMENSIONS[0]-1, 0, CROP_DIMENSIONS[1]-1, 0, CROP_DIMENSIONS[2]-1)
+    reslicer.SetOutputSpacing([s*(z_height/CROP_DIMENSIONS[2]) for s in image.GetSpacing()])
+    reslicer.Update()
+    return reslicer.GetOutput()
+
+
+def cropParameters(image, crop_path):
+    """
+    Recovers (center, z_height) of an existing crop volume from its header,
+    so the crop can be repeated on a new full volume.
+    """
+    header = nrrd.read_header(crop_path)
+    origin = np.array(header['space origin'], dtype=np.float64)
+    spacing = np.diagonal(header['space directions']).astype(np.float64)
+    sizes = np.array(header['sizes'])
+    if spacing[0] < 0: # mirrored x/y axes
+        origin[:2] += spacing[:2] * sizes[:2]
+        spacing[:2] *= -1
+
+    image_spacing = np.array(image.GetSpacing())
+    z_height = int(np.round(spacing[2] / abs(image_spacing[2]) * CROP_DIMENSIONS[2]))
+    center = origin + spacing * sizes / 2
+    center = np.round((center - np.array(image.GetOrigin())) / image_spacing).astype(int)
+    return tuple(center.tolist()), z_height
+
+
+def writeCropVolume(image, path):
+    sx, sy, sz = image.GetSpacing()
+    ox, oy, oz = image.GetOrigin()
+    x_dim, y_dim, z_dim = image.GetDimensions()
+    header = OrderedDict()
+    header['dimension'] = 3
+    header['space'] = 'left-posterior-superior'
+    header['space directions'] = [[sx, 0, 0], [0, sy, 0], [0, 0, sz]]
+    header['kinds'] = ['domain', 'domain', 'domain']
+    header['endian'] = 'little'
+    header['space origin'] = [ox, oy, oz]
+    volume = vtk_to_numpy(image.GetPointData().GetScalars()).astype(np.int16)
+    volume = volume.reshape(x_dim, y_dim, z_dim, order='F')
+    writeNrrd(path, volume, header)
+
+
+###########################
+# segmentation            #
+###########################
+def readImage(path):
+    """
+    Reads a .nrrd file. Returns the vtkImageData and the (x, y, z) numpy array it wraps.
+    """
+    data, header = nrrd.read(path)
+    image = vtk.vtkImageData()
+    image.SetDimensions(header['sizes'])
+    image.SetSpacing(np.diagonal(header['space directions']))
+    image.SetOrigin(header['space origin'])
+    image.GetPointData().SetScalars(numpy_to_vtk(data.ravel(order='F')))
+    return image, data
+
+
+def fitLabelMap(prediction, shape):
+    """
+    Places a prediction (model input size) into an empty label map of the volume shape.
+    """
+    label_map_data = np.zeros(shape, dtype=np.uint8)
+    x0, y0, z0 = prediction.shape
+    label_map_data[:x0,:y0,:z0] = prediction
+    return label_map_data
+
+
+def segmentationHeader(spacing, origin):
+    sx, sy, sz = spacing
+    ox, oy, oz = origin
+    header = OrderedDict()
+    header['type'] = 'unsigned char'
+    header['dimension'] = 3
+    header['space'] = 'left-posterior-superior'
+    header['sizes'] = '120 144 248' # fixed model size
+    header['space directions'] = [[sx, 0, 0], [0, sy, 0], [0, 0, sz]]
+    header['kinds'] = ['domain', 'domain', 'domain']
+    header['endian'] = 'little'
+    header['space origin'] = [ox, oy, oz]
+    header['Segment0_ID'] = 'Segment_1'
+    header['Segment0_Name'] = 'plaque'
+    header['Segment0_Color'] = str(241/255) + ' ' + str(214/255) + ' ' + str(145/255)
+    header['Segment0_LabelValue'] = 1
+    header['Segment0_Layer'] = 0
+    header['Segment0_Extent'] = '0 119 0 143 0 247'
+    header['Segment1_ID'] = 'Segment_2'
+    header['Segment1_Name'] = 'lumen'
+    header['Segment1_Color'] = str(216/255) + ' ' + str(101/255) + ' ' + str(79/255)
+    header['Segment1_LabelValue'] = 2
+    header['Segment1_Layer'] = 0
+    header['Segment1_Extent'] = '0 119 0 143 0 247'
+    return header
+
+
+def writeSegmentation(label_map_data, spacing, origin, path):
+    writeNrrd(path, label_map_data, segmentationHeader(spacing, origin))
+
+
+###########################
+# models                  #
+###########################
+def createSurfacePipeline(input_port, label):
+    """
+    Discrete marching cubes -> clean -> windowed sinc smoothing of one label.
+    Returns the filters (marching, clean, smoother), smoother is the output.
+    """
+    marching = vtk.vtkDiscreteMarchingCubes()
+    marching.SetInputConnection(input_port)
+    marching.GenerateValues(1, label, label)
+    clean, smoother = createSmoothingPipeline(marching.GetOutputPort())
+    return marching, clean, smoother
+
+
+def createSmoothingPipeline(input_port):
+    """
+    Clean (merges duplicate points) -> windowed sinc smoothing of a marching cubes surface.
+    Returns the filters (clean, smoother), smoother is the output.
+    """
+    clean = vtk.vtkCleanPolyData()
+    clean.SetInputConnection(input_port)
+    smoother = vtk.vtkWindowedSincPolyDataFilter()
+    smoother.SetInputConnection(clean.GetOutputPort())
+    smoother.SetNumberOfIterations(20)
+    smoother.SetPassBand(0.005)
+    return clean, smoother
+
+
+def padLabelMap(label_map):
+    """
+    Pads a label map by one voxel, so surfaces at the border are closed.
+    """
+    extent = np.array(label_map.GetExtent())
+    extent += np.array([-1, 1, -1, 1, -1, 1])
+    padding = vtk.vtkImageConstantPad()
+    padding.SetConstant(0)
+    padding.SetInputData(label_map)
+    padding.SetOutputWholeExtent(extent)
+    return padding
+
+
+def extractSurface(label_map, label):
+    padding = padLabelMap(label_map)
+    smoother = createSurfacePipeline(padding.GetOutputPort(), label)[2]
+    smoother.Update()
+    surface = vtk.vtkPolyData()
+    surface.DeepCopy(smoother.GetOutput())
+    return surface
+
+
+def writeSTL(surface, path):
+    """
+    Writes a surface if it is not empty. Returns True if a file was written.
+    """
+    if surface.GetNumberOfPoints() == 0:
+        return False
+    writer = vtk.vtkSTLWriter()
+    writer.SetFileName(path)
+    writer.SetInputData(surface)
+    writer.Write()
+    return True
+
+
+###########################
+# centerlines             #
+###########################
+def readSTL(path):
+    reader = vtk.vtkSTLReader()
+    reader.SetFileName(path)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def readCenterlines(path):
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(path)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def centerlineEndPoints(centerlines):
+    """
+    Returns the first point of the centerlines (source) and the last point of each line (targets).
+    """
+    first_point = None
+    last_points = []
+    l = centerlines.GetLines()
+    l.InitTraversal()
+    for i in range(l.GetNumberOfCells()):
+        pointIds = vtk.vtkIdList()
+        l.GetNextCell(pointIds)
+        if pointIds.GetNumberOfIds() == 0: continue
+        first_point = centerlines.GetPoint(pointIds.GetId(0))
+        last_points.append(centerlines.GetPoint(pointIds.GetId(pointIds.GetNumberOfIds()-1)))
+    return first_point, last_points
+
+
+def preconditionSurface(surface, mode=CENTERLINE_PRECONDITIONING):
+    """
+    Reduces the vertex count of a lumen surface before the centerline computation
+    (Delaunay cost grows superlinearly with it). Returns the surface itself if mode is None.
+        'decimate' decimation up to CENTERLINE_DECIMATION_REDUCTION, the decimation error
+                   is limited to CENTERLINE_PRECONDITIONING_TOLERANCE. The rims of the flat caps
+                   at the crop faces are feature edges and stay sharp.
+        'remesh'   uniform remeshing to triangles of CENTERLINE_REMESH_EDGE_LENGTH
+    """
+    if mode is None:
+        return surface
+    clean = vtk.vtkCleanPolyData()
+    clean.SetInputData(surface)
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputConnection(clean.GetOutputPort())
+    triangles.Update()
+
+    if mode == 'decimate':
+        decimation = vtk.vtkDecimatePro()
+        decimation.SetInputConnection(triangles.GetOutputPort())
+        decimation.SetTargetReduction(CENTERLINE_DECIMATION_REDUCTION)
+        decimation.PreserveTopologyOn()
+        decimation.SplittingOff()
+        decimation.BoundaryVertexDeletionOff() # open STLs: keep the outlet contours
+        decimation.SetFeatureAngle(45)         # cap rims
+        decimation.ErrorIsAbsoluteOn()
+        decimation.SetAbsoluteError(CENTERLINE_PRECONDITIONING_TOLERANCE)
+        output = decimation
+    elif mode == 'remesh':
+        entity_ids = vtk.vtkIntArray() # single surface entity, required by the remeshing
+        entity_ids.SetName("CellEntityIds")
+        entity_ids.SetNumberOfTuples(triangles.GetOutput().GetNumberOfCells())
+        entity_ids.Fill(1)
+        triangulated = vtk.vtkPolyData()
+        triangulated.ShallowCopy(triangles.GetOutput())
+        triangulated.GetCellData().AddArray(entity_ids)
+        remeshing = vtkvmtkPolyDataSurfaceRemeshing()
+        remeshing.SetInputData(triangulated)
+        remeshing.SetCellEntityIdsArrayName("CellEntityIds")
+        remeshing.SetElementSizeModeToTargetArea()
+        remeshing.SetTargetArea(0.25 * np.sqrt(3) * CENTERLINE_REMESH_EDGE_LENGTH**2) # equilateral triangle
+        remeshing.SetNumberOfIterations(10)
+        remeshing.SetPreserveBoundaryEdges(1)
+        output = remeshing
+    else:
+        raise ValueError("Unknown surface preconditioning: " + str(mode))
+
+    output.Update()
+    preconditioned = vtk.vtkPolyData()
+    preconditioned.DeepCopy(output.GetOutput())
+    preconditioned.GetCellData().RemoveArray("CellEntityIds")
+    return preconditioned
+
+
+def mapPointIds(source_surface, target_surface, point_ids):
+    """
+    Maps point ids of one surface to the closest points of another one (e.g. seeds to a preconditioned surface).
+    """
+    if source_surface is target_surface:
+        return list(point_ids)
+    return [target_surface.FindPoint(source_surface.GetPoint(i)) for i in point_ids]
+
+
+def centerlineCacheKey(lumen_path, mode=CENTERLINE_PRECONDITIONING):
+    """
+    Key of the centerline cache of a lumen STL, depends on the surface preconditioning.
+    """
+    key = surfaceKey(lumen_path)
+    if key is None or mode is None:
+        return key
+    if mode == 'decimate':
+        parameters = (CENTERLINE_DECIMATION_REDUCTION, CENTERLINE_PRECONDITIONING_TOLERANCE)
+    else:
+        parameters = (CENTERLINE_REMESH_EDGE_LENGTH,)
+    return key + "/" + mode + "/" + "/".join(str(p) for p in parameters)
+
+
+def createCenterlineFilter(surface, source_id, target_ids):
+    """
+    Configures a vmtk centerline filter from surface point ids.
+    """
+    inletSeedIds = vtk.vtkIdList()
+    inletSeedIds.InsertNextId(source_id)
+    outletSeedIds = vtk.vtkIdList()
+    for id in target_ids:
+        outletSeedIds.InsertNextId(id)
+
+    centerlineFilter = vtkvmtkPolyDataCenterlines()
+    centerlineFilter.SetInputData(surface)
+    centerlineFilter.SetSourceSeedIds(inletSeedIds)
+    centerlineFilter.SetTargetSeedIds(outletSeedIds)
+    centerlineFilter.SetRadiusArrayName('MaximumInscribedSphereRadius')
+    centerlineFilter.SetFlipNormals(False)
+    centerlineFilter.SetAppendEndPointsToCenterlines(False)
+    if len(target_ids) == 1:
+        centerlineFilter.SetStopFastMarchingOnReachingTarget(True)
+    else:
+        centerlineFilter.SetStopFastMarchingOnReachingTarget(False)
+    centerlineFilter.SetSimplifyVoronoi(False)
+    centerlineFilter.SetCenterlineResampling(False)
+    centerlineFilter.SetResamplingStepLength(1.0)
+    return centerlineFilter
+
+
+def setCenterlineIntermediates(centerlineFilter, delaunay_tessellation, voronoi_diagram, pole_ids):
+    """
+    Lets a centerline filter reuse the tessellation of an earlier run on the same surface.
+    """
+    if delaunay_tessellation is not None:
+        centerlineFilter.GenerateDelaunayTessellationOff()
+        centerlineFilter.SetDelaunayTessellation(delaunay_tessellation)
+    if (voronoi_diagram is not None) and (pole_ids is not None):
+        centerlineFilter.GenerateVoronoiDiagramOff()
+        centerlineFilter.SetVoronoiDiagram(voronoi_diagram)
+        centerlineFilter.SetPoleIds(pole_ids)
+
+
+def computeCenterlines(surface, source_position, target_positions, lumen_path=None):
+    """
+    Computes centerlines between the surface points closest to the given seed positions.
+    The surface is preconditioned first (see preconditionSurface()). If the path of the
+    lumen STL is given, the tessellation is taken from/written to its centerline cache.
+    """
+    surface = preconditionSurface(surface)
+    source_id = surface.FindPoint(source_position)
+    target_ids = [surface.FindPoint(p) for p in target_positions]
+    centerlineFilter = createCenterlineFilter(surface, source_id, target_ids)
+    key, cache = None, None
+    if lumen_path and USE_CENTERLINE_CACHE:
+        key = centerlineCacheKey(lumen_path)
+        cache = loadCenterlineCache(lumen_path, key)
+        if cache is not None:
+            setCenterlineIntermediates(centerlineFilter, *cache)
+    centerlineFilter.Update()
+    if key is not None and cache is None:
+        try:
+            writeCenterlineCache(lumen_path, key, centerlineFilter.GetDelaunayTessellation(),
+                                 centerlineFilter.GetVoronoiDiagram(), centerlineFilter.GetPoleIds())
+        except OSError:
+            pass # the cache is optional
+    return centerlineFilter.GetOutput()
+
+
+def writeCenterlines(centerlines, path):
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(path)
+    writer.SetInputData(centerlines)
+    writer.Write()
@@ -1,3 +1,8 @@
+import os
+import copy
+import queue
+import threading
+
 import numpy as np
 
 import torch
@@ -7,6 +12,65 @@ from skimage import morphology
 from skimage.exposure import rescale_intensity
 
 from defaults import *
+from modules.PredictorService import PREDICTION_STAGES
+
+
+def preprocess(img_data, h=120, w=144, d=248, wl=415, ww=470):
+    """
+    Crops, windows and normalizes a volume to the model input.
+        Args:
+        img_data (numpy array): image volume data
+        h (int): height
+        w (int): width
+        d (int): depth
+        wl (int): window level for preprocessing
+        ww (int): window width for preprocessing
+    Returns a float32 array of shape (h, w, d).
+    """
+    # crop if necessary
+    h0, w0, d0 = img_data.shape
+    if h0 != h or w0 != w or d0 != d:
+        assert h0 >= h and w0 >= w and d0 >= d, 'cannot crop'
+        img_data = img_data[:h, :w, :d]
+
+    # windowing (np.clip copies, the input is not modified)
+    upper_threshold = wl + ww//2
+    lower_threshold = wl - ww//2
+    img_data = np.clip(img_data, lower_threshold, upper_threshold)
+
+    # normalization
+    return rescale_intensity(img_data, out_range=(0, 1)).astype(np.float32)
+
+
+def removeSmallClusters(pred, region_label_img, min_size=MIN_CLUSTER_SIZE):
+    """
+    Sets all voxels of connected components smaller than min_size voxels to 0 (in place).
+    One pass: cluster sizes by bincount, removal by a lookup table over the component labels.
+    """
+    cluster_sizes = np.bincount(region_label_img.ravel())
+    remove = cluster_sizes < min_size
+    remove[0] = False # background/ignored voxels
+    pred[remove[region_label_img]] = 0
+    return pred
+
+
+def postprocess(pred, progress=None):
+    """
+    Morphological clean-up of a predicted label map (uint8).
+    """
+    pred = pred.astype(np.uint8)
+    pred = np.rot90(pred, 0, axes=(1, 2))
+    if progress is not None:
+        progress(2, PREDICTION_STAGES[2])
+    pred = morphology.closing(pred) # close small gaps
+    if progress is not None:
+        progress(3, PREDICTION_STAGES[3])
+    region_label_img = morphology.label(pred, connectivity=2)
+    region_label_img[pred==1] = 0 # ignore plaque (TODO better method? remove only far away plaque?)
+    removeSmallClusters(pred, region_label_img) # remove small clusters
+    pred = morphology.opening(pred) # remove spikes
+    return pred
+
 
 class CarotidDataset(Dataset):
     """
@@ -22,53 +86,50 @@ class CarotidDataset(Dataset):
             wl (int): window level for preprocessing
             ww (int): window width for preprocessing
         """
-        self.img_data = np.copy(img_data)
         self.label = torch.zeros(img_data.shape)
-
-        # crop if necessary
-        h0, w0, d0 = self.img_data.shape
-        if h0 != h or w0 != w or d0 != d:
-            assert h0 >= h and w0 >= w and d0 >= d, 'cannot crop'
-            self.img_data = self.img_data[:h, :w, :d]
-
-        # windowing
-        upper_threshold = wl + ww//2
-        lower_threshold = wl - ww//2
-        self.img_data[self.img_data < lower_threshold] = lower_threshold
-        self.img_data[self.img_data > upper_threshold] = upper_threshold
-
-        # normalization
-        self.img_data = rescale_intensity(self.img_data, out_range=(0, 1))
-
-        # cast to tensor
-        self.img_data = torch.tensor(self.img_data)
+        self.img_data = torch.from_numpy(preprocess(img_data, h, w, d, wl, ww))
 
 
     def __getitem__(self, idx):
         return self.img_data, self.label
-    
+
     def __len__(self):
         return 1
-    
+
 
 
 class CarotidSegmentationPredictor():
     """
     Wrapper object to call segmentation predictions based on trained UNet.
+    The forward pass is executed by a selectable backend (same weights):
+        'eager'       PyTorch eager mode (reference)
+        'torchscript' traced and frozen TorchScript graph
+        'onnx'        ONNX Runtime (CPU only, needs the onnxruntime package)
     """
-    def __init__(self):
+    def __init__(self, backend=INFERENCE_BACKEND, channels_last=INFERENCE_CHANNELS_LAST, threads=INFERENCE_THREADS):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.weights = 'seg_model_weights.pth'
+        self.backend = backend
+        self.channels_last = channels_last and self.device == 'cpu'
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.threads = threads
         self.model = UNet(spatial_dims=3,
                           in_channels=1,
                           out_channels=3,
-                          channels=(16, 32, 64, 128),  
+                          channels=(16, 32, 64, 128),
                           strides=(2, 2, 2),
                           num_res_units=3,
                           norm='INSTANCE',
                           ).to(self.device)
         self.model.load_state_dict(torch.load(self.weights, map_location=self.device))
         self.model.eval()
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last_3d)
+        if self.backend == 'onnx' and self.device != 'cpu':
+            self.backend = 'eager'
+        self.compiled_model = None # TorchScript module or ONNX Runtime session, created on first use
+        self.lock = threading.Lock() # forward passes of both sides are serialized
         self.dataset = None
         self.dataloader = None
 
@@ -77,29 +138,159 @@ class CarotidSegmentationPredictor():
         self.dataset = CarotidDataset(img_data)
         self.dataloader = DataLoader(self.dataset, batch_size=1)
 
-    
+
     def run_inference(self):
         pred = None
         for item in self.dataloader:
-            # infer label prediction
-            img = item[0].type(torch.FloatTensor).unsqueeze(1).to(self.device)
-            output = self.model(img).squeeze(0)
-            pred = torch.argmax(output, dim=0).cpu().numpy().astype(np.uint8)
-
-            # postprocess
-            pred = pred.astype(np.uint8)
-            pred = np.rot90(pred, 0, axes=(1, 2))
-            pred = morphology.closing(pred) # close small gaps
-            region_label_img = morphology.label(pred, connectivity=2)
-            region_label_img[pred==1] = 0 # ignore plaque (TODO better method? remove only far away plaque?)
-            region_label_hist, _ = np.histogram(region_label_img, bins=np.max(region_label_img)+1)
-            for i in range(1, len(region_label_hist)):
-                cluster_size = region_label_hist[i]
-                if 0 < cluster_size < MIN_CLUSTER_SIZE:
-                    pred[region_label_img==i] = 0 # remove small clusters
-            pred = morphology.opening(pred) # remove spikes
+            pred = postprocess(self.forward(item[0])[0])
         return pred
 
+
+    def predict(self, img_data, progress=None):
+        """
+        Label prediction of a single volume, without changing setData() state.
+        progress(stage index, stage name) is called before each of the PREDICTION_STAGES,
+        it may raise PredictionCancelled to stop the prediction.
+        """
+        if progress is not None:
+            progress(0, PREDICTION_STAGES[0])
+        img = preprocess(img_data)
+        if progress is not None:
+            progress(1, PREDICTION_STAGES[1])
+        pred = self.forward(img[None])[0]
+        return postprocess(pred, progress)
+
+
+    def forward(self, img_batch):
+        """
+        Label prediction of a batch of preprocessed volumes (N x h x w x d tensor or array).
+        Returns the uint8 label maps (N x h x w x d numpy array).
+        """
+        with self.lock:
+            return self.__forward(img_batch)
+
+
+    def __forward(self, img_batch):
+        img = torch.as_tensor(img_batch).float().unsqueeze(1).to(self.device)
+        if self.backend == 'onnx':
+            session = self.__onnxSession()
+            if session is not None:
+                output = session.run(None, {'input': img.numpy()})[0]
+                return np.argmax(output, axis=1).astype(np.uint8)
+
+        if self.channels_last:
+            img = img.contiguous(memory_format=torch.channels_last_3d)
+        with torch.no_grad():
+            if self.backend == 'torchscript':
+                output = self.__torchScriptModel(img)(img)
+            else:
+                output = self.model(img)
+        return torch.argmax(output, dim=1).cpu().numpy().astype(np.uint8)
+
+
+    def __torchScriptModel(self, example_input):
+        if self.compiled_model is None:
+            with torch.no_grad():
+                traced = torch.jit.trace(self.model, example_input)
+                self.compiled_model = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+        return self.compiled_model
+
+
+    def __onnxSession(self):
+        """
+        Exports the model once next to the weights (re-exported if the weights are newer)
+        and opens an ONNX Runtime session. Falls back to eager mode without onnxruntime.
+        """
+        if self.compiled_model is not None:
+            return self.compiled_model
+        try:
+            import onnxruntime
+        except ImportError:
+            print("onnxruntime is not installed, using eager inference.")
+            self.backend = 'eager'
+            return None
+
+        onnx_path = os.path.splitext(self.weights)[0] + ".onnx"
+        if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(self.weights):
+            example = torch.zeros((1, 1, 120, 144, 248))
+            # export a copy, the eager model keeps its dtype and memory format
+            model = copy.deepcopy(self.model).float().to(memory_format=torch.contiguous_format)
+            torch.onnx.export(model, example, onnx_path,
+                              input_names=['input'], output_names=['output'],
+                              dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+                              opset_version=17)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        self.compiled_model = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        return self.compiled_model
+
+
+    def batchSize(self, shape, memory_budget=INFERENCE_MEMORY_BUDGET):
+        """
+        Number of volumes of the given shape that fit into the memory budget.
+        """
+        bytes_per_volume = int(np.prod(shape)) * INFERENCE_BYTES_PER_VOXEL
+        return max(1, memory_budget // bytes_per_volume)
+
+
+    def predict_many(self, volumes, memory_budget=INFERENCE_MEMORY_BUDGET):
+        """
+        Streams label maps for many cropped volumes, in input order.
+        Volumes are batched up to the memory budget. A background thread preprocesses
+        the next batch while the current one is in the forward pass.
+        Instance normalization works per volume, so results do not depend on the batch size.
+
+        Args:
+            volumes (iterable): volume arrays, can be a lazy generator (e.g. reading files)
+            memory_budget (int): bytes available for one forward pass
+
+        Yields one postprocessed uint8 label map per volume.
+        """
+        batches = queue.Queue(maxsize=1) # one batch prefetched
+        stop = threading.Event()
+
+        def prefetch():
+            try:
+                batch = []
+                batch_size = None
+                for volume in volumes:
+                    if stop.is_set():
+                        return
+                    batch.append(preprocess(volume))
+                    if batch_size is None:
+                        batch_size = self.batchSize(batch[0].shape, memory_budget)
+                    if len(batch) == batch_size:
+                        batches.put(np.stack(batch))
+                        batch = []
+                if batch:
+                    batches.put(np.stack(batch))
+                batches.put(None)
+            except Exception as e:
+                batches.put(e)
+
+        thread = threading.Thread(target=prefetch, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                for pred in self.forward(batch):
+                    yield postprocess(pred)
+        finally:
+            # generator closed early: let the prefetch thread finish
+            stop.set()
+            while thread.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    thread.join(0.1)
+
+
     def discard(self):
         self.dataset = None
-        self.dataloader = None
\ No newline at end of file
+        self.dataloader = None
@@ -0,0 +1,58 @@
+"""
+Lazily created segmentation CNN.
+torch, MONAI and scikit-image are only imported (and the weights only loaded)
+on first use or by a background warm-up, so the application starts without them.
+"""
+
+import threading
+
+# stages reported by CarotidSegmentationPredictor.predict()
+PREDICTION_STAGES = ["Preprocessing", "Forward pass", "Morphology", "Cluster filter"]
+
+
+class PredictionCancelled(Exception):
+    """
+    Raised by a progress callback to stop a prediction between two stages.
+    """
+    pass
+
+
+class PredictorService():
+    """
+    Holds one CarotidSegmentationPredictor, created on the first get().
+    Thread-safe: concurrent callers wait for the same instance.
+    """
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs # arguments of CarotidSegmentationPredictor
+        self.predictor = None
+        self.lock = threading.Lock()
+
+
+    def isLoaded(self):
+        return self.predictor is not None
+
+
+    def get(self):
+        """
+        Returns the predictor, imports and loads it if necessary (blocking).
+        """
+        with self.lock:
+            if self.predictor is None:
+                from modules.Predictor import CarotidSegmentationPredictor
+                self.predictor = CarotidSegmentationPredictor(**self.kwargs)
+            return self.predictor
+
+
+    def warmUp(self):
+        """
+        Loads the predictor in a daemon thread. A later get() waits for it.
+        If loading fails (e.g. missing weights), it is retried and reported on first use.
+        """
+        def load():
+            try:
+                self.get()
+            except Exception as e:
+                print("Warm-up of the segmentation CNN failed:", e)
+
+        if self.predictor is None:
+            threading.Thread(target=load, daemon=True).start()
@@ -1,38 +1,86 @@
 import os
-from collections import OrderedDict
 
 import numpy as np
-import nrrd
 import vtk
-from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
-from PyQt5.QtCore import Qt, pyqtSignal
+from vtk.util.numpy_support import vtk_to_numpy
+from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
+from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import  (
-    QWidget, QVBoxLayout, QHBoxLayout, QSlider, QTabWidget,
+    QWidget, QVBoxLayout, QHBoxLayout, QSlider, QTabWidget, QProgressBar,
     QPushButton, QMessageBox, QGridLayout, QLabel, QToolBar, QAction, QSizePolicy
 )
 
 from modules.Interactors import ImageSliceInteractor, IsosurfaceInteractor
-from modules.Predictor import CarotidSegmentationPredictor
+from modules.LabelMap import LabelMap
+from modules.LabelHistory import LabelHistory
+from modules.PredictorService import PredictorService, PredictionCancelled, PREDICTION_STAGES
+from modules.Pipeline import fitLabelMap, writeSegmentation, writeSTL
 from defaults import *
 
+class PredictionWorker(QObject):
+    """
+    Runs a CNN prediction of one volume outside of the GUI thread.
+    The predictor is loaded by the worker if the warm-up has not finished yet.
+    Cancellation takes effect at the next prediction stage.
+    """
+    finished = pyqtSignal()
+    progress = pyqtSignal(int, str)
+    prediction_done = pyqtSignal(object, int)
+    failed = pyqtSignal(str)
+    predictor_service = None
+    image_data = None
+    generation = 0
+    cancelled = False
+
+
+    def run(self):
+        try:
+            if not self.predictor_service.isLoaded():
+                self.progress.emit(0, "Loading model")
+            predictor = self.predictor_service.get()
+            prediction = predictor.predict(self.image_data, self.reportProgress)
+            self.prediction_done.emit(fitLabelMap(prediction, self.image_data.shape), self.generation)
+        except PredictionCancelled:
+            pass
+        except Exception as e: # e.g. weights missing
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit()
+
+
+    def reportProgress(self, stage, name):
+        if self.cancelled:
+            raise PredictionCancelled()
+        self.progress.emit(stage, name)
+
+
+
+
 class SegmentationModuleTab(QWidget):  
     """
     Tab view of a right OR left side carotid for segmentation.
     """
     data_modified = pyqtSignal()
-    def __init__(self, predictor, parent=None):
+    thread_started = pyqtSignal()
+    thread_finished = pyqtSignal()
+    def __init__(self, predictor_service, parent=None):
         super().__init__(parent)
 
         # state
-        self.predictor = predictor       # global wrapper for pytorch execution
+        self.predictor_service = predictor_service # lazily loaded CNN, shared by both sides
+        self.prediction_thread = None    # thread of a running CNN prediction
+        self.prediction_worker = None    # worker of a running CNN prediction
+        self.prediction_generation = 0   # predictions of older generations are not applied
         self.image = None                # underlying CTA volume image
         self.image_data = None           # numpy array of raw image scalar data
-        self.label_map = None            # segmentation label map
-        self.label_map_data = None       # numpy array of raw label map scalar data
-        self.threshold_img = None        # image to display threshold 
+        self.labels = None               # LabelMap, segmentation buffer shared by numpy and VTK
+        self.history = None              # LabelHistory, undo/redo of label map edits
+        self.label_map = None            # segmentation label map (vtkImageData of labels)
+        self.label_map_data = None       # numpy array of raw label map scalar data (view of labels)
+        self.threshold_img = None        # LabelMap to display threshold, only the visible slice is computed
         self.volume_file = False         # path to CTA volume file
-        self.plaque_pending = True       # True if no plaque pixels exist yet
-        self.lumen_pending = True        # True if no lumen pixels exist yet
+        self.plaque_pending = True       # True if no plaque pixels exist yet (plaque actors not shown)
+        self.lumen_pending = True        # True if no lumen pixels exist yet (lumen actors not shown)
         self.model_camera_pending = True # True if camera of model_view has not been set yet
         self.editing_active = False      # True if label map editing is active
         self.brush_size = 15             # size of brush on label map
@@ -48,6 +96,11 @@ class SegmentationModuleTab(QWidget):
 
         self.model_view = IsosurfaceInteractor(self)
         self.CNN_button = QPushButton("New Segmentation: Initialize with CNN") 
+        self.prediction_progress = QProgressBar()
+        self.prediction_progress.setRange(0, len(PREDICTION_STAGES))
+        self.prediction_progress.setVisible(False)
+        self.prediction_cancel_button = QPushButton("Cancel")
+        self.prediction_cancel_button.setVisible(False)
 
         # define sliders
         self.brush_size_slider = QSlider(Qt.Horizontal)  
@@ -93,6 +146,12 @@ class SegmentationModuleTab(QWidget):
         self.toolbar_auto_update = QAction("auto-update 3D model")
         self.toolbar_auto_update.setCheckable(True)
         self.toolbar_auto_update.setEnabled(False)
+        self.toolbar_undo = QAction("Undo", self)
+        self.toolbar_undo.setShortcut(QKeySequence("Ctrl+Z"))
+        self.toolbar_undo.setEnabled(False)
+        self.toolbar_redo = QAction("Redo", self)
+        self.toolbar_redo.setShortcuts([QKeySequence("Ctrl+Y"), QKeySequence("Ctrl+Shift+Z")])
+        self.toolbar_redo.setEnabled(False)
         spacer1 = QWidget()
         spacer1.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         spacer2 = QWidget()
@@ -101,6 +160,8 @@ class SegmentationModuleTab(QWidget):
         # set toolbar
         self.edit_toolbar = QToolBar()
         self.edit_toolbar.addAction(self.toolbar_edit)
+        self.edit_toolbar.addAction(self.toolbar_undo)
+        self.edit_toolbar.addAction(self.toolbar_redo)
         self.edit_toolbar.addWidget(spacer1)
         self.edit_toolbar.addAction(self.toolbar_lumen)
         self.edit_toolbar.addAction(self.toolbar_plaque)
@@ -111,8 +172,12 @@ class SegmentationModuleTab(QWidget):
         self.edit_toolbar.addAction(self.toolbar_auto_update)
 
         # add everything to a layout
+        self.CNN_layout = QHBoxLayout()
+        self.CNN_layout.addWidget(self.CNN_button)
+        self.CNN_layout.addWidget(self.prediction_progress)
+        self.CNN_layout.addWidget(self.prediction_cancel_button)
         self.slice_view_layout = QVBoxLayout()
-        self.slice_view_layout.addWidget(self.CNN_button)
+        self.slice_view_layout.addLayout(self.CNN_layout)
         self.slice_view_layout.addWidget(self.edit_toolbar)
         self.slice_view_layout.addLayout(self.slider_layout)
         self.slice_view_layout.addWidget(self.slice_view)
@@ -124,17 +189,20 @@ class SegmentationModuleTab(QWidget):
         
         # vtk objects
         self.lumen_outline_actor3D, self.lumen_outline_actor2D = self.__createOutlineActors(
-            self.model_view.smoother_lumen.GetOutputPort(), COLOR_LUMEN_DARK, COLOR_LUMEN)
+            self.model_view.surface_lumen, COLOR_LUMEN_DARK, COLOR_LUMEN)
         self.plaque_outline_actor3D, self.plaque_outline_actor2D = self.__createOutlineActors(
-            self.model_view.smoother_plaque.GetOutputPort(), COLOR_PLAQUE_DARK, COLOR_PLAQUE)
+            self.model_view.surface_plaque, COLOR_PLAQUE_DARK, COLOR_PLAQUE)
         self.__setupLUT()  # setup lookup table to display masks and threshold 
         self.__setupEditingPipeline()
 
         # connect signals/slots
         self.CNN_button.pressed.connect(self.generateCNNSeg)
+        self.prediction_cancel_button.clicked.connect(self.cancelPrediction)
         self.slice_view.slice_changed[int].connect(self.sliceChanged)
         self.slice_view_slider.valueChanged[int].connect(self.slice_view.setSlice)
         self.toolbar_edit.triggered[bool].connect(self.edit)
+        self.toolbar_undo.triggered.connect(self.undo)
+        self.toolbar_redo.triggered.connect(self.redo)
         self.toolbar_brush2D.triggered[bool].connect(self.set2DBrush)
         self.toolbar_brush3D.triggered[bool].connect(self.set3DBrush)
         self.toolbar_auto_update.triggered[bool].connect(self.markerVisible)
@@ -152,9 +220,9 @@ class SegmentationModuleTab(QWidget):
         self.model_view.Start()
 
 
-    def __createOutlineActors(self, output_port, color3D, color2D):
+    def __createOutlineActors(self, surface, color3D, color2D):
         cutter = vtk.vtkCutter()
-        cutter.SetInputConnection(output_port)
+        cutter.SetInputData(surface)
         cutter.SetCutFunction(self.slice_view.image_mapper.GetSlicePlane())
         mapper = vtk.vtkPolyDataMapper()
         mapper.ScalarVisibilityOff()
@@ -251,6 +319,8 @@ class SegmentationModuleTab(QWidget):
         self.slice_view_slider.setSliderPosition(slice_nr)
         self.mask_slice_mapper.SetSliceNumber(slice_nr)
         self.threshold_mapper.SetSliceNumber(slice_nr)
+        if self.threshold_img is not None:
+            self.__updateThresholdSlice()
 
         if self.marker: 
             x,y = self.slice_view.GetEventPosition()  
@@ -282,6 +352,7 @@ class SegmentationModuleTab(QWidget):
     
 
     def loadVolumeSeg(self, volume_file, seg_file, is_new_file=True):
+        self.cancelPrediction() # a running prediction belongs to the old data
         if volume_file:
             # load image volume if it is new
             if is_new_file:
@@ -298,7 +369,7 @@ class SegmentationModuleTab(QWidget):
                 
             # image exists -> load segmentation
             if seg_file:
-                self.label_map, self.plaque_pending, self.lumen_pending = self.model_view.loadNrrd(seg_file, self.image)
+                self.labels, self.plaque_pending, self.lumen_pending = self.model_view.loadNrrd(seg_file, self.image)
                 self.__loadLabelMapData()
                 self.model_camera_pending = False
 
@@ -324,14 +395,8 @@ class SegmentationModuleTab(QWidget):
                 self.lumen_pending = True
                 self.model_camera_pending = True
                 self.model_view.reset()
-                self.label_map = vtk.vtkImageData()
-                self.label_map.SetDimensions(self.image.GetDimensions())
-                self.label_map.SetSpacing(self.image.GetSpacing())
-                self.label_map.SetOrigin(self.image.GetOrigin())
-                self.label_map_data = np.zeros(self.label_map.GetDimensions(), dtype=np.uint8)
-                vtk_data_array = numpy_to_vtk(self.label_map_data.ravel(order='F'))
-                self.label_map.GetPointData().SetScalars(vtk_data_array)
-                self.masks_color_mapped.SetInputData(self.label_map)
+                self.labels = LabelMap(self.image.GetDimensions(), self.image.GetSpacing(), self.image.GetOrigin())
+                self.__loadLabelMapData()
                 self.model_view.renderer.RemoveActor(self.lumen_outline_actor3D)
                 self.slice_view.renderer.RemoveActor(self.lumen_outline_actor2D)
                 self.model_view.renderer.RemoveActor(self.plaque_outline_actor3D)
@@ -355,6 +420,9 @@ class SegmentationModuleTab(QWidget):
             self.model_camera_pending = True
             self.image = None
             self.image_data = None
+            self.labels = None
+            self.history = None
+            self.updateUndoActions()
             self.label_map = None
             self.label_map_data = None
             self.threshold_img = None
@@ -376,43 +444,101 @@ class SegmentationModuleTab(QWidget):
         dlg.setText("<p align='center'>Generate a segmentation prediction?<br>WARNING: Fully overwrites current mask!</p>")
         dlg.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
         button = dlg.exec()
-        if button == QMessageBox.Ok:
-            self.predictor.setData(self.image_data)
-            prediction_label_map = self.predictor.run_inference()
-
-            # update the label map
-            x0, y0, z0 = prediction_label_map.shape
-            self.label_map_data[:x0,:y0,:z0] = prediction_label_map
-            vtk_data_array = numpy_to_vtk(self.label_map_data.ravel(order='F'))
-            self.label_map.GetPointData().SetScalars(vtk_data_array)
-            self.plaque_pending, self.lumen_pending = self.model_view.updateScene(self.label_map_data, self.label_map)
-
-            # update scene actors
-            if self.plaque_pending:
-                self.model_view.renderer.RemoveActor(self.plaque_outline_actor3D)
-                self.slice_view.renderer.RemoveActor(self.plaque_outline_actor2D)
-            else:
-                self.model_view.renderer.AddActor(self.plaque_outline_actor3D)
-                if not self.editing_active:
-                    self.slice_view.renderer.AddActor(self.plaque_outline_actor2D)
+        if button == QMessageBox.Ok and self.image_data is not None:
+            self.prediction_generation += 1
+            self.CNN_button.setEnabled(False)
+            self.prediction_progress.setValue(0)
+            self.prediction_progress.setFormat("Starting...")
+            self.prediction_progress.setVisible(True)
+            self.prediction_cancel_button.setVisible(True)
+
+            # start new thread, the label map is only replaced when the prediction completes
+            self.prediction_thread = QThread()
+            self.prediction_worker = PredictionWorker()
+            self.prediction_worker.predictor_service = self.predictor_service
+            self.prediction_worker.image_data = np.array(self.image_data) # copy, image may be replaced meanwhile
+            self.prediction_worker.generation = self.prediction_generation
+            self.prediction_worker.moveToThread(self.prediction_thread)
+
+            self.prediction_worker.progress[int, str].connect(self.reportPredictionProgress)
+            self.prediction_worker.prediction_done[object, int].connect(self.applyPrediction)
+            self.prediction_worker.failed[str].connect(self.predictionFailed)
+            self.prediction_worker.finished.connect(self.prediction_thread.quit)
+            self.prediction_worker.finished.connect(self.prediction_worker.deleteLater)
+
+            self.prediction_thread.started.connect(self.prediction_worker.run)
+            self.prediction_thread.finished.connect(self.predictionThreadFinished)
+            self.prediction_thread.finished.connect(self.prediction_thread.deleteLater)
+            self.prediction_thread.start()
+            self.thread_started.emit()
+
+
+    def reportPredictionProgress(self, stage, name):
+        self.prediction_progress.setValue(stage)
+        self.prediction_progress.setFormat(name + "...")
+
+
+    def cancelPrediction(self):
+        if self.prediction_worker is None:
+            return
+        self.prediction_worker.cancelled = True
+        self.prediction_generation += 1 # result is ignored even if the last stage is running
+        self.prediction_progress.setFormat("Cancelling...")
+        self.prediction_cancel_button.setVisible(False)
 
-            if self.lumen_pending:
-                self.model_view.renderer.RemoveActor(self.lumen_outline_actor3D)
-                self.slice_view.renderer.RemoveActor(self.lumen_outline_actor2D)
-            else:
-                self.model_view.renderer.AddActor(self.lumen_outline_actor3D)
-                if not self.editing_active:
-                    self.slice_view.renderer.AddActor(self.lumen_outline_actor2D)
 
-            self.slice_view.GetRenderWindow().Render()
-            self.model_view.GetRenderWindow().Render()
-            self.data_modified.emit()
+    def predictionFailed(self, message):
+        QMessageBox.warning(self, "New Segmentation: Initialize with CNN",
+                            "The segmentation CNN could not be run:\n" + message)
+
+
+    def predictionThreadFinished(self):
+        self.prediction_thread = None
+        self.prediction_worker = None
+        self.prediction_progress.setVisible(False)
+        self.prediction_cancel_button.setVisible(False)
+        self.CNN_button.setEnabled(True)
+        self.thread_finished.emit()
+
+
+    def applyPrediction(self, label_map_data, generation):
+        if generation != self.prediction_generation or self.label_map_data is None:
+            return
+
+        # update the label map (undoable)
+        self.labels.beginRecording()
+        self.labels.setData(label_map_data)
+        self.history.push(self.labels.endRecording())
+        self.updateUndoActions()
+        self.plaque_pending, self.lumen_pending = self.model_view.updateScene(self.labels, False)
+
+        # update scene actors
+        if self.plaque_pending:
+            self.model_view.renderer.RemoveActor(self.plaque_outline_actor3D)
+            self.slice_view.renderer.RemoveActor(self.plaque_outline_actor2D)
+        else:
+            self.model_view.renderer.AddActor(self.plaque_outline_actor3D)
+            if not self.editing_active:
+                self.slice_view.renderer.AddActor(self.plaque_outline_actor2D)
+
+        if self.lumen_pending:
+            self.model_view.renderer.RemoveActor(self.lumen_outline_actor3D)
+            self.slice_view.renderer.RemoveActor(self.lumen_outline_actor2D)
+        else:
+            self.model_view.renderer.AddActor(self.lumen_outline_actor3D)
+            if not self.editing_active:
+                self.slice_view.renderer.AddActor(self.lumen_outline_actor2D)
+
+        self.slice_view.GetRenderWindow().Render()
+        self.model_view.GetRenderWindow().Render()
+        self.data_modified.emit()
 
     
     def __loadLabelMapData(self):
-        shape = self.label_map.GetDimensions()
-        self.label_map_data = vtk_to_numpy(self.label_map.GetPointData().GetScalars())
-        self.label_map_data = self.label_map_data.reshape(shape, order='F')
+        self.label_map = self.labels.image
+        self.label_map_data = self.labels.data
+        self.history = LabelHistory(self.labels)
+        self.updateUndoActions()
         self.masks_color_mapped.SetInputData(self.label_map)
 
 
@@ -422,10 +548,7 @@ class SegmentationModuleTab(QWidget):
         position = self.image.GetOrigin()
         spacing = self.image.GetSpacing()
         
-        self.threshold_img = vtk.vtkImageData()  
-        self.threshold_img.SetDimensions(shape)
-        self.threshold_img.SetOrigin(position)
-        self.threshold_img.SetSpacing(spacing)
+        self.threshold_img = LabelMap(shape, spacing, position) # preallocated, reused for every threshold
 
         self.image_data = vtk_to_numpy(self.image.GetPointData().GetScalars())
         self.image_data = self.image_data.reshape(shape, order='F')
@@ -433,7 +556,7 @@ class SegmentationModuleTab(QWidget):
         self.threshold_slider.setMinimum(min)
         self.threshold_slider.setMaximum(max+1)
         self.threshold_slider.setValue(min)
-        self.threshold_color_mapped.SetInputData(self.threshold_img)
+        self.threshold_color_mapped.SetInputData(self.threshold_img.image)
 
 
     def setUpCircle(self, dim2D=False): 
@@ -575,19 +698,17 @@ class SegmentationModuleTab(QWidget):
         self.threshold = threshold
         self.threshold_slider_label.setText("Threshold: "+ str(self.threshold) + " (HU)")  # update slider label 
 
-        # get copy of pixel values 
-        threshold_img_data = np.copy(self.image_data)
-
-        # define threshold mask 
-        threshold_img_data[threshold_img_data<self.threshold] = 0
-        threshold_img_data[threshold_img_data>self.threshold] = 1
-        self.threshold_mask = threshold_img_data.astype(np.bool_)
-        vtk_data_array = numpy_to_vtk(threshold_img_data.ravel(order='F'))
-        self.threshold_img.GetPointData().SetScalars(vtk_data_array)
+        # threshold mask of the visible slice only, the brush thresholds its own region
+        self.__updateThresholdSlice()
         
         # update scene 
         self.slice_view.GetRenderWindow().Render()
 
+    def __updateThresholdSlice(self):
+        z = self.slice_view.slice
+        np.greater_equal(self.image_data[:,:,z], self.threshold, out=self.threshold_img.data[:,:,z])
+        self.threshold_img.markModified(z0=z, z1=z+1)
+
     # to show threshold only when slider moved
     def showThreshold(self):  
         self.slice_view.renderer.AddActor(self.threshold_actor)  
@@ -616,7 +737,7 @@ class SegmentationModuleTab(QWidget):
 
     def setColorLumen(self, on:bool):
         if on:
-            self.draw_value = 2
+            self.draw_value = LABEL_LUMEN
             self.circle_actor.GetProperty().SetColor(COLOR_LUMEN)  # set color of circle to lumen 
             self.circle3D_actor.GetProperty().SetColor(COLOR_LUMEN)
             self.sphere3D_actor.GetProperty().SetColor(COLOR_LUMEN)
@@ -626,7 +747,7 @@ class SegmentationModuleTab(QWidget):
 
     def setColorPlaque(self, on:bool):
         if on:
-            self.draw_value = 1
+            self.draw_value = LABEL_PLAQUE
             self.circle_actor.GetProperty().SetColor(COLOR_PLAQUE)  # set color of circle to plaque 
             self.circle3D_actor.GetProperty().SetColor(COLOR_PLAQUE)
             self.sphere3D_actor.GetProperty().SetColor(COLOR_PLAQUE)
@@ -666,22 +787,12 @@ class SegmentationModuleTab(QWidget):
         if event == "RightButtonPressEvent": # check if left (-> brush) or right (-> eraser) mouse button pressed
             self.eraser = True 
 
-        # draw first point at position clicked on
+        # draw first point at position clicked on, record the stroke for undo
+        self.labels.beginRecording()
         self.draw(obj,event)
 
         # check if pipeline needs updates
-        if self.plaque_pending and self.draw_value == 1.0:
-            self.model_view.renderer.AddActor(self.model_view.actor_plaque)
-            self.model_view.renderer.AddActor(self.plaque_outline_actor3D)
-            self.model_view.renderer.ResetCamera()
-            self.plaque_pending = False
-            self.slice_view.GetRenderWindow().Render()
-        elif self.lumen_pending and self.draw_value == 2.0:
-            self.model_view.renderer.AddActor(self.model_view.actor_lumen)
-            self.model_view.renderer.AddActor(self.lumen_outline_actor3D)
-            self.model_view.renderer.ResetCamera()
-            self.lumen_pending = False
-            self.slice_view.GetRenderWindow().Render()
+        self.__showNewLabels()
 
         # draw as long as left mouse button pressed down 
         self.drawEvent = self.slice_view.interactor_style.AddObserver("MouseMoveEvent", self.draw) 
@@ -714,13 +825,14 @@ class SegmentationModuleTab(QWidget):
             if self.eraser: 
                 # erase only current draw value 
                 mask[self.label_map_data[x0:x1,y0:y1,z] != self.draw_value] = False   
-                self.label_map_data[x0:x1,y0:y1,z][mask] = 0
+                value = 0
             else:
                 # draw only if HU above threshold 
-                threshold = self.threshold_mask[x0:x1,y0:y1,z]  
+                threshold = self.image_data[x0:x1,y0:y1,z] >= self.threshold
                 mask = threshold & mask
-                self.label_map_data[x0:x1,y0:y1,z][mask] = self.draw_value
-
+                value = self.draw_value
+            z0, z1 = z, z+1
+            mask = mask[:,:,np.newaxis]
 
         else: 
             # draw sphere
@@ -733,25 +845,42 @@ class SegmentationModuleTab(QWidget):
             if self.eraser: 
                  # erase only current draw value
                 mask[self.label_map_data[x0:x1,y0:y1,z0:z1] != self.draw_value] = False  
-                self.label_map_data[x0:x1,y0:y1,z0:z1][mask] = 0
+                value = 0
             else:
                 # draw only if HU above threshold
-                threshold = self.threshold_mask[x0:x1,y0:y1,z0:z1]
+                threshold = self.image_data[x0:x1,y0:y1,z0:z1] >= self.threshold
                 mask = threshold & mask
-                self.label_map_data[x0:x1,y0:y1,z0:z1][mask] = self.draw_value  
+                value = self.draw_value
 
-        # update the label map (shallow copies make this efficient)   
-        vtk_data_array = numpy_to_vtk(self.label_map_data.ravel(order='F'))
-        self.label_map.GetPointData().SetScalars(vtk_data_array)
+        # update the label map (shared buffer, only the brush box is marked modified)
+        self.labels.paint(x0, x1, y0, y1, z0, z1, mask, value)
         self.slice_view.GetRenderWindow().Render()
         
         
+    def __showNewLabels(self):
+        # add the actors of labels that exist for the first time
+        if self.plaque_pending and self.labels.contains(LABEL_PLAQUE):
+            self.model_view.renderer.AddActor(self.model_view.actor_plaque)
+            self.model_view.renderer.AddActor(self.plaque_outline_actor3D)
+            self.model_view.camera_reset_pending = True # surface is extracted in the background
+            self.plaque_pending = False
+            self.slice_view.GetRenderWindow().Render()
+        if self.lumen_pending and self.labels.contains(LABEL_LUMEN):
+            self.model_view.renderer.AddActor(self.model_view.actor_lumen)
+            self.model_view.renderer.AddActor(self.lumen_outline_actor3D)
+            self.model_view.camera_reset_pending = True # surface is extracted in the background
+            self.lumen_pending = False
+            self.slice_view.GetRenderWindow().Render()
+
+
     def end_draw(self, obj, event):
         self.slice_view.interactor_style.RemoveObserver(self.drawEvent)  
         self.slice_view.interactor_style.RemoveObserver(self.endEvent) 
+        self.history.push(self.labels.endRecording())
+        self.updateUndoActions()
 
         if self.toolbar_auto_update.isChecked():  # update if auto-update is checked
-            self.model_view.padding.SetInputData(self.label_map)
+            self.model_view.requestSurfaceUpdate(self.labels) # meshed in the background
             self.model_view.GetRenderWindow().Render()
             self.marker = True
 
@@ -759,6 +888,35 @@ class SegmentationModuleTab(QWidget):
             self.eraser = False 
         
 
+    def undo(self):
+        if self.history is None or self.labels.recording is not None: # not during a stroke
+            return
+        if self.history.undo():
+            self.__labelsRestored()
+
+
+    def redo(self):
+        if self.history is None or self.labels.recording is not None:
+            return
+        if self.history.redo():
+            self.__labelsRestored()
+
+
+    def __labelsRestored(self):
+        # the delta is already in the shared buffer, only views need updates
+        self.__showNewLabels()
+        if self.toolbar_auto_update.isChecked():
+            self.model_view.requestSurfaceUpdate(self.labels)
+        self.updateUndoActions()
+        self.slice_view.GetRenderWindow().Render()
+        self.data_modified.emit()
+
+
+    def updateUndoActions(self):
+        self.toolbar_undo.setEnabled(self.history is not None and self.history.canUndo())
+        self.toolbar_redo.setEnabled(self.history is not None and self.history.canRedo())
+
+
     def saveChanges(self, path_seg, path_lumen, path_plaque):
         # catch if one side has something to save, other side not
         if self.label_map is None:
@@ -769,49 +927,21 @@ class SegmentationModuleTab(QWidget):
             return
 
         # save segmentation nrrd
-        sx, sy, sz = self.label_map.GetSpacing()
-        ox, oy, oz = self.label_map.GetOrigin()
-        header = OrderedDict()
-        header['type'] = 'unsigned char'
-        header['dimension'] = 3
-        header['space'] = 'left-posterior-superior'
-        header['sizes'] = '120 144 248' # fixed model size
-        header['space directions'] = [[sx, 0, 0], [0, sy, 0], [0, 0, sz]]
-        header['kinds'] = ['domain', 'domain', 'domain']
-        header['endian'] = 'little'
-        header['encoding'] = 'gzip'
-        header['space origin'] = [ox, oy, oz]
-        header['Segment0_ID'] = 'Segment_1'
-        header['Segment0_Name'] = 'plaque'
-        header['Segment0_Color'] = str(241/255) + ' ' + str(214/255) + ' ' + str(145/255)
-        header['Segment0_LabelValue'] = 1
-        header['Segment0_Layer'] = 0
-        header['Segment0_Extent'] = '0 119 0 143 0 247'
-        header['Segment1_ID'] = 'Segment_2'
-        header['Segment1_Name'] = 'lumen'
-        header['Segment1_Color'] = str(216/255) + ' ' + str(101/255) + ' ' + str(79/255)
-        header['Segment1_LabelValue'] = 2
-        header['Segment1_Layer'] = 0
-        header['Segment1_Extent'] = '0 119 0 143 0 247'
-        segmentation = vtk_to_numpy(self.label_map.GetPointData().GetScalars())
-        segmentation = segmentation.reshape(x_dim, y_dim, z_dim, order='F')
-        nrrd.write(path_seg, segmentation, header)
-
-        # save models
-        writer = vtk.vtkSTLWriter()
-        lumen = self.model_view.smoother_lumen.GetOutput()
-        if lumen.GetNumberOfPoints() > 0:
-            writer.SetFileName(path_lumen)
-            writer.SetInputData(lumen)
-            writer.Write()
-        plaque = self.model_view.smoother_plaque.GetOutput()
-        if plaque.GetNumberOfPoints() > 0:
-            writer.SetFileName(path_plaque)
-            writer.SetInputData(plaque)
-            writer.Write()
+        writeSegmentation(self.label_map_data, self.label_map.GetSpacing(), self.label_map.GetOrigin(), path_seg)
+
+        # save models (extracted now if the shown surfaces are outdated)
+        if not self.model_view.surfacesCurrent(self.label_map):
+            self.model_view.updateSurfaces(self.labels)
+            self.model_view.GetRenderWindow().Render()
+        writeSTL(self.model_view.surface_lumen, path_lumen)
+        writeSTL(self.model_view.surface_plaque, path_plaque)
 
 
     def close(self):
+        if self.prediction_thread is not None:
+            self.cancelPrediction()
+            self.prediction_thread.wait()
+        self.model_view.stopSurfaceUpdates()
         self.slice_view.Finalize()
         self.model_view.Finalize()
 
@@ -823,16 +953,21 @@ class SegmentationModule(QTabWidget):
     """
     new_segmentation = pyqtSignal()
     new_models = pyqtSignal()
+    thread_started = pyqtSignal()
+    thread_finished = pyqtSignal()
     def __init__(self, parent=None):
         super().__init__(parent)
         self.patient_dict = None
 
-        self.predictor = CarotidSegmentationPredictor()
-        self.segmentation_module_left = SegmentationModuleTab(self.predictor)
-        self.segmentation_module_right = SegmentationModuleTab(self.predictor)
+        self.predictor_service = PredictorService() # CNN is loaded on first use or by warmUp()
+        self.segmentation_module_left = SegmentationModuleTab(self.predictor_service)
+        self.segmentation_module_right = SegmentationModuleTab(self.predictor_service)
 
         self.segmentation_module_left.data_modified.connect(self.dataModifiedLeft)
         self.segmentation_module_right.data_modified.connect(self.dataModifiedRight)
+        for tab in (self.segmentation_module_left, self.segmentation_module_right):
+            tab.thread_started.connect(self.thread_started)
+            tab.thread_finished.connect(self.thread_finished)
 
         self.addTab(self.segmentation_module_right, "Right")
         self.addTab(self.segmentation_module_left, "Left")
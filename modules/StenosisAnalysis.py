@@ -0,0 +1,259 @@
+"""
+Qt-free stenosis analysis of centerlines.
+Used by the stenosis classifier module and by the cohort report (stenosis_report.py).
+"""
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+from defaults import *
+
+
+class Branch():
+    """
+    One branch of a BranchTree: the part of a centerline after it split from an earlier line.
+    """
+    def __init__(self, line, parent=None, split_index=0):
+        self.line = line                # index of the centerline (cell) the branch belongs to
+        self.parent = parent            # parent Branch, None for the line starting at the inlet
+        self.split_index = split_index  # index in the points of the parent where the branch starts
+        self.children = []
+        self.point_ids = []             # point ids in the merged centerlines
+        self.positions = None           # nx3 numpy array with point positions
+        self.arc = None                 # n numpy array with the arc length from the inlet (accumulated)
+        self.radii = None               # n numpy array with the maximal inscribed sphere radius
+
+
+    def length(self):
+        return float(self.arc[-1] - self.arc[0]) if len(self.arc) > 0 else 0.0
+
+
+
+class BranchTree():
+    """
+    Branches of vmtk centerlines (one line per outlet, all starting at the inlet).
+    Coincident points of the lines are merged, the lines are inserted into a prefix
+    trie of point ids in one pass. A line becomes a branch starting at its first point
+    not shared with an earlier line, its parent is the branch of the last shared point.
+    """
+    def __init__(self, centerlines, min_branch_len=20, branch_cutoff=1, merge_tolerance=CENTERLINE_MERGE_TOLERANCE):
+        """
+            Args:
+            centerlines (vtkPolyData): vmtk centerlines with MaximumInscribedSphereRadius
+            min_branch_len (float): shorter branches (mm) are removed, their sub-branches start
+                                    with their points and are attached to their parent
+            branch_cutoff (float): length clipped from both branch ends (mm)
+            merge_tolerance (float): points closer than this (mm) are the same point
+        """
+        clean = vtk.vtkCleanPolyData()
+        clean.SetInputData(centerlines)
+        clean.PointMergingOn()
+        clean.ToleranceIsAbsoluteOn()
+        clean.SetAbsoluteTolerance(merge_tolerance)
+        clean.Update()
+        merged = clean.GetOutput()
+        self.branches = []
+        if merged.GetNumberOfPoints() == 0:
+            return
+        points = vtk_to_numpy(merged.GetPoints().GetData()).astype(np.float64)
+        radii = vtk_to_numpy(merged.GetPointData().GetArray('MaximumInscribedSphereRadius')).astype(np.float64)
+
+        # prefix trie, node 0 is the root (before the first point)
+        children = [{}]      # per node: point id -> child node
+        node_branch = [None] # per node: branch containing its point
+        node_index = [-1]    # per node: index of its point in the branch
+        l = merged.GetLines()
+        l.InitTraversal()
+        for i in range(l.GetNumberOfCells()):
+            pointIds = vtk.vtkIdList()
+            l.GetNextCell(pointIds)
+            ids = [pointIds.GetId(k) for k in range(pointIds.GetNumberOfIds())]
+
+            # follow the shared prefix
+            node, k = 0, 0
+            while k < len(ids) and ids[k] in children[node]:
+                node = children[node][ids[k]]
+                k += 1
+            if k == len(ids):
+                continue # duplicate of an earlier line
+
+            parent = node_branch[node]
+            branch = Branch(i, parent, node_index[node] + 1)
+            branch.point_ids = ids[k:]
+            for index, point_id in enumerate(branch.point_ids):
+                children.append({})
+                node_branch.append(branch)
+                node_index.append(index)
+                children[node][point_id] = len(children) - 1
+                node = len(children) - 1
+
+            branch.positions = points[branch.point_ids]
+            branch.radii = radii[branch.point_ids]
+            steps = np.linalg.norm(np.diff(branch.positions, axis=0), axis=1)
+            arc0 = 0.0
+            if parent is not None:
+                # arc length continues from the last shared point
+                shared = branch.split_index - 1
+                arc0 = parent.arc[shared] + np.linalg.norm(branch.positions[0] - parent.positions[shared])
+                parent.children.append(branch)
+            branch.arc = arc0 + np.concatenate(([0.0], np.cumsum(steps)))
+            self.branches.append(branch)
+
+        self.__removeShortBranches(min_branch_len, branch_cutoff)
+        self.__clipBranchEnds(branch_cutoff)
+
+
+    def roots(self):
+        return [b for b in self.branches if b.parent is None]
+
+
+    def parentIndices(self):
+        """
+        Returns (parent idx, branch point idx) per branch, (own idx, 0) for branches without parent.
+        """
+        index = {id(b): i for i, b in enumerate(self.branches)}
+        return [(i, 0) if b.parent is None else (index[id(b.parent)], b.split_index)
+                for i, b in enumerate(self.branches)]
+
+
+    def __removeShortBranches(self, min_branch_len, branch_cutoff):
+        # children are created after their parents, reverse order handles them first
+        for branch in reversed(list(self.branches)):
+            if branch.length() >= min_branch_len and branch.length() > 2 * branch_cutoff:
+                continue
+            self.branches.remove(branch)
+            if branch.parent is not None:
+                branch.parent.children.remove(branch)
+            for child in branch.children:
+                self.__mergeIntoChild(branch, child)
+
+
+    def __mergeIntoChild(self, branch, child):
+        # the child takes over the points of the removed branch up to its origin
+        # and becomes a sub-branch of the removed branch's parent
+        prefix = child.split_index
+        child.point_ids = branch.point_ids[:prefix] + child.point_ids
+        child.positions = np.concatenate((branch.positions[:prefix], child.positions))
+        child.arc = np.concatenate((branch.arc[:prefix], child.arc))
+        child.radii = np.concatenate((branch.radii[:prefix], child.radii))
+        child.parent = branch.parent
+        child.split_index = branch.split_index
+        if branch.parent is not None:
+            branch.parent.children.append(child)
+        for grandchild in child.children:
+            grandchild.split_index += prefix
+
+
+    def __clipBranchEnds(self, branch_cutoff):
+        for branch in self.branches:
+            start = branch.arc[0] + branch_cutoff
+            end = branch.arc[-1] - branch_cutoff
+            clip_ids = np.searchsorted(branch.arc, [start, end])
+            if clip_ids[1] - clip_ids[0] < 2:
+                continue # too few points, keep the whole branch
+            branch.point_ids = branch.point_ids[clip_ids[0]:clip_ids[1]]
+            branch.positions = branch.positions[clip_ids[0]:clip_ids[1]]
+            branch.arc = branch.arc[clip_ids[0]:clip_ids[1]]
+            branch.radii = branch.radii[clip_ids[0]:clip_ids[1]]
+            for child in branch.children:
+                child.split_index = int(np.clip(child.split_index - clip_ids[0], 0, len(branch.arc)-1))
+
+
+
+def centerlineBranches(centerlines, min_branch_len=20, branch_cutoff=1):
+    """
+    Splits vmtk centerlines into branches (see BranchTree).
+    Returns lists with one entry per branch:
+        positions     nx3 numpy arrays with point positions
+        arc lengths   n numpy arrays with the arc length along the line (accumulated)
+        radii         n numpy arrays with the maximal inscribed sphere radius
+        parents       tuples (parent idx, branch point idx), a line starting at the inlet is its own parent
+    """
+    tree = BranchTree(centerlines, min_branch_len, branch_cutoff)
+    return ([b.positions for b in tree.branches],
+            [b.arc for b in tree.branches],
+            [b.radii for b in tree.branches],
+            tree.parentIndices())
+
+
+def branchSegments(branch, arc_lists, parent_indices):
+    """
+    Returns the (start, end) point indices of the parts of a branch between its sub-branch origins.
+    """
+    split_ids = set(index_tuple[1] for index_tuple in parent_indices
+                    if index_tuple[0] == branch and index_tuple[1] != 0)
+    ids = sorted(split_ids | {0, len(arc_lists[branch])-1})
+    return list(zip(ids[:-1], ids[1:]))
+
+
+def stenosisRanges(radii, r_thresh, start_index, end_index):
+    """
+    Returns the (first index below, first index above again) pairs of all ranges in
+    radii[start_index:end_index] below the radius threshold. Ranges touching the
+    ends of the segment or closer than 10 points to the branch ends are skipped.
+    """
+    radii_ranges = np.where(radii[start_index:end_index] < r_thresh, 0, 1)
+    radii_ranges[-1] = 1 # closes open ends
+    radii_ranges = radii_ranges - np.roll(radii_ranges, 1)
+    indices_down = np.where(radii_ranges == -1)[0] + start_index
+    indices_up = np.where(radii_ranges == 1)[0] + start_index
+    assert indices_down.size == indices_up.size
+
+    ranges = []
+    for idx1, idx2 in zip(indices_down, indices_up):
+        # catch if too close to branch end
+        if (idx1 <= 10 or
+            idx2 >= radii.shape[0] - 10 or
+            idx1 == start_index or
+            idx2 == end_index - 1):
+            continue
+        ranges.append((int(idx1), int(idx2)))
+    return ranges
+
+
+def referenceIndex(idx1, idx2, length):
+    """
+    Default NASCET reference point: distal to the stenosis by half its length.
+    """
+    return min(idx2 + int((idx2 - idx1)/2), length-2)
+
+
+def nascetDegree(min_diameter, ref_diameter):
+    """
+    Stenosis degree (%) after NASCET: narrowing relative to the distal reference diameter.
+    """
+    return ((ref_diameter - min_diameter) / ref_diameter) * 100.0
+
+
+def analyzeStenosis(arc, rad, idx1, idx2, ref_idx=None):
+    """
+    Returns the measures of the stenosis between idx1 and idx2 of a branch as a dict.
+    """
+    if ref_idx is None:
+        ref_idx = referenceIndex(idx1, idx2, rad.shape[0])
+    min_idx = idx1 + int(np.argmin(rad[idx1:idx2]))
+    min_diameter = 2.0 * float(rad[min_idx])
+    ref_diameter = 2.0 * float(rad[ref_idx])
+    return {"min_index": min_idx,
+            "ref_index": ref_idx,
+            "min_diameter": min_diameter,
+            "ref_diameter": ref_diameter,
+            "degree": nascetDegree(min_diameter, ref_diameter),
+            "length": float(arc[idx2] - arc[idx1])}
+
+
+def detectStenoses(arc, rad, segments, threshold_fraction=STENOSIS_REPORT_THRESHOLD):
+    """
+    Automatic stenosis detection of one branch: in each segment, ranges below
+    threshold_fraction of the median segment diameter are stenoses.
+    Returns a list of analyzeStenosis() dicts.
+    """
+    stenoses = []
+    for id0, id1 in segments:
+        if id1 <= id0:
+            continue
+        r_thresh = threshold_fraction * float(np.median(rad[id0:id1+1]))
+        for idx1, idx2 in stenosisRanges(rad, r_thresh, id0, id1+1):
+            stenoses.append(analyzeStenosis(arc, rad, idx1, idx2))
+    return stenoses
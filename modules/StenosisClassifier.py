@@ -3,7 +3,6 @@ import json
 
 import numpy as np
 import vtk
-from vtk.util.numpy_support import vtk_to_numpy
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 from PyQt5.QtWidgets import QWidget, QShortcut, QHBoxLayout, QTabWidget, QGraphicsPathItem
 from PyQt5.QtGui import QColor, QPainterPath, QKeySequence
@@ -11,6 +10,7 @@ from PyQt5.QtCore import Qt, QRectF, pyqtSignal
 import pyqtgraph as pg
 
 from defaults import *
+from modules.StenosisAnalysis import BranchTree, stenosisRanges, referenceIndex, nascetDegree
 
 # Override pyqtgraph defaults
 pg.setConfigOption('background', 'w')
@@ -235,7 +235,7 @@ class StenosisWrapper(object):
         self.min_diameter_normal /= np.linalg.norm(self.min_diameter_normal)
         half_stenosis_length = int((idx2 - idx1)/2)
         self.stenosis_arc_len = self.arc[idx2] - self.arc[idx1]
-        ref_idx = min(idx2 + half_stenosis_length, self.pos.shape[0]-2)
+        ref_idx = referenceIndex(idx1, idx2, self.pos.shape[0])
         self.ref_diameter_pos = self.pos[ref_idx]
         self.ref_diameter_normal = np.mean(self.pos[min_idx:min_idx+6] - self.pos[min_idx-5:min_idx+1], axis=0)
         self.ref_diameter_normal /= np.linalg.norm(self.ref_diameter_normal)
@@ -300,7 +300,7 @@ class StenosisWrapper(object):
         
     def __computeStenosisDegree(self, ref_idx):
         nascet_ref_dia = 2.0 * self.rad[ref_idx]
-        self.degree = ((nascet_ref_dia - self.nascet_min_dia) / nascet_ref_dia) * 100.0
+        self.degree = nascetDegree(self.nascet_min_dia, nascet_ref_dia)
         self.degree_string = f'{self.degree:.1f}%'
         self.full_description =  f'Stenosis degree (NASCET): {self.degree_string}\n'\
                                  f'Smallest inner diameter: {self.nascet_min_dia:.1f} mm\n'\
@@ -387,6 +387,7 @@ class StenosisClassifierTab(QWidget):
         self.min_branch_len = 20 # minimal length of a branch in mm
         self.branch_cutoff = 1  # length to be cut from branch ends in mm
 
+        self.branch_tree = None     # BranchTree of the centerlines
         self.c_radii_lists = []     # processed centerline radii
         self.c_pos_lists = []       # processed centerline positions
         self.c_arc_lists = []       # processed centerline arc length (cumulated)
@@ -541,88 +542,14 @@ class StenosisClassifierTab(QWidget):
 
 
     def __preprocessCenterlines(self):
-        # lists for each line in centerlines
-        # lines are ordered source->outlet
-        self.c_pos_lists = []       # 3xn numpy arrays with point positions
-        self.c_arc_lists = []       # 1xn numpy arrays with arc length along centerline (accumulated)
-        self.c_radii_lists = []     # 1xn numpy arrays with maximal inscribed sphere radius
-        self.c_parent_indices = []  # tuple per list: (parent idx, branch point idx)
+        # lists for each branch of the tree, ordered source->outlet
         self.clearStenoses() # empties the list of actors and removes them from rendering
-
-        # iterate all (global) lines
-        # each line is a vtkIdList containing point ids in the right order
-        centerlines = self.reader_centerline.GetOutput()
-        radii_flat = centerlines.GetPointData().GetArray('MaximumInscribedSphereRadius')
-        l = centerlines.GetLines()
-        l.InitTraversal()
-        for i in range(l.GetNumberOfCells()):
-            pointIds = vtk.vtkIdList()
-            l.GetNextCell(pointIds)
-
-            # retrieve position data
-            points = vtk.vtkPoints()
-            centerlines.GetPoints().GetPoints(pointIds, points)
-            p = vtk_to_numpy(points.GetData())
-
-            # calculate arc len
-            arc = p - np.roll(p, 1, axis=0)
-            arc = np.sqrt((arc*arc).sum(axis=1))
-            arc[0] = 0
-            arc = np.cumsum(arc)
-
-            # retrieve radius data
-            radii = vtk.vtkDoubleArray()
-            radii.SetNumberOfTuples(pointIds.GetNumberOfIds())
-            radii_flat.GetTuples(pointIds, radii)
-            r = vtk_to_numpy(radii)
-
-            # add to centerlines
-            self.c_pos_lists.append(p)
-            self.c_arc_lists.append(arc)
-            self.c_radii_lists.append(r)
-            self.c_parent_indices.append((i,0)) # points to own origin
-            self.c_stenosis_lists.append([]) # for storing actors later
-
-        # cleanup branch overlaps
-        # (otherwise each line starts at the inlet)
-        for i in range(0, len(self.c_pos_lists)):
-            for j in range(i+1, len(self.c_pos_lists)):
-                len0 = self.c_pos_lists[i].shape[0]
-                len1 = self.c_pos_lists[j].shape[0]
-                if len0 < len1:
-                    overlap_mask = np.not_equal(self.c_pos_lists[i], self.c_pos_lists[j][:len0])
-                else:
-                    overlap_mask = np.not_equal(self.c_pos_lists[i][:len1], self.c_pos_lists[j])
-                overlap_mask = np.all(overlap_mask, axis=1) # AND over tuples
-                split_index = np.searchsorted(overlap_mask, True) # first position where lines diverge
-
-                if split_index <= 0:
-                    continue # no new parent was found
-
-                # save parent and position
-                self.c_parent_indices[j] = (i,split_index)
-                
-                # clip line to remove overlaps
-                self.c_pos_lists[j] = self.c_pos_lists[j][split_index:]
-                self.c_arc_lists[j] = self.c_arc_lists[j][split_index:]
-                self.c_radii_lists[j] = self.c_radii_lists[j][split_index:]
-
-        # remove branches below the minimum length
-        for i in range(len(self.c_arc_lists)-1, -1, -1):
-            if self.c_arc_lists[i][-1] - self.c_arc_lists[i][0] < self.min_branch_len:
-                del self.c_pos_lists[i]
-                del self.c_arc_lists[i]
-                del self.c_radii_lists[i]
-                del self.c_parent_indices[i]
-
-        # clip branch ends
-        for i in range(len(self.c_arc_lists)):
-            start = self.c_arc_lists[i][0] + self.branch_cutoff
-            end = self.c_arc_lists[i][-1] - self.branch_cutoff
-            clip_ids = np.searchsorted(self.c_arc_lists[i], [start, end])
-            self.c_pos_lists[i] = self.c_pos_lists[i][clip_ids[0]:clip_ids[1]]
-            self.c_arc_lists[i] = self.c_arc_lists[i][clip_ids[0]:clip_ids[1]]
-            self.c_radii_lists[i] = self.c_radii_lists[i][clip_ids[0]:clip_ids[1]]
+        self.branch_tree = BranchTree(self.reader_centerline.GetOutput(), self.min_branch_len, self.branch_cutoff)
+        self.c_pos_lists = [b.positions for b in self.branch_tree.branches]
+        self.c_arc_lists = [b.arc for b in self.branch_tree.branches]
+        self.c_radii_lists = [b.radii for b in self.branch_tree.branches]
+        self.c_parent_indices = self.branch_tree.parentIndices()
+        self.c_stenosis_lists = [[] for _ in self.c_pos_lists] # for storing actors later
 
         # create branch clippers
         self.branch_actors = []
@@ -693,11 +620,9 @@ class StenosisClassifierTab(QWidget):
                     subbranch_ids.append(index_tuple[1])
                     x = self.c_arc_lists[i][index_tuple[1]]
                     lineplot.addItem(pg.InfiniteLine(pos=x, angle=90, pen=dashed_pen))
-            subbranch_ids = sorted(subbranch_ids)
 
-            # draw horizontal sliders
-            subbranch_ids.insert(0, 0) # line start id
-            subbranch_ids.append(len(self.c_arc_lists[i])-1) # line end id
+            # draw horizontal sliders between line start, sub-branch origins and line end
+            subbranch_ids = sorted(set(subbranch_ids) | {0, len(self.c_arc_lists[i])-1})
             for j in range(len(subbranch_ids)-1):
                 id0 = subbranch_ids[j]
                 id1 = subbranch_ids[j+1]
@@ -750,15 +675,6 @@ class StenosisClassifierTab(QWidget):
 
         start_index = np.searchsorted(arc, lineROI.x_start)
         end_index = np.searchsorted(arc, lineROI.x_end) + 1
-        radii_ranges = np.where(rad[start_index:end_index] < r_thresh, 0, 1)
-        radii_ranges[-1] = 1 # closes open ends
-        radii_ranges = radii_ranges - np.roll(radii_ranges, 1)
-
-        # compute threshold indices, save in lineROI for later use
-        indices_down = np.where(radii_ranges == -1)[0] + start_index
-        indices_up = np.where(radii_ranges == 1)[0] + start_index
-        nr_stenoses = indices_down.size
-        assert nr_stenoses == indices_up.size
 
         # cleanup all stenoses with same start index
         for i in range(len(stenosis_list)-1, -1, -1):
@@ -768,18 +684,8 @@ class StenosisClassifierTab(QWidget):
                 del stenosis_list[i]
                 self.nr_stenoses -= 1
 
-        # create a stenosis object for each case
-        for i in range(indices_down.size):
-            idx1 = indices_down[i]
-            idx2 = indices_up[i]
-            
-            # catch if too close to branch end
-            if (idx1 <= 10 or 
-                idx2 >= pos.shape[0] - 10 or
-                idx1 == start_index or
-                idx2 == end_index - 1):
-                continue
-
+        # create a stenosis object for each range below the threshold
+        for idx1, idx2 in stenosisRanges(rad, r_thresh, start_index, end_index):
             stenosis = StenosisWrapper(self.renderer, 
                                        self.lineplots[lineROI.plot_id],
                                        lineROI,
@@ -0,0 +1,105 @@
+import os
+import json
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk
+
+from defaults import *
+
+CACHE_DIR_NAME = ".volume_cache" # not matched by the case* pattern of the working dir
+
+
+def cachePaths(volume_path):
+    """
+    Returns the (data, meta) file paths of the uncompressed cache entry of a volume.
+    Cache entries are kept in one folder per working directory (parent of the case folder).
+    """
+    case_folder = os.path.dirname(os.path.abspath(volume_path))
+    cache_dir = os.path.join(os.path.dirname(case_folder), CACHE_DIR_NAME)
+    name = os.path.splitext(os.path.basename(volume_path))[0]
+    return os.path.join(cache_dir, name + ".npy"), os.path.join(cache_dir, name + ".json")
+
+
+def loadCachedVolume(volume_path):
+    """
+    Returns a vtkImageData that wraps the memory-mapped cache entry of a volume
+    without copying, or None if there is no valid entry.
+    Entries are valid if the source file did not change since they were written.
+    """
+    data_path, meta_path = cachePaths(volume_path)
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        stat = os.stat(volume_path)
+        if meta['source_mtime'] != stat.st_mtime or meta['source_size'] != stat.st_size:
+            return None
+        # copy-on-write mapping: pages are only read on access, VTK gets a writable buffer
+        data = np.load(data_path, mmap_mode='c')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    try:
+        os.utime(data_path) # mark as recently used for eviction
+    except OSError:
+        pass # the cache is optional
+    image = vtk.vtkImageData()
+    image.SetDimensions(data.shape)
+    image.SetSpacing(meta['spacing'])
+    image.SetOrigin(meta['origin'])
+    image.GetPointData().SetScalars(numpy_to_vtk(data.ravel(order='F'))) # view, data is Fortran ordered
+    return image
+
+
+def writeVolumeCache(volume_path, data, spacing, origin):
+    """
+    Writes an uncompressed cache entry for a volume file.
+    The data array is expected in (x, y, z) order; it is stored in Fortran order.
+    """
+    data_path, meta_path = cachePaths(volume_path)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    stat = os.stat(volume_path)
+    meta = {"source_mtime": stat.st_mtime,
+            "source_size": stat.st_size,
+            "spacing": [float(s) for s in spacing],
+            "origin": [float(o) for o in origin]}
+
+    # write to temporary files first, a crash must not leave a valid looking entry
+    with open(data_path + ".tmp", 'wb') as f:
+        np.save(f, np.asfortranarray(data))
+    with open(meta_path + ".tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    evictVolumeCache(os.path.dirname(data_path))
+
+
+def removeCachedVolume(volume_path):
+    for path in reversed(cachePaths(volume_path)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def evictVolumeCache(cache_dir, max_size=VOLUME_CACHE_MAX_SIZE):
+    """
+    Removes least recently used entries until the cache folder is below max_size bytes.
+    """
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path[:-4] + ".json") # invalidate first
+            os.remove(path)
+        except OSError:
+            continue # still mapped (Windows)
+        total_size -= size
@@ -0,0 +1,164 @@
+"""
+Timing benchmark and regression check of the centerline branch extraction.
+Builds synthetic vmtk-like centerlines (every line starts at the inlet, shared
+sections are duplicated points) with an increasing number of outlets and compares
+the former pairwise overlap search (exact float comparison of all line pairs)
+with StenosisAnalysis.BranchTree (prefix trie of merged point ids).
+Exits with code 1 if a branch gets a wrong parent or split index, also for
+lines with jittered (e.g. resampled) shared points. With the default branch
+length limit and end clipping, nested splits, short inner branches (merged into
+their sub-branches) and short leaves (removed) are checked as well.
+
+Usage: python scripts/benchmark_branch_tree.py [--points 400] [--jitter 1e-6]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.StenosisAnalysis import BranchTree
+
+OUTLETS = [2, 8, 32, 128]
+
+
+def bend(start, n, angle):
+    # n points with 0.5 mm steps in z, leaving start in direction angle
+    t = 0.5 * np.arange(1, n + 1)
+    return start + np.stack([t * np.cos(angle), t * np.sin(angle), 0.5 * t], axis=1)
+
+
+def polyLines(lines):
+    """
+    vtkPolyData with one line cell per point array, no points are shared between cells.
+    """
+    positions = np.concatenate(lines)
+    centerlines = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(positions, deep=True))
+    centerlines.SetPoints(vtk_points)
+    cells = vtk.vtkCellArray()
+    offset = 0
+    for line in lines:
+        cells.InsertNextCell(len(line))
+        for k in range(len(line)):
+            cells.InsertCellPoint(offset + k)
+        offset += len(line)
+    centerlines.SetLines(cells)
+    radii = numpy_to_vtk(np.full(len(positions), 2.0), deep=True)
+    radii.SetName('MaximumInscribedSphereRadius')
+    centerlines.GetPointData().AddArray(radii)
+    return centerlines
+
+
+def syntheticCenterlines(outlets, points, jitter, seed=0):
+    """
+    Line 0 runs along z, line j copies the first split_j points of line 0 and then bends away.
+    Returns the centerlines, the lines and the split index of each line j > 0.
+    """
+    rng = np.random.default_rng(seed)
+    main = np.stack([np.zeros(points), np.zeros(points), 0.5 * np.arange(points)], axis=1)
+    lines = [main]
+    splits = []
+    for j in range(1, outlets):
+        split = int(rng.integers(20, points - 20))
+        shared = main[:split] + rng.uniform(-jitter, jitter, size=(split, 3))
+        lines.append(np.concatenate([shared, bend(main[split-1], points - split, 2 * np.pi * j / outlets)]))
+        splits.append(split)
+    return polyLines(lines), lines, splits
+
+
+def topologyCases():
+    """
+    Returns (name, lines, expected parent indices) with min_branch_len=20 and branch_cutoff=1.
+    Points are 0.5 mm apart, clipping 1 mm removes the first 2 points of each branch,
+    so split indices in a parent are 2 lower than in the unclipped line.
+    """
+    main = np.stack([np.zeros(400), np.zeros(400), 0.5 * np.arange(400)], axis=1)
+    line1 = np.concatenate([main[:100], bend(main[99], 200, 0.5)])     # branch 1 starts at index 100 of line 0
+    line2 = np.concatenate([line1[:150], bend(line1[149], 200, 2.5)])  # starts at index 50 of branch 1
+    cases = [("nested split", [main, line1, line2], [(0, 0), (0, 98), (1, 48)])]
+
+    # inner branch of 3.5 mm and of a single point (below 2x cutoff), its sub-branch takes over its points
+    for stub_points in (6, 1):
+        stub = np.concatenate([main[:100], bend(main[99], stub_points, 0.5)])
+        sub = np.concatenate([stub, bend(stub[-1], 200, 2.5)])
+        cases.append(("short inner branch ({} points)".format(stub_points), [main, stub, sub], [(0, 0), (0, 98)]))
+
+    # leaf of 6 mm is removed, the sub-branch of branch 1 keeps its split index
+    leaf = np.concatenate([main[:200], bend(main[199], 10, 4.0)])
+    cases.append(("short leaf", [main, line1, leaf, line2], [(0, 0), (0, 98), (1, 48)]))
+    return cases
+
+
+def checkTopology():
+    failed = False
+    for name, lines, expected in topologyCases():
+        tree = BranchTree(polyLines(lines))
+        empty = [i for i, b in enumerate(tree.branches) if len(b.arc) < 2]
+        if tree.parentIndices() != expected or empty:
+            print("Wrong branch tree for the {} case: {}, expected {}{}".format(
+                name, tree.parentIndices(), expected, ", empty branches" if empty else ""))
+            failed = True
+        for b in tree.branches:
+            if b.parent is not None and b not in b.parent.children:
+                print("Parent of a branch does not list it as child in the {} case".format(name))
+                failed = True
+    return failed
+
+
+def pairwiseOverlap(lines):
+    # former StenosisClassifierTab.__preprocessCenterlines overlap cleanup
+    pos_lists = list(lines)
+    parent_indices = [(i, 0) for i in range(len(lines))]
+    for i in range(0, len(pos_lists)):
+        for j in range(i+1, len(pos_lists)):
+            len0 = pos_lists[i].shape[0]
+            len1 = pos_lists[j].shape[0]
+            if len0 < len1:
+                overlap_mask = np.not_equal(pos_lists[i], pos_lists[j][:len0])
+            else:
+                overlap_mask = np.not_equal(pos_lists[i][:len1], pos_lists[j])
+            overlap_mask = np.all(overlap_mask, axis=1)
+            split_index = np.searchsorted(overlap_mask, True)
+            if split_index <= 0:
+                continue
+            parent_indices[j] = (i, split_index)
+            pos_lists[j] = pos_lists[j][split_index:]
+    return parent_indices
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=400)
+    parser.add_argument("--jitter", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    failed = checkTopology()
+    print("{:<10}{:>10}{:>16}{:>16}".format("outlets", "jitter", "pairwise [s]", "trie [s]"))
+    for outlets in OUTLETS:
+        for jitter in (0.0, args.jitter):
+            centerlines, lines, splits = syntheticCenterlines(outlets, args.points, jitter)
+
+            t0 = time.perf_counter()
+            pairwiseOverlap(lines)
+            t_pairwise = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            tree = BranchTree(centerlines, min_branch_len=0, branch_cutoff=0)
+            t_tree = time.perf_counter() - t0
+
+            expected = [(0, 0)] + [(0, split) for split in splits]
+            if tree.parentIndices() != expected:
+                print("Wrong branch tree for {} outlets (jitter {})!".format(outlets, jitter))
+                failed = True
+            print("{:<10}{:>10.0e}{:>16.4f}{:>16.4f}".format(outlets, jitter, t_pairwise, t_tree))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Interaction benchmark of label map painting.
+Replays synthetic brush strokes (2D circle and 3D sphere brush) on a
+120x144x248 label map and compares the per-event cost of
+    full re-upload   ravel(order='F') + numpy_to_vtk + SetScalars of the whole map (former draw())
+    shared buffer    LabelMap with the modified brush box announced by markModified()
+Each event also maps the displayed slice through a lookup table, like the slice view does.
+Exits with code 1 if the VTK scalars of both variants differ after the strokes.
+
+Usage: python scripts/benchmark_brush.py [--events 300] [--radius 15]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.LabelMap import LabelMap
+
+SHAPE = (120, 144, 248)
+
+
+def brushMask(radius, sphere):
+    axis = np.arange(-radius, radius+1)
+    if sphere:
+        X, Y, Z = np.meshgrid(axis, axis, axis, indexing='ij')
+        return X**2 + Y**2 + Z**2 < radius**2
+    X, Y = np.meshgrid(axis, axis, indexing='ij')
+    return X**2 + Y**2 < radius**2
+
+
+def strokes(events, seed=0):
+    # random walk of mouse positions, slice changes every 20 events
+    rng = np.random.default_rng(seed)
+    position = np.array([SHAPE[0]//2, SHAPE[1]//2, SHAPE[2]//2])
+    for i in range(events):
+        position[:2] += rng.integers(-3, 4, size=2)
+        if i % 20 == 19:
+            position[2] += rng.integers(-5, 6)
+        position = np.clip(position, 0, np.array(SHAPE)-1)
+        yield tuple(int(p) for p in position)
+
+
+def paint(data, position, mask, radius, sphere):
+    """
+    Paints the brush into data, returns the modified box (x0, x1, y0, y1, z0, z1).
+    """
+    x, y, z = position
+    x0, x1 = max(x-radius, 0), min(x+radius+1, SHAPE[0])
+    y0, y1 = max(y-radius, 0), min(y+radius+1, SHAPE[1])
+    if sphere:
+        z0, z1 = max(z-radius, 0), min(z+radius+1, SHAPE[2])
+        m = mask[x0-x+radius:x1-x+radius, y0-y+radius:y1-y+radius, z0-z+radius:z1-z+radius]
+    else:
+        z0, z1 = z, z+1
+        m = mask[x0-x+radius:x1-x+radius, y0-y+radius:y1-y+radius, None]
+    data[x0:x1, y0:y1, z0:z1][m] = 2
+    return x0, x1, y0, y1, z0, z1
+
+
+def sliceColorMap(image):
+    lut = vtk.vtkLookupTable()
+    lut.SetNumberOfTableValues(3)
+    lut.SetTableRange(0, 2)
+    lut.Build()
+    color = vtk.vtkImageMapToColors()
+    color.SetLookupTable(lut)
+    color.SetInputData(image)
+    return color
+
+
+def runFullUpload(events, radius, sphere):
+    image = vtk.vtkImageData()
+    image.SetDimensions(SHAPE)
+    data = np.zeros(SHAPE, dtype=np.uint8) # C order, like the former empty segmentation
+    image.GetPointData().SetScalars(numpy_to_vtk(data.ravel(order='F')))
+    color = sliceColorMap(image)
+    mask = brushMask(radius, sphere)
+    times = []
+    for position in strokes(events):
+        t0 = time.perf_counter()
+        paint(data, position, mask, radius, sphere)
+        image.GetPointData().SetScalars(numpy_to_vtk(data.ravel(order='F')))
+        color.UpdateExtent((0, SHAPE[0]-1, 0, SHAPE[1]-1, position[2], position[2]))
+        times.append(time.perf_counter() - t0)
+    return times, vtk_to_numpy(image.GetPointData().GetScalars()).copy()
+
+
+def runSharedBuffer(events, radius, sphere):
+    labels = LabelMap(SHAPE, (1, 1, 1), (0, 0, 0))
+    color = sliceColorMap(labels.image)
+    mask = brushMask(radius, sphere)
+    times = []
+    for position in strokes(events):
+        t0 = time.perf_counter()
+        labels.markModified(*paint(labels.data, position, mask, radius, sphere))
+        color.UpdateExtent((0, SHAPE[0]-1, 0, SHAPE[1]-1, position[2], position[2]))
+        times.append(time.perf_counter() - t0)
+    return times, vtk_to_numpy(labels.image.GetPointData().GetScalars()).copy()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--radius", type=int, default=15)
+    args = parser.parse_args()
+
+    failed = False
+    print("{:<10}{:<18}{:>14}{:>14}".format("brush", "variant", "mean [ms]", "p95 [ms]"))
+    for sphere in (False, True):
+        results = []
+        for name, run in (("full re-upload", runFullUpload), ("shared buffer", runSharedBuffer)):
+            times, scalars = run(args.events, args.radius, sphere)
+            results.append(scalars)
+            times = np.array(times) * 1000
+            print("{:<10}{:<18}{:>14.3f}{:>14.3f}".format(
+                "sphere" if sphere else "circle", name, times.mean(), np.percentile(times, 95)))
+        if not np.array_equal(*results):
+            print("Label maps differ!")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
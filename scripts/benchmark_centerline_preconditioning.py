@@ -0,0 +1,97 @@
+"""
+Timing benchmark and regression check of the surface preconditioning before the
+centerline computation (Pipeline.preconditionSurface).
+Computes the centerlines of a lumen model on the raw surface and on the decimated
+and remeshed surfaces, with the seed points of existing centerlines. Reports vertex
+count, preconditioning and centerline runtime, and the deviation of the centerlines
+from the raw result: symmetric Hausdorff distance and maximal difference of the
+maximum inscribed sphere radius at the closest raw centerline point.
+Exits with code 1 if a deviation exceeds the tolerance (mm).
+
+Usage: python scripts/benchmark_centerline_preconditioning.py <lumen.stl> <centerlines.vtp> [--tolerance 0.5]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.Pipeline import (readSTL, readCenterlines, centerlineEndPoints, createCenterlineFilter,
+                              preconditionSurface)
+
+MODES = [None, 'decimate', 'remesh']
+RADIUS_ARRAY = 'MaximumInscribedSphereRadius'
+
+
+def centerlines(surface, source, targets):
+    source_id = surface.FindPoint(source)
+    target_ids = [surface.FindPoint(p) for p in targets]
+    centerlineFilter = createCenterlineFilter(surface, source_id, target_ids)
+    centerlineFilter.Update()
+    return centerlineFilter.GetOutput()
+
+
+def hausdorffDistance(a, b):
+    hausdorff = vtk.vtkHausdorffDistancePointSetFilter()
+    hausdorff.SetInputData(0, a)
+    hausdorff.SetInputData(1, b)
+    hausdorff.Update()
+    return hausdorff.GetOutput(0).GetFieldData().GetArray("HausdorffDistance").GetValue(0)
+
+
+def radiusDeviation(reference, lines):
+    locator = vtk.vtkStaticPointLocator()
+    locator.SetDataSet(reference)
+    locator.BuildLocator()
+    radius_reference = vtk_to_numpy(reference.GetPointData().GetArray(RADIUS_ARRAY))
+    radius = vtk_to_numpy(lines.GetPointData().GetArray(RADIUS_ARRAY))
+    closest = [locator.FindClosestPoint(lines.GetPoint(i)) for i in range(lines.GetNumberOfPoints())]
+    return float(np.max(np.abs(radius - radius_reference[closest])))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("lumen", help="lumen model (.stl)")
+    parser.add_argument("centerlines", help="centerlines (.vtp), their end points are used as seeds")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    surface = readSTL(args.lumen)
+    source, targets = centerlineEndPoints(readCenterlines(args.centerlines))
+    if source is None or len(targets) == 0:
+        print("No seed points in " + args.centerlines)
+        return 1
+
+    failed = False
+    reference = None
+    print("{:<10}{:>10}{:>16}{:>16}{:>16}{:>16}".format(
+        "surface", "vertices", "precond. [s]", "centerl. [s]", "hausdorff [mm]", "radius [mm]"))
+    for mode in MODES:
+        t0 = time.perf_counter()
+        preconditioned = preconditionSurface(surface, mode)
+        t_precondition = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        lines = centerlines(preconditioned, source, targets)
+        t_centerlines = time.perf_counter() - t0
+
+        if reference is None:
+            reference = lines
+            distance, radius = 0.0, 0.0
+        else:
+            distance = hausdorffDistance(reference, lines)
+            radius = radiusDeviation(reference, lines)
+            if distance > args.tolerance or radius > args.tolerance:
+                print("Centerlines of the {} surface deviate by more than {} mm!".format(mode, args.tolerance))
+                failed = True
+        print("{:<10}{:>10}{:>16.3f}{:>16.3f}{:>16.3f}{:>16.3f}".format(
+            str(mode), preconditioned.GetNumberOfPoints(), t_precondition, t_centerlines, distance, radius))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Regression check and timing benchmark for the small cluster removal of the
+CNN post-processing. Compares the single-pass filter (bincount + lookup table)
+against the former per-component loop on synthetic noisy label maps.
+Exits with code 1 if the results differ.
+
+Usage: python scripts/benchmark_cluster_filter.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from skimage import morphology
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from defaults import MIN_CLUSTER_SIZE
+from modules.Predictor import removeSmallClusters
+
+
+def removeSmallClustersLoop(pred, region_label_img, min_size=MIN_CLUSTER_SIZE):
+    # former implementation, one full volume scan per component
+    region_label_hist, _ = np.histogram(region_label_img, bins=np.max(region_label_img)+1)
+    for i in range(1, len(region_label_hist)):
+        cluster_size = region_label_hist[i]
+        if 0 < cluster_size < min_size:
+            pred[region_label_img==i] = 0
+    return pred
+
+
+def noisyLabelMap(noise, shape=(120, 144, 248), seed=0):
+    """
+    Vessel tree (lumen 2, plaque 1) plus a fraction of randomly labeled voxels
+    that form many small clusters, like a poor prediction.
+    """
+    rng = np.random.default_rng(seed)
+    x, y, z = np.meshgrid(*[np.linspace(-1, 1, s) for s in shape], indexing='ij')
+    pred = np.zeros(shape, dtype=np.uint8)
+    r = np.sqrt((x - 0.2*np.sin(3*z))**2 + y**2)
+    pred[r < 0.35] = 1
+    pred[r < 0.3] = 2
+    pred[np.sqrt((x + 0.5)**2 + (y - 0.5)**2) < 0.1] = 2 # second large component
+    mask = rng.random(shape) < noise
+    pred[mask] = rng.integers(1, 3, size=np.count_nonzero(mask), dtype=np.uint8)
+    return pred
+
+
+def main():
+    failed = False
+    print("{:>8}{:>12}{:>12}{:>12}{:>10}".format("noise", "clusters", "loop [s]", "lut [s]", "speedup"))
+    for noise in (0.001, 0.01, 0.05):
+        pred = noisyLabelMap(noise)
+        region_label_img = morphology.label(pred, connectivity=2)
+        region_label_img[pred==1] = 0
+
+        t0 = time.perf_counter()
+        expected = removeSmallClustersLoop(pred.copy(), region_label_img)
+        t_loop = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        result = removeSmallClusters(pred.copy(), region_label_img)
+        t_lut = time.perf_counter() - t0
+
+        if not np.array_equal(expected, result):
+            print("Results differ for noise {}!".format(noise))
+            failed = True
+        print("{:>8}{:>12}{:>12.3f}{:>12.3f}{:>10.1f}".format(
+            noise, region_label_img.max(), t_loop, t_lut, t_loop / t_lut))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Benchmark for the threaded DICOM series import.
+Reports decoded slices/second for 1, 2, 4 and N (all cores) decoder threads.
+
+Usage: python scripts/benchmark_dicom_import.py <DICOM series directory> [repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.DICOMReader import readSeries, numberOfReaderThreads
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    source_dir = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    paths = [os.path.join(source_dir, f) for f in os.listdir(source_dir)]
+
+    all_cores = numberOfReaderThreads(0)
+    thread_counts = sorted(set([1, 2, 4, all_cores]))
+    reference = None
+    print(f"{len(paths)} slices, {all_cores} cores")
+    print(f"{'threads':>8} {'best (s)':>10} {'slices/s':>10}")
+    for threads in thread_counts:
+        best = float('inf')
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            volume, _ = readSeries(paths, threads)
+            best = min(best, time.perf_counter() - t0)
+        if reference is None:
+            reference = volume
+        elif not (volume == reference).all():
+            print("WARNING: volume differs from single-threaded import")
+        print(f"{threads:>8} {best:>10.3f} {len(paths)/best:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
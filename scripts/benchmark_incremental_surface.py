@@ -0,0 +1,104 @@
+"""
+Timing benchmark and regression check of the brick-wise surface extraction.
+Applies small, medium and large spherical edits to a synthetic vessel label map
+(120x144x248) and compares the incremental update (IncrementalSurface) against a
+full rebuild (Pipeline.extractSurface) of lumen and plaque.
+Exits with code 1 if the stitched surfaces differ from the full extraction
+(number of points/cells, or point positions by more than TOLERANCE).
+
+Usage: python scripts/benchmark_incremental_surface.py [--brick-size 32]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.LabelMap import LabelMap
+from modules.IncrementalSurface import IncrementalSurface
+from modules.Pipeline import extractSurface
+
+SHAPE = (120, 144, 248)
+SPACING = (0.4, 0.4, 0.5)
+ORIGIN = (-20.0, 10.0, 300.0)
+TOLERANCE = 1e-4
+EDITS = [("small", 3), ("medium", 12), ("large", 40)] # sphere radius in voxels
+
+
+def vesselLabelMap():
+    x, y, z = np.meshgrid(*[np.linspace(-1, 1, s) for s in SHAPE], indexing='ij')
+    data = np.zeros(SHAPE, dtype=np.uint8)
+    r = np.sqrt((x - 0.2*np.sin(3*z))**2 + y**2)
+    data[(r < 0.35) & (z > -0.2) & (z < 0.3)] = 1
+    data[r < 0.3] = 2
+    return data
+
+
+def paintSphere(labels, center, radius, value):
+    x0, y0, z0 = [max(c - radius, 0) for c in center]
+    x1, y1, z1 = [min(c + radius + 1, s) for c, s in zip(center, SHAPE)]
+    X, Y, Z = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1), np.arange(z0, z1), indexing='ij')
+    mask = (X - center[0])**2 + (Y - center[1])**2 + (Z - center[2])**2 < radius**2
+    labels.data[x0:x1, y0:y1, z0:z1][mask] = value
+    labels.markModified(x0, x1, y0, y1, z0, z1)
+
+
+def surfacesMatch(a, b):
+    if a.GetNumberOfPoints() != b.GetNumberOfPoints() or a.GetNumberOfCells() != b.GetNumberOfCells():
+        return False
+    if a.GetNumberOfPoints() == 0:
+        return True
+    locator = vtk.vtkStaticPointLocator()
+    locator.SetDataSet(b)
+    locator.BuildLocator()
+    points_a = vtk_to_numpy(a.GetPoints().GetData())
+    points_b = vtk_to_numpy(b.GetPoints().GetData())
+    for p in points_a:
+        if np.linalg.norm(points_b[locator.FindClosestPoint(p)] - p) > TOLERANCE:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--brick-size", type=int, default=32)
+    args = parser.parse_args()
+
+    labels = LabelMap(SHAPE, SPACING, ORIGIN, vesselLabelMap())
+    engine = IncrementalSurface(labels=(2, 1), brick_size=args.brick_size)
+    t0 = time.perf_counter()
+    engine.update(labels.data, SPACING, ORIGIN)
+    print("initial build (all bricks): {:.3f} s".format(time.perf_counter() - t0))
+    labels.takeDirtyExtent()
+
+    failed = False
+    rng = np.random.default_rng(0)
+    print("{:<10}{:>10}{:>14}{:>14}{:>10}".format("edit", "radius", "full [s]", "bricks [s]", "speedup"))
+    for name, radius in EDITS:
+        center = (SHAPE[0]//2 + int(rng.integers(-10, 10)), SHAPE[1]//2, int(rng.integers(60, 190)))
+        paintSphere(labels, center, radius, 2)
+
+        t0 = time.perf_counter()
+        full = [extractSurface(labels.image, label) for label in (2, 1)]
+        t_full = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        engine.invalidate(labels.takeDirtyExtent())
+        incremental = engine.update(labels.data, SPACING, ORIGIN)
+        t_incremental = time.perf_counter() - t0
+
+        for label, a, b in zip(("lumen", "plaque"), full, incremental):
+            if not surfacesMatch(a, b):
+                print("{} surface of the {} edit differs from the full extraction!".format(label, name))
+                failed = True
+        print("{:<10}{:>10}{:>14.3f}{:>14.3f}{:>10.1f}".format(
+            name, radius, t_full, t_incremental, t_full / t_incremental))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Latency benchmark and accuracy guard for the CNN inference backends.
+Runs the 120x144x248 model input through every backend (eager, channels-last,
+TorchScript, ONNX Runtime) and compares the label maps against eager float32 inference.
+Fails (exit code 1) if the Dice score of lumen or plaque drops below MIN_DICE.
+Synthetic volumes are used unless crop volumes (.nrrd) are given.
+
+Int8 quantization is not offered: dynamic quantization in PyTorch only covers
+Linear/RNN layers, and the instance normalization of the UNet is not quantizable.
+
+Usage (from the repository root, weights are read from the working directory):
+    python scripts/benchmark_inference.py [--threads N] [crop volume .nrrd ...]
+"""
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+import numpy as np
+import nrrd
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.Predictor import CarotidSegmentationPredictor, preprocess
+
+MIN_DICE = 0.99
+REPEATS = 3
+
+
+def syntheticCrop(shape=(120, 144, 248), seed=0):
+    # contrast-filled vessel with plaque-like calcification in soft tissue
+    rng = np.random.default_rng(seed)
+    x, y, z = np.meshgrid(*[np.linspace(-1, 1, s) for s in shape], indexing='ij')
+    r = np.sqrt((x - 0.1*np.sin(3*z))**2 + y**2)
+    volume = rng.normal(40, 30, size=shape)
+    volume[r < 0.3] = rng.normal(450, 40, size=np.count_nonzero(r < 0.3))
+    volume[(r > 0.25) & (r < 0.32) & (z > 0.2) & (z < 0.4)] = 900
+    return volume.astype(np.int16)
+
+
+def dice(a, b, label):
+    a = a == label
+    b = b == label
+    total = np.count_nonzero(a) + np.count_nonzero(b)
+    if total == 0:
+        return 1.0
+    return 2 * np.count_nonzero(a & b) / total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("volumes", nargs="*")
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.volumes:
+        volumes = [nrrd.read(path)[0] for path in args.volumes]
+    else:
+        volumes = [syntheticCrop(seed=i) for i in range(2)]
+    batch = np.stack([preprocess(v) for v in volumes])[:1]
+
+    configurations = [
+        ("eager", dict(backend='eager', channels_last=False)),
+        ("eager channels-last", dict(backend='eager', channels_last=True)),
+        ("torchscript", dict(backend='torchscript', channels_last=False)),
+        ("torchscript channels-last", dict(backend='torchscript', channels_last=True)),
+        ("onnx", dict(backend='onnx', channels_last=False)),
+    ]
+
+    reference = None
+    failed = False
+    print("threads: {}".format(args.threads if args.threads > 0 else torch.get_num_threads()))
+    print("{:<28}{:>12}{:>12}{:>12}{:>12}".format("backend", "first [s]", "mean [s]", "dice lumen", "dice plaque"))
+    for name, kwargs in configurations:
+        if kwargs['backend'] == 'onnx' and importlib.util.find_spec("onnxruntime") is None:
+            print("{:<28}not available".format(name))
+            continue
+        predictor = CarotidSegmentationPredictor(threads=args.threads, **kwargs)
+
+        t0 = time.perf_counter()
+        predictor.forward(batch) # includes tracing/export
+        first = time.perf_counter() - t0
+        if predictor.backend != kwargs['backend']:
+            # the onnx backend falls back to eager inference on the first forward pass
+            print("{:<28}not available".format(name))
+            continue
+        times = []
+        for _ in range(REPEATS):
+            t0 = time.perf_counter()
+            predictor.forward(batch)
+            times.append(time.perf_counter() - t0)
+
+        predictions = [predictor.forward(preprocess(v)[None])[0] for v in volumes]
+        if reference is None:
+            reference = predictions
+        dice_lumen = min(dice(p, r, 2) for p, r in zip(predictions, reference))
+        dice_plaque = min(dice(p, r, 1) for p, r in zip(predictions, reference))
+        failed |= dice_lumen < MIN_DICE or dice_plaque < MIN_DICE
+        print("{:<28}{:>12.2f}{:>12.2f}{:>12.4f}{:>12.4f}".format(
+            name, first, np.mean(times), dice_lumen, dice_plaque))
+
+    if failed:
+        print("Dice below {} for at least one backend.".format(MIN_DICE))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Benchmark for the NRRD writer codecs.
+Compares write time, read time and file size of raw, gzip level 1 and gzip level 6
+(single- and multi-threaded) against the former pynrrd default (gzip level 9)
+for a full CTA volume, a crop volume and a segmentation.
+Synthetic data is used unless a full volume .nrrd is given.
+
+Usage: python scripts/benchmark_nrrd_write.py [full volume .nrrd]
+"""
+import os
+import sys
+import time
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import nrrd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.NrrdWriter import writeNrrd, numberOfWriterThreads
+
+
+def syntheticCT(shape, seed=0):
+    # smooth tissue-like structure plus noise, HU range similar to CTA
+    rng = np.random.default_rng(seed)
+    coarse = rng.normal(40, 300, size=[max(2, s//16) for s in shape])
+    for axis, s in enumerate(shape):
+        coarse = np.repeat(coarse, -(-s // coarse.shape[axis]), axis=axis)
+    volume = coarse[:shape[0], :shape[1], :shape[2]] + rng.normal(0, 20, size=shape)
+    return np.asfortranarray(np.clip(volume, -1024, 3071).astype(np.int16))
+
+
+def syntheticSegmentation(shape):
+    x, y, z = np.meshgrid(*[np.linspace(-1, 1, s) for s in shape], indexing='ij')
+    r = np.sqrt(x**2 + y**2)
+    seg = np.zeros(shape, dtype=np.uint8)
+    seg[r < 0.35 + 0.05*np.sin(6*z)] = 1
+    seg[r < 0.25] = 2
+    return np.asfortranarray(seg)
+
+
+def header():
+    h = OrderedDict()
+    h['dimension'] = 3
+    h['space'] = 'left-posterior-superior'
+    h['space directions'] = [[0.5, 0, 0], [0, 0.5, 0], [0, 0, 0.6]]
+    h['kinds'] = ['domain', 'domain', 'domain']
+    h['endian'] = 'little'
+    h['space origin'] = [0.0, 0.0, 0.0]
+    return h
+
+
+def main():
+    if len(sys.argv) > 1:
+        full, _ = nrrd.read(sys.argv[1])
+        full = np.asfortranarray(full)
+    else:
+        full = syntheticCT((512, 512, 600))
+    volumes = [("full volume", full),
+               ("crop volume", syntheticCT((120, 144, 248), seed=1)),
+               ("segmentation", syntheticSegmentation((120, 144, 248)))]
+
+    n = numberOfWriterThreads(0)
+    codecs = [("raw", 'raw', 0, 1),
+              ("gzip1", 'gzip', 1, 1),
+              (f"gzip1 x{n}", 'gzip', 1, n),
+              ("gzip6", 'gzip', 6, 1),
+              (f"gzip6 x{n}", 'gzip', 6, n),
+              ("gzip9 (old)", 'gzip', 9, 1)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.nrrd")
+        for name, data in volumes:
+            print(f"\n{name} {data.shape} {data.dtype}, {data.nbytes/1024**2:.1f} MB")
+            print(f"{'codec':>14} {'write (s)':>10} {'read (s)':>10} {'size (MB)':>10}")
+            for label, encoding, level, threads in codecs:
+                t0 = time.perf_counter()
+                writeNrrd(path, data, header(), encoding, level, threads)
+                t1 = time.perf_counter()
+                read_data, _ = nrrd.read(path)
+                t2 = time.perf_counter()
+                assert np.array_equal(read_data, data), label + ": read back differs"
+                size = os.path.getsize(path) / 1024**2
+                print(f"{label:>14} {t1-t0:>10.3f} {t2-t1:>10.3f} {size:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
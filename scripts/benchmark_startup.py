@@ -0,0 +1,88 @@
+"""
+Import-time profile of the application start.
+Imports CarotidAnalyzer.py in a fresh interpreter with `python -X importtime`
+and lists the slowest top-level packages (sum of the self times of their modules). Also reports
+whether torch, MONAI or scikit-image were imported, which should not happen
+before the segmentation CNN is used.
+
+Usage (from the repository root):
+    python scripts/benchmark_startup.py [--top 15] [--window]
+        --window  additionally time the construction of the main window (offscreen)
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED_PACKAGES = ["torch", "monai", "skimage"]
+
+WINDOW_SNIPPET = """
+import time
+t0 = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication([])
+import CarotidAnalyzer
+t1 = time.perf_counter()
+win = CarotidAnalyzer.CarotidAnalyzer()
+t2 = time.perf_counter()
+print("{:.3f} {:.3f}".format(t1 - t0, t2 - t1))
+win.close()
+"""
+
+
+def importProfile():
+    """
+    Returns {top-level package: import time [s]} of importing CarotidAnalyzer.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import CarotidAnalyzer"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit(1)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        times[package] = times.get(package, 0) + int(self_time) / 1e6
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--window", action="store_true")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    times = importProfile()
+    print("import CarotidAnalyzer: {:.2f} s (wall, incl. interpreter start)".format(time.perf_counter() - t0))
+    print("{:<32}{:>12}".format("package", "import [s]"))
+    for name, t in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+        print("{:<32}{:>12.3f}".format(name, t))
+
+    # -X importtime lists nested imports too, check all of them
+    loaded = subprocess.run([sys.executable, "-c",
+                             "import sys, CarotidAnalyzer; print(' '.join(sys.modules))"],
+                            cwd=ROOT, capture_output=True, text=True).stdout.split()
+    deferred = [p for p in DEFERRED_PACKAGES if p in loaded]
+    print("deferred packages imported at start: " + (", ".join(deferred) if deferred else "none"))
+
+    if args.window:
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        result = subprocess.run([sys.executable, "-c", WINDOW_SNIPPET], cwd=ROOT, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr[-2000:])
+            return 1
+        t_import, t_window = result.stdout.split()[-2:]
+        print("window construction: {} s (after imports of {} s)".format(t_window, t_import))
+    return 1 if deferred else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
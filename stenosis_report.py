@@ -0,0 +1,218 @@
+"""
+Headless stenosis report of all cases with centerlines in a working directory.
+Each side is split into branches like in the stenosis classifier; stenoses are
+detected automatically (diameter below STENOSIS_REPORT_THRESHOLD of the median
+diameter of the branch segment) and graded after NASCET. Cases are analyzed in a
+process pool, results are streamed into one table with a row per branch,
+including its diameter profile (arc length and diameter lists).
+
+Output format by file extension: .csv (profiles as space separated values) or
+.parquet (list columns, needs pyarrow).
+
+Usage:
+    python stenosis_report.py <working dir> <output.csv|.parquet> [--cases case01 case02] [--workers 4] [--threshold 0.8]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from defaults import *
+from modules.CaseIndex import CaseIndex
+
+SIDES = ["left", "right"]
+COLUMNS = [
+    "patient_ID", "side", "branch", "parent", "parent_index",
+    "length", "min_diameter", "min_diameter_arc", "max_diameter",
+    "stenosis_count", "stenosis_degree", "stenosis_min_diameter", "stenosis_ref_diameter",
+    "stenosis_length", "stenosis_arc", "manual_stenosis_degree",
+    "profile_arc", "profile_diameter",
+]
+PROFILE_COLUMNS = ("profile_arc", "profile_diameter")
+ROW_GROUP_SIZE = 1024 # rows per written parquet row group
+
+
+def analyzeSide(patient_dict, side, threshold):
+    """
+    Returns the report rows (dicts) of the branches of one side.
+    """
+    import numpy as np
+    import vtk
+    from modules.StenosisAnalysis import centerlineBranches, branchSegments, detectStenoses
+
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(patient_dict['centerlines_' + side])
+    reader.Update()
+    pos_lists, arc_lists, radii_lists, parent_indices = centerlineBranches(reader.GetOutput())
+
+    # worst internal carotid stenosis graded by hand in the GUI (first branch)
+    manual_degree = None
+    meta_path = os.path.join(patient_dict['base_path'], patient_dict['patient_ID'] + "_" + side + "_meta.txt")
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, 'r') as f:
+                manual_degree = float(json.load(f)["stenosis_degree"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    rows = []
+    for i in range(len(arc_lists)):
+        arc, rad = arc_lists[i], radii_lists[i]
+        if len(arc) == 0:
+            continue
+        stenoses = detectStenoses(arc, rad, branchSegments(i, arc_lists, parent_indices), threshold)
+        worst = max(stenoses, key=lambda s: s["degree"]) if stenoses else None
+        min_idx = int(np.argmin(rad))
+        rows.append({
+            "patient_ID": patient_dict['patient_ID'],
+            "side": side,
+            "branch": i,
+            "parent": parent_indices[i][0],
+            "parent_index": int(parent_indices[i][1]),
+            "length": float(arc[-1] - arc[0]),
+            "min_diameter": 2.0 * float(rad[min_idx]),
+            "min_diameter_arc": float(arc[min_idx]),
+            "max_diameter": 2.0 * float(np.max(rad)),
+            "stenosis_count": len(stenoses),
+            "stenosis_degree": worst["degree"] if worst else 0.0,
+            "stenosis_min_diameter": worst["min_diameter"] if worst else None,
+            "stenosis_ref_diameter": worst["ref_diameter"] if worst else None,
+            "stenosis_length": worst["length"] if worst else 0.0,
+            "stenosis_arc": float(arc[worst["min_index"]]) if worst else None,
+            "manual_stenosis_degree": manual_degree if i == 0 else None,
+            "profile_arc": arc.astype(float).tolist(),
+            "profile_diameter": (2.0 * rad).astype(float).tolist(),
+        })
+    return rows
+
+
+def analyzeCase(patient_dict, threshold):
+    """
+    Analyzes both sides of a case. Executed in a worker process.
+    Returns (rows, errors).
+    """
+    rows, errors = [], []
+    for side in SIDES:
+        if not patient_dict['centerlines_' + side]:
+            continue
+        try:
+            rows += analyzeSide(patient_dict, side, threshold)
+        except Exception:
+            errors.append(side + " failed\n" + traceback.format_exc())
+    return rows, errors
+
+
+class CSVReportWriter():
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+        self.writer.writeheader()
+
+
+    def write(self, rows):
+        for row in rows:
+            row = dict(row)
+            for column in PROFILE_COLUMNS:
+                row[column] = " ".join("{:.3f}".format(v) for v in row[column])
+            self.writer.writerow(row)
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
+
+
+
+class ParquetReportWriter():
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        types = {"patient_ID": pa.string(), "side": pa.string(),
+                 "branch": pa.int32(), "parent": pa.int32(), "parent_index": pa.int32(),
+                 "stenosis_count": pa.int32()}
+        self.schema = pa.schema([(c, pa.list_(pa.float64()) if c in PROFILE_COLUMNS else types.get(c, pa.float64()))
+                                 for c in COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+
+
+    def write(self, rows):
+        self.rows += rows
+        if len(self.rows) >= ROW_GROUP_SIZE:
+            self.__flush()
+
+
+    def close(self):
+        self.__flush()
+        self.writer.close()
+
+
+    def __flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+
+
+def reportWriter(path):
+    if path.endswith(".parquet"):
+        try:
+            return ParquetReportWriter(path)
+        except ImportError:
+            path = path[:-len(".parquet")] + ".csv"
+            print("pyarrow is not installed, writing " + path + " instead.")
+    return CSVReportWriter(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stenosis report of all cases with centerlines in a working directory.")
+    parser.add_argument("working_dir", help="directory containing the case* folders")
+    parser.add_argument("output", help="report file (.csv or .parquet)")
+    parser.add_argument("--cases", nargs="+", help="patient IDs to analyze (default: all cases)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="number of worker processes (0 -> all cores)")
+    parser.add_argument("--threshold", type=float, default=STENOSIS_REPORT_THRESHOLD,
+                        help="stenosis threshold as fraction of the median segment diameter")
+    args = parser.parse_args(argv)
+
+    case_index = CaseIndex(args.working_dir)
+    case_index.scan()
+    patient_IDs = args.cases if args.cases else list(case_index.cases.keys())
+    patient_dicts = [case_index.cases[pID] for pID in patient_IDs if pID in case_index.cases and
+                     any(case_index.cases[pID]['centerlines_' + side] for side in SIDES)]
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    t0 = time.perf_counter()
+    failed = 0
+    nr_rows = 0
+    writer = reportWriter(args.output)
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {executor.submit(analyzeCase, patient_dict, args.threshold): patient_dict['patient_ID']
+                       for patient_dict in patient_dicts}
+            for future in as_completed(futures):
+                pID = futures[future]
+                try:
+                    rows, errors = future.result()
+                except Exception as e: # worker died
+                    rows, errors = [], ["failed: " + str(e)]
+                writer.write(rows)
+                nr_rows += len(rows)
+                for error in errors:
+                    print("{}: {}".format(pID, error))
+                failed += len(errors)
+    finally:
+        writer.close()
+    print("Analyzed {} cases ({} branches) in {:.1f} s, {} sides failed.".format(
+        len(patient_dicts), nr_rows, time.perf_counter() - t0, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())